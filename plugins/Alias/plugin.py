@@ -110,28 +110,41 @@ def makeNewAlias(name, alias):
         raise AliasError, 'Can\'t mix $* and optional args (@1, etc.)'
     if original.count('$*') > 1:
         raise AliasError, 'There can be only one $* in an alias.'
-    testTokens = callbacks.tokenize(original)
-    if testTokens and isinstance(testTokens[0], list):
+    # The alias is only tokenized once; $nick, $channel, and the arguments
+    # are substituted into (a copy of) these tokens each time it's called.
+    originalTokens = callbacks.tokenize(original, frozen=True)
+    if originalTokens and isinstance(originalTokens[0], tuple):
         raise AliasError, 'Commands may not be the result of nesting.'
     def f(self, irc, msg, args):
-        alias = original.replace('$nick', msg.nick)
+        channel = None
         if '$channel' in original:
             channel = getChannel(msg, args)
-            alias = alias.replace('$channel', channel)
-        tokens = callbacks.tokenize(alias)
         if biggestDollar or biggestAt:
             args = getArgs(args, required=biggestDollar, optional=biggestAt,
                             wildcard=wildcard)
         def regexpReplace(m):
             idx = int(m.group(1))
             return args[idx-1]
+        def firstReplace(s):
+            s = s.replace('$nick', msg.nick)
+            if channel is not None:
+                s = s.replace('$channel', channel)
+            return dollarRe.sub(regexpReplace, s)
+        def copyReplace(tokens, replacer):
+            L = []
+            for token in tokens:
+                if isinstance(token, tuple):
+                    L.append(copyReplace(token, replacer))
+                else:
+                    L.append(replacer(token))
+            return L
         def replace(tokens, replacer):
             for (i, token) in enumerate(tokens):
                 if isinstance(token, list):
                     replace(token, replacer)
                 else:
                     tokens[i] = replacer(token)
-        replace(tokens, lambda s: dollarRe.sub(regexpReplace, s))
+        tokens = copyReplace(originalTokens, firstReplace)
         if biggestAt:
             assert not wildcard
             args = args[biggestDollar:]
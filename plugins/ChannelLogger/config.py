@@ -45,7 +45,12 @@ conf.registerChannelValue(ChannelLogger, 'enable',
 conf.registerGlobalValue(ChannelLogger, 'flushImmediately',
     registry.Boolean(False, """Determines whether channel logfiles will be
     flushed anytime they're written to, rather than being buffered by the
-    operating system."""))
+    bot and the operating system."""))
+conf.registerGlobalValue(ChannelLogger, 'flushInterval',
+    registry.PositiveInteger(1, """Determines the most seconds that what's
+    written to the channel logfiles may be buffered by the bot before it's
+    flushed, unless supybot.plugins.ChannelLogger.flushImmediately is on.
+    Buffering cuts down on the writes the bot makes to busy logs."""))
 conf.registerChannelValue(ChannelLogger, 'stripFormatting',
     registry.Boolean(True, """Determines whether formatting characters (such
     as bolding, color, etc.) are removed when writing the logs to disk."""))
@@ -69,6 +74,17 @@ conf.registerChannelValue(ChannelLogger, 'filenameTimestamp',
     for your logs to be rotated, you'll also have to enable
     supybot.plugins.ChannelLogger.rotateLogs."""))
 
+conf.registerChannelValue(ChannelLogger, 'index',
+    registry.Boolean(False, """Determines whether the bot will keep an index
+    of the channel's logs, by word, nick, and time, so they can be searched
+    with the search command.  The logfiles themselves are unchanged."""))
+conf.registerGlobalValue(ChannelLogger.index, 'maximumResults',
+    registry.PositiveInteger(5, """Determines the most lines the search
+    command will reply with."""))
+conf.registerGlobalValue(ChannelLogger.index, 'timeout',
+    registry.PositiveFloat(2.0, """Determines how many seconds the search
+    command may spend looking through the index before it gives up."""))
+
 conf.registerGlobalValue(ChannelLogger, 'directories',
     registry.Boolean(True, """Determines whether the bot will partition its
     channel logs into separate directories based on different criteria."""))
@@ -29,18 +29,29 @@
 ###
 
 import os
+import re
 import time
+import string
 from cStringIO import StringIO
 
 import supybot.conf as conf
+import supybot.utils as utils
 import supybot.world as world
+from supybot.commands import *
 import supybot.irclib as irclib
 import supybot.ircmsgs as ircmsgs
 import supybot.ircutils as ircutils
 import supybot.registry as registry
+import supybot.schedule as schedule
 import supybot.callbacks as callbacks
 
+try:
+    import sqlite3
+except ImportError:
+    from pysqlite2 import dbapi2 as sqlite3 # for python2.4
+
 class FakeLog(object):
+    filename = None
     def flush(self):
         return
     def close(self):
@@ -48,6 +59,200 @@ class FakeLog(object):
     def write(self, s):
         return
 
+class Log(object):
+    """A logfile that keeps what's written to it in memory until it's flushed.
+    name is the name getLogName gave it; offset is where the next thing written
+    to it will end up in the file, and fileId is its id in the index, if it's
+    indexed."""
+    maximumBuffered = 65536
+    def __init__(self, filename, name):
+        self.fd = file(filename, 'a')
+        self.filename = filename
+        self.name = name
+        self.offset = os.path.getsize(filename)
+        self.fileId = None
+        self.buffer = []
+        self.buffered = 0
+
+    def write(self, s):
+        self.buffer.append(s)
+        self.buffered += len(s)
+        self.offset += len(s)
+        if self.buffered > self.maximumBuffered:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.fd.write(''.join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+        self.fd.flush()
+
+    def close(self):
+        self.flush()
+        self.fd.close()
+
+_wordRe = re.compile('[^\\s%s]+' % re.escape(string.punctuation))
+def words(s):
+    """Returns the set of words in s, lowercased."""
+    return set(_wordRe.findall(s.lower()))
+
+_nickRe = re.compile(r'^(?:\*\*\* (\S+)|<(\S+?)> |\* (\S+)|-(\S+?)- )')
+def lineNick(line):
+    """Returns the nick a line of the log is from (or about), or None."""
+    m = _nickRe.match(line)
+    if m is None:
+        return None
+    for nick in m.groups():
+        if nick is not None:
+            return ircutils.toLower(nick)
+
+class SearchTimeout(Exception):
+    pass
+
+class LogIndex(object):
+    """An index of the lines in the logfiles, by their words, their nick, and
+    the time they were logged, giving the file and offset each is at.  Lines
+    are added in memory, and written to the database when it's committed."""
+    def __init__(self, filename):
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        self.db.text_factory = str
+        self.fileIds = {}
+        self.pending = []
+        cursor = self.db.cursor()
+        cursor.execute("""SELECT name FROM sqlite_master
+                          WHERE type='table' AND name='files'""")
+        if not cursor.fetchall():
+            cursor.execute("""CREATE TABLE files (
+                              id INTEGER PRIMARY KEY,
+                              network TEXT,
+                              channel TEXT,
+                              filename TEXT UNIQUE
+                              )""")
+            cursor.execute("""CREATE TABLE lines (
+                              id INTEGER PRIMARY KEY,
+                              file INTEGER,
+                              offset INTEGER,
+                              at INTEGER,
+                              nick TEXT
+                              )""")
+            cursor.execute("""CREATE INDEX lines_nick ON lines (nick)""")
+            cursor.execute("""CREATE INDEX lines_at ON lines (at)""")
+            cursor.execute("""CREATE TABLE words (
+                              word TEXT,
+                              line INTEGER
+                              )""")
+            cursor.execute("""CREATE INDEX words_word ON words (word, line)""")
+            self.db.commit()
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+    def fileId(self, network, channel, filename):
+        """Returns the id of the given logfile, adding it if it's new."""
+        try:
+            return self.fileIds[filename]
+        except KeyError:
+            cursor = self.db.cursor()
+            cursor.execute("""SELECT id FROM files WHERE filename=?""",
+                           (filename,))
+            results = cursor.fetchall()
+            if results:
+                id = results[0][0]
+            else:
+                cursor.execute("""INSERT INTO files VALUES (NULL, ?, ?, ?)""",
+                               (network, ircutils.toLower(channel), filename))
+                id = cursor.lastrowid
+                self.db.commit()
+            self.fileIds[filename] = id
+            return id
+
+    def add(self, fileId, offset, at, line):
+        self.pending.append((fileId, offset, at, line))
+
+    def commit(self):
+        if not self.pending:
+            return
+        cursor = self.db.cursor()
+        for (fileId, offset, at, line) in self.pending:
+            cursor.execute("""INSERT INTO lines VALUES (NULL, ?, ?, ?, ?)""",
+                           (fileId, offset, at, lineNick(line)))
+            id = cursor.lastrowid
+            cursor.executemany("""INSERT INTO words VALUES (?, ?)""",
+                               [(word, id) for word in words(line)])
+        self.db.commit()
+        self.pending = []
+
+    def search(self, network, channel, terms, nick=None, since=None,
+               until=None, limit=None, timeout=None):
+        """Returns (filename, offset) pairs for the lines logged in channel
+        with all of terms in them (from nick, if it's given; between the times
+        since and until, if they're given), newest first.  Raises
+        SearchTimeout if the search takes longer than timeout seconds."""
+        sql = ["""SELECT files.filename, lines.offset FROM lines, files
+                  WHERE lines.file=files.id AND files.network=?
+                  AND files.channel=?"""]
+        args = [network, ircutils.toLower(channel)]
+        if terms:
+            sql.append("""AND lines.id IN (%s)""" %
+                       ' INTERSECT '.join(['SELECT line FROM words '
+                                           'WHERE word=?'] * len(terms)))
+            args.extend(terms)
+        if nick is not None:
+            sql.append("""AND lines.nick=?""")
+            args.append(ircutils.toLower(nick))
+        if since is not None:
+            sql.append("""AND lines.at >= ?""")
+            args.append(since)
+        if until is not None:
+            sql.append("""AND lines.at < ?""")
+            args.append(until)
+        sql.append("""ORDER BY lines.id DESC""")
+        if limit is not None:
+            sql.append("""LIMIT ?""")
+            args.append(limit)
+        if timeout is not None:
+            deadline = time.time() + timeout
+            def progress():
+                return time.time() > deadline
+            self.db.set_progress_handler(progress, 1000)
+        try:
+            cursor = self.db.cursor()
+            try:
+                cursor.execute(' '.join(sql), args)
+                return cursor.fetchall()
+            except sqlite3.OperationalError, e:
+                if timeout is not None and time.time() > deadline:
+                    raise SearchTimeout
+                raise
+        finally:
+            if timeout is not None:
+                self.db.set_progress_handler(None, 1000)
+
+_secondsRe = re.compile(r'%[-_0^#]*[ScsXTr+]')
+_minutesRe = re.compile(r'%[-_0^#]*[MR]')
+_hoursRe = re.compile(r'%[-_0^#]*[HIklp]')
+def nextRotation(format, now=None):
+    """Returns the next time at which time.strftime(format) might change,
+    judging by the smallest unit of time format uses (days, if it uses none
+    smaller)."""
+    if now is None:
+        now = time.time()
+    (year, month, day, hour, minute, second) = time.localtime(now)[:6]
+    format = format.replace('%%', '')
+    if _secondsRe.search(format):
+        second += 1
+    elif _minutesRe.search(format):
+        (minute, second) = (minute + 1, 0)
+    elif _hoursRe.search(format):
+        (hour, minute, second) = (hour + 1, 0, 0)
+    else:
+        (day, hour, minute, second) = (day + 1, 0, 0, 0)
+    # mktime normalizes the overflowing field for us.
+    return time.mktime((year, month, day, hour, minute, second, 0, 0, -1))
+
 class ChannelLogger(callbacks.Plugin):
     noIgnore = True
     def __init__(self, irc):
@@ -56,13 +261,47 @@ class ChannelLogger(callbacks.Plugin):
         self.lastMsgs = {}
         self.lastStates = {}
         self.logs = {}
+        self.configs = {}
+        self.configsGeneration = None
+        self.flushScheduled = False
+        self.rotateAt = None
+        self.index = None
         self.flusher = self.flush
         world.flushers.append(self.flusher)
 
     def die(self):
         for log in self._logs():
             log.close()
+        if self.index is not None:
+            self.index.close()
         world.flushers = [x for x in world.flushers if x is not self.flusher]
+        if self.flushScheduled:
+            schedule.removeEvent(self.flushEvent)
+        if self.rotateAt is not None:
+            schedule.removeEvent(self.rotateEvent)
+
+    _channelValues = ['enable', 'timestamp', 'stripFormatting', 'rotateLogs',
+                      'filenameTimestamp', 'noLogPrefix', 'index']
+    def _config(self, channel):
+        """Returns a dict of the channel's settings (and the global ones
+        doLog needs), looking them up only when the registry has changed
+        since we last did."""
+        generation = registry.generation()
+        if generation != self.configsGeneration:
+            self.configs.clear()
+            self.configsGeneration = generation
+        key = ircutils.toLower(channel)
+        try:
+            return self.configs[key]
+        except KeyError:
+            config = {}
+            for name in self._channelValues:
+                config[name] = self.registryValue(name, channel)
+            config['flushImmediately'] = self.registryValue('flushImmediately')
+            config['flushInterval'] = self.registryValue('flushInterval')
+            config['timestampFormat'] = conf.supybot.log.timestampFormat()
+            self.configs[key] = config
+            return config
 
     def __call__(self, irc, msg):
         try:
@@ -82,6 +321,7 @@ class ChannelLogger(callbacks.Plugin):
         for log in self._logs():
             log.close()
         self.logs.clear()
+        self.configs.clear()
         self.lastMsgs.clear()
         self.lastStates.clear()
 
@@ -98,13 +338,34 @@ class ChannelLogger(callbacks.Plugin):
             except ValueError, e:
                 if e.args[0] != 'I/O operation on a closed file':
                     self.log.exception('Odd exception:')
+        if self.index is not None:
+            self.index.commit()
+
+    flushEvent = 'ChannelLogger flush'
+    def _flushBuffers(self):
+        self.flushScheduled = False
+        self.flushBuffers()
+
+    def flushBuffers(self):
+        for log in self._logs():
+            log.flush()
+        # The index is committed after the logs are flushed, so it never
+        # points past the end of a logfile.
+        if self.index is not None:
+            self.index.commit()
+
+    def getIndex(self):
+        if self.index is None:
+            filename = conf.supybot.directories.data.dirize('ChannelLogger.db')
+            self.index = LogIndex(filename)
+        return self.index
 
     def logNameTimestamp(self, channel):
-        format = self.registryValue('filenameTimestamp', channel)
+        format = self._config(channel)['filenameTimestamp']
         return time.strftime(format)
 
     def getLogName(self, channel):
-        if self.registryValue('rotateLogs', channel):
+        if self._config(channel)['rotateLogs']:
             return '%s.%s.log' % (channel, self.logNameTimestamp(channel))
         else:
             return '%s.log' % channel
@@ -127,14 +388,43 @@ class ChannelLogger(callbacks.Plugin):
     def checkLogNames(self):
         for (irc, logs) in self.logs.items():
             for (channel, log) in logs.items():
-                if self.registryValue('rotateLogs', channel):
+                if self._config(channel)['rotateLogs']:
                     name = self.getLogName(channel)
                     if name != log.name:
                         log.close()
                         del logs[channel]
 
-    def getLog(self, irc, channel):
+    rotateEvent = 'ChannelLogger rotation'
+    def _rotate(self):
+        self.rotateAt = None
+        self.rotate()
+
+    def rotate(self):
+        """Closes the logs whose names have changed, and schedules the next
+        time that should be checked."""
+        if self.rotateAt is not None:
+            schedule.removeEvent(self.rotateEvent)
+            self.rotateAt = None
         self.checkLogNames()
+        for logs in self.logs.itervalues():
+            for channel in logs:
+                self._scheduleRotation(channel)
+
+    def _scheduleRotation(self, channel):
+        """Makes sure logNames will be checked when channel's log might need
+        to be rotated."""
+        config = self._config(channel)
+        if not config['rotateLogs']:
+            return
+        when = nextRotation(config['filenameTimestamp'])
+        if self.rotateAt is None:
+            schedule.addEvent(self._rotate, when, self.rotateEvent)
+            self.rotateAt = when
+        elif when < self.rotateAt:
+            schedule.rescheduleEvent(self.rotateEvent, when)
+            self.rotateAt = when
+
+    def getLog(self, irc, channel):
         try:
             logs = self.logs[irc]
         except KeyError:
@@ -146,15 +436,17 @@ class ChannelLogger(callbacks.Plugin):
             try:
                 name = self.getLogName(channel)
                 logDir = self.getLogDir(irc, channel)
-                log = file(os.path.join(logDir, name), 'a')
+                log = Log(os.path.join(logDir, name), name)
                 logs[channel] = log
+                self._scheduleRotation(channel)
                 return log
             except IOError:
                 self.log.exception('Error opening log:')
                 return FakeLog()
 
-    def timestamp(self, log):
-        format = conf.supybot.log.timestampFormat()
+    def timestamp(self, log, format=None):
+        if format is None:
+            format = conf.supybot.log.timestampFormat()
         if format:
             log.write(time.strftime(format))
             log.write('  ')
@@ -163,24 +455,40 @@ class ChannelLogger(callbacks.Plugin):
         return ircutils.toLower(channel)
 
     def doLog(self, irc, channel, s, *args):
-        if not self.registryValue('enable', channel):
+        if self.logs and registry.generation() != self.configsGeneration:
+            # Our settings have changed, and so might have the names of the
+            # logs, or when they'll next change.
+            self.rotate()
+        config = self._config(channel)
+        if not config['enable']:
             return
         s = format(s, *args)
         channel = self.normalizeChannel(irc, channel)
         log = self.getLog(irc, channel)
-        if self.registryValue('timestamp', channel):
-            self.timestamp(log)
-        if self.registryValue('stripFormatting', channel):
+        offset = getattr(log, 'offset', None)
+        if config['timestamp']:
+            self.timestamp(log, config['timestampFormat'])
+        if config['stripFormatting']:
             s = ircutils.stripFormatting(s)
         log.write(s)
-        if self.registryValue('flushImmediately'):
+        if config['index'] and log.filename is not None:
+            index = self.getIndex()
+            if log.fileId is None:
+                log.fileId = index.fileId(irc.network, channel, log.filename)
+            index.add(log.fileId, offset, int(time.time()), s)
+        if config['flushImmediately']:
             log.flush()
+        if not self.flushScheduled and \
+           (config['index'] or not config['flushImmediately']):
+            when = time.time() + config['flushInterval']
+            schedule.addEvent(self._flushBuffers, when, self.flushEvent)
+            self.flushScheduled = True
 
     def doPrivmsg(self, irc, msg):
         (recipients, text) = msg.args
         for channel in recipients.split(','):
             if irc.isChannel(channel):
-                noLogPrefix = self.registryValue('noLogPrefix', channel)
+                noLogPrefix = self._config(channel)['noLogPrefix']
                 if noLogPrefix and text.startswith(noLogPrefix):
                     text = '-= THIS MESSAGE NOT LOGGED =-'
                 nick = msg.nick or irc.nick
@@ -261,6 +569,64 @@ class ChannelLogger(callbacks.Plugin):
                            '*** %s <%s> has quit IRC%s\n',
                            msg.nick, msg.prefix, reason)
 
+    def search(self, irc, msg, args, channel, optlist, text):
+        """[<channel>] [--nick <nick>] [--{since,until} <seconds>] [<words>]
+
+        Returns the latest lines logged in <channel> with all of <words> in
+        them.  If --nick is given, only lines from <nick> are returned; --since
+        and --until limit the lines to those logged since (and until) that
+        many seconds ago.  <channel> is only necessary if the message isn't
+        sent in the channel itself, and the channel's logs must be indexed
+        (see supybot.plugins.ChannelLogger.index).
+        """
+        if msg.nick not in irc.state.channels[channel].users:
+            irc.error(format('You must be in %s to use this command.',
+                             channel), Raise=True)
+        if not self.registryValue('index', channel):
+            irc.error(format('%s\'s logs aren\'t indexed.', channel),
+                      Raise=True)
+        (nick, since, until) = (None, None, None)
+        now = int(time.time())
+        for (option, arg) in optlist:
+            if option == 'nick':
+                nick = arg
+            elif option == 'since':
+                since = now - arg
+            elif option == 'until':
+                until = now - arg
+        terms = list(words(text))
+        if not terms and nick is None:
+            raise callbacks.ArgumentError
+        self.flushBuffers()
+        try:
+            results = self.getIndex().search(irc.network, channel, terms,
+                          nick=nick, since=since, until=until,
+                          limit=self.registryValue('index.maximumResults'),
+                          timeout=self.registryValue('index.timeout'))
+        except SearchTimeout:
+            irc.error('That search took too long; try being more specific.',
+                      Raise=True)
+        L = []
+        for (filename, offset) in results:
+            try:
+                fd = file(filename)
+                try:
+                    fd.seek(offset)
+                    L.append(fd.readline().rstrip('\r\n'))
+                finally:
+                    fd.close()
+            except EnvironmentError, e:
+                self.log.warning('Couldn\'t read %s: %s', filename, e)
+        if not L:
+            irc.reply('No lines matched that search.')
+        else:
+            irc.replies(L, joiner=' | ')
+    search = wrap(search, ['inChannel',
+                           getopts({'nick': 'something',
+                                    'since': 'nonNegativeInt',
+                                    'until': 'nonNegativeInt'}),
+                           additional('text', '')])
+
     def outFilter(self, irc, msg):
         # Gotta catch my own messages *somehow* :)
         # Let's try this little trick...
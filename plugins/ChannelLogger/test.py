@@ -29,8 +29,149 @@
 
 from supybot.test import *
 
-class ChannelLoggerTestCase(PluginTestCase):
+import supybot.schedule as schedule
+
+class ChannelLoggerTestCase(ChannelPluginTestCase):
     plugins = ('ChannelLogger',)
+    def setUp(self):
+        ChannelPluginTestCase.setUp(self)
+        self.cb = self.irc.getCallback('ChannelLogger')
+
+    def contents(self):
+        cb = self.cb
+        filename = os.path.join(cb.getLogDir(self.irc, self.channel),
+                                cb.getLogName(self.channel))
+        if not os.path.exists(filename):
+            return ''
+        fd = file(filename)
+        try:
+            return fd.read()
+        finally:
+            fd.close()
+
+    def say(self, s):
+        self.irc.feedMsg(ircmsgs.privmsg(self.channel, s, prefix=self.prefix))
+
+    def runEvent(self, name):
+        """Runs the named event now, as schedule.run would once it's due, and
+        returns the time it was scheduled for."""
+        when = schedule.schedule.events[name][1][0]
+        schedule.removeEvent(name)()
+        return when
+
+    def testNextRotation(self):
+        nextRotation = sys.modules[self.cb.__module__].nextRotation
+        now = time.mktime((2009, 3, 14, 15, 9, 26, 0, 0, -1))
+        def at(*args):
+            return time.mktime(args + (0, 0, -1))
+        self.assertEqual(nextRotation('%Y-%m-%d', now),
+                         at(2009, 3, 15, 0, 0, 0))
+        self.assertEqual(nextRotation('%%H-%d', now), at(2009, 3, 15, 0, 0, 0))
+        self.assertEqual(nextRotation('%d.%H', now), at(2009, 3, 14, 16, 0, 0))
+        self.assertEqual(nextRotation('%H%M', now), at(2009, 3, 14, 15, 10, 0))
+        self.assertEqual(nextRotation('%s', now), now + 1)
+
+    def testBuffersWrites(self):
+        interval = conf.supybot.plugins.ChannelLogger.flushInterval
+        original = interval()
+        try:
+            interval.setValue(60)
+            # Joining the channel already scheduled a flush.
+            if self.cb.flushScheduled:
+                self.runEvent(self.cb.flushEvent)
+            # The log isn't cleaned between runs, so earlier runs' lines
+            # mustn't look like this one's.
+            start = time.time()
+            s = 'buffered at %s' % start
+            self.say(s)
+            self.failIf(s in self.contents())
+            when = self.runEvent(self.cb.flushEvent)
+            self.failUnless(start + 60 <= when <= time.time() + 60)
+            self.failUnless(s in self.contents())
+            self.failIf(self.cb.flushScheduled)
+        finally:
+            interval.setValue(original)
+
+    def testFlushImmediately(self):
+        flushImmediately = conf.supybot.plugins.ChannelLogger.flushImmediately
+        original = flushImmediately()
+        try:
+            flushImmediately.setValue(True)
+            s = 'flushed at %s' % time.time()
+            self.say(s)
+            self.failUnless(s in self.contents())
+        finally:
+            flushImmediately.setValue(original)
+
+    def testRotatesOnSchedule(self):
+        rotateLogs = conf.supybot.plugins.ChannelLogger.rotateLogs
+        filenameTimestamp = \
+            conf.supybot.plugins.ChannelLogger.filenameTimestamp
+        originals = (rotateLogs(), filenameTimestamp())
+        nextRotation = sys.modules[self.cb.__module__].nextRotation
+        try:
+            rotateLogs.setValue(True)
+            filenameTimestamp.setValue('%Y-%m-%d')
+            s = 'rotated at %s' % time.time()
+            self.say(s)
+            name = self.cb.getLog(self.irc, self.channel).name
+            self.assertEqual(self.cb.rotateAt, nextRotation('%Y-%m-%d'))
+            # Rather than wait for midnight, change the name the log should
+            # have, and rotate when the scheduler would have.
+            filenameTimestamp.setValue('rotated')
+            when = self.runEvent(self.cb.rotateEvent)
+            self.assertEqual(when, nextRotation('%Y-%m-%d'))
+            self.failIf(self.channel in self.cb.logs[self.irc])
+            self.assertEqual(self.cb.rotateAt, None)
+            self.failIfEqual(self.cb.getLogName(self.channel), name)
+            filename = os.path.join(self.cb.getLogDir(self.irc, self.channel),
+                                    name)
+            self.failUnless(s in file(filename).read())
+        finally:
+            rotateLogs.setValue(originals[0])
+            filenameTimestamp.setValue(originals[1])
+
+    def testSearch(self):
+        index = conf.supybot.plugins.ChannelLogger.index
+        original = index()
+        try:
+            self.assertError('channellogger search foo')
+            index.setValue(True)
+            self.say('the quick brown fox')
+            self.irc.feedMsg(ircmsgs.privmsg(self.channel, 'a lazy brown dog',
+                                             prefix='bar!bar@baz'))
+            self.say('nothing to see here')
+            self.assertRegexp('channellogger search brown',
+                              'lazy brown dog.*quick brown')
+            self.assertRegexp('channellogger search --nick %s brown' %
+                              self.nick,
+                              '<%s> the quick brown fox$' % self.nick)
+            self.assertNotRegexp('channellogger search --nick bar brown',
+                                 'quick')
+            self.assertRegexp('channellogger search --since 60 brown',
+                              'lazy brown dog')
+            self.assertResponse('channellogger search --until 60 brown',
+                                'No lines matched that search.')
+            self.assertResponse('channellogger search purple',
+                                'No lines matched that search.')
+        finally:
+            index.setValue(original)
+
+    def testSearchOffsets(self):
+        index = conf.supybot.plugins.ChannelLogger.index
+        original = index()
+        try:
+            index.setValue(True)
+            for i in range(20):
+                self.say('line number%s' % i)
+            self.assertRegexp('channellogger search number3',
+                              '<%s> line number3$' % self.nick)
+            self.cb.reset()
+            self.say('line number20')
+            self.assertRegexp('channellogger search number20',
+                              '<%s> line number20$' % self.nick)
+        finally:
+            index.setValue(original)
 
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -42,8 +42,32 @@ import supybot.irclib as irclib
 import supybot.ircmsgs as ircmsgs
 import supybot.plugins as plugins
 import supybot.ircutils as ircutils
+import supybot.registry as registry
 import supybot.callbacks as callbacks
 
+_configs = {}
+_configsGeneration = None
+def _getConfig(channel):
+    """Returns the selfStats value and the smileys and frowns regexps for
+    channel, looking them up only when the registry has changed since we last
+    did."""
+    global _configsGeneration
+    generation = registry.generation()
+    if generation != _configsGeneration:
+        _configs.clear()
+        _configsGeneration = generation
+    key = ircutils.toLower(channel)
+    try:
+        return _configs[key]
+    except KeyError:
+        group = conf.supybot.plugins.ChannelStats
+        link = plugins.getChannel(channel)
+        config = (group.selfStats.get(channel)(),
+                  group.smileys.get(link)(),
+                  group.frowns.get(link)())
+        _configs[key] = config
+        return config
+
 class ChannelStat(irclib.IrcCommandDispatcher):
     _values = ['actions', 'chars', 'frowns', 'joins', 'kicks','modes',
                'msgs', 'parts', 'quits', 'smileys', 'topics', 'words', 'users']
@@ -74,11 +98,9 @@ class ChannelStat(irclib.IrcCommandDispatcher):
             method(msg)
 
     def doPayload(self, channel, payload):
-        channel = plugins.getChannel(channel)
+        (_, sRe, fRe) = _getConfig(channel)
         self.chars += len(payload)
         self.words += len(payload.split())
-        fRe = conf.supybot.plugins.ChannelStats.get('frowns').get(channel)()
-        sRe =conf.supybot.plugins.ChannelStats.get('smileys').get(channel)()
         self.frowns += len(fRe.findall(payload))
         self.smileys += len(sRe.findall(payload))
 
@@ -191,7 +213,7 @@ class ChannelStats(callbacks.Plugin):
     def outFilter(self, irc, msg):
         if msg.command == 'PRIVMSG':
             if ircutils.isChannel(msg.args[0]):
-                if self.registryValue('selfStats', msg.args[0]):
+                if _getConfig(msg.args[0])[0]:
                     try:
                         self.outFiltering = True
                         self.db.addMsg(msg, 0)
@@ -236,7 +258,7 @@ class ChannelStats(callbacks.Plugin):
             return
         if (channel, id) not in self.db:
             self.db[channel, id] = UserStat()
-        self.db.channels[channel][id].kicked += 1
+        self.db[channel, id].kicked += 1
 
     def stats(self, irc, msg, args, channel, name):
         """[<channel>] [<name>]
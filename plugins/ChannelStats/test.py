@@ -74,6 +74,21 @@ class ChannelStatsTestCase(ChannelPluginTestCase):
         finally:
             conf.supybot.plugins.ChannelStats.selfStats.setValue(True)
 
+    def testSmileysChange(self):
+        cb = self.irc.getCallback('ChannelStats')
+        smileys = conf.supybot.plugins.ChannelStats.smileys.get(self.channel)
+        original = str(smileys)
+        try:
+            self.irc.feedMsg(ircmsgs.privmsg(self.channel, 'hi :) ^_^',
+                                             prefix=self.prefix))
+            self.assertEqual(cb.db.getChannelStats(self.channel).smileys, 1)
+            smileys.set('^_^')
+            self.irc.feedMsg(ircmsgs.privmsg(self.channel, 'hi :) ^_^',
+                                             prefix=self.prefix))
+            self.assertEqual(cb.db.getChannelStats(self.channel).smileys, 2)
+        finally:
+            smileys.set(original)
+
     def testNoKeyErrorStats(self):
         self.assertNotRegexp('stats sweede', 'KeyError')
 
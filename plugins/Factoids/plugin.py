@@ -77,6 +77,34 @@ def getFactoidId(irc, msg, args, state):
 addConverter('factoid', getFactoid)
 addConverter('factoidId', getFactoidId)
 
+# Keys and factoids are indexed under the (lowercased, since LIKE doesn't care
+# about case) trigrams in them, plus a term for their first character, so LIKE
+# patterns only need to be checked against the rows having every term the
+# pattern's literal parts have, rather than against the whole table.
+def indexTerms(s):
+    """Returns the terms a key or factoid is indexed under."""
+    s = s.lower()
+    terms = set([s[i:i+3] for i in xrange(len(s) - 2)])
+    if s:
+        terms.add('^' + s[0])
+    return terms
+
+# SQLite won't bind more than 999 variables in a statement, so the index
+# terms _like checks are capped; the LIKE itself still checks every row the
+# index picks, so checking fewer terms only makes the index less selective.
+maximumTerms = 900
+
+def likeTerms(pattern):
+    """Returns the terms any text matching the LIKE pattern is indexed under.
+    """
+    pattern = pattern.lower()
+    terms = set()
+    for part in re.split('[%_]', pattern):
+        terms.update([part[i:i+3] for i in xrange(len(part) - 2)])
+    if pattern and pattern[0] not in '%_':
+        terms.add('^' + pattern[0])
+    return terms
+
 class Factoids(callbacks.Plugin, plugins.ChannelDBHandler):
     def __init__(self, irc):
         callbacks.Plugin.__init__(self, irc)
@@ -86,6 +114,7 @@ class Factoids(callbacks.Plugin, plugins.ChannelDBHandler):
         if os.path.exists(filename):
             db = sqlite3.connect(filename)
             db.text_factory = str
+            self._makeIndex(db)
             return db
         db = sqlite3.connect(filename)
         db.text_factory = str
@@ -108,8 +137,69 @@ class Factoids(callbacks.Plugin, plugins.ChannelDBHandler):
                           usage_count INTEGER
                           )""")
         db.commit()
+        self._makeIndex(db)
         return db
 
+    def _makeIndex(self, db):
+        """Creates the search index, and fills it in if the database was made
+        before there was one."""
+        cursor = db.cursor()
+        cursor.execute("""SELECT name FROM sqlite_master
+                          WHERE type='table' AND name='keys_index'""")
+        if cursor.fetchall():
+            return
+        for table in ('keys', 'factoids'):
+            cursor.execute("""CREATE TABLE %s_index (
+                              term TEXT,
+                              id INTEGER
+                              )""" % table)
+            cursor.execute("""CREATE INDEX %s_index_term
+                              ON %s_index (term, id)""" % (table, table))
+            cursor.execute("""CREATE INDEX %s_index_id
+                              ON %s_index (id)""" % (table, table))
+        cursor.execute("""SELECT id, key FROM keys""")
+        for (id, key) in cursor.fetchall():
+            self._index(cursor, 'keys', id, key)
+        cursor.execute("""SELECT id, fact FROM factoids""")
+        for (id, fact) in cursor.fetchall():
+            self._index(cursor, 'factoids', id, fact)
+        db.commit()
+
+    def _index(self, cursor, table, id, text):
+        terms = list(indexTerms(text))
+        # One statement per batch, rather than one per term, so we don't
+        # commit for every term when the database is autocommitting.
+        while terms:
+            batch = terms[:400]
+            del terms[:400]
+            sql = """INSERT INTO %s_index VALUES %s""" % \
+                  (table, ', '.join(['(?, ?)'] * len(batch)))
+            args = []
+            for term in batch:
+                args.extend((term, id))
+            cursor.execute(sql, args)
+
+    def _unindex(self, cursor, table, id):
+        cursor.execute("""DELETE FROM %s_index WHERE id=?""" % table, (id,))
+
+    def _like(self, table, column, pattern, maximum=maximumTerms):
+        """Returns an SQL condition (and its arguments) for table.column
+        matching the LIKE pattern, which uses the index (at most maximum of
+        its terms) to pick out the rows worth checking."""
+        sql = '%s.%s LIKE ?' % (table, column)
+        args = [pattern]
+        # The trigrams pick out fewer rows than the first letter does.
+        terms = sorted(likeTerms(pattern), key=lambda t: t.startswith('^'))
+        del terms[max(maximum, 0):]
+        if terms:
+            sql += """ AND %s.id IN (SELECT id FROM %s_index
+                                     WHERE term IN (%s)
+                                     GROUP BY id
+                                     HAVING count(*)=%s)""" % \
+                   (table, table, ', '.join('?' * len(terms)), len(terms))
+            args.extend(terms)
+        return (sql, args)
+
     def getCommandHelp(self, command, simpleSyntax=None):
         method = self.getCommandMethod(command)
         if method.im_func.func_name == 'learn':
@@ -149,6 +239,7 @@ class Factoids(callbacks.Plugin, plugins.ChannelDBHandler):
         
         if len(keyid) == 0:
             cursor.execute("""INSERT INTO keys VALUES (NULL, ?)""", (key,))
+            self._index(cursor, 'keys', cursor.lastrowid, key)
             db.commit()
         if len(factid) == 0:
             if ircdb.users.hasUser(msg.prefix):
@@ -158,6 +249,7 @@ class Factoids(callbacks.Plugin, plugins.ChannelDBHandler):
             cursor.execute("""INSERT INTO factoids VALUES
                               (NULL, ?, ?, ?, ?)""",
                            (name, int(time.time()), factoid, 0))
+            self._index(cursor, 'factoids', cursor.lastrowid, factoid)
             db.commit()
         (keyid, factid) = self._getKeyAndFactId(channel, key, factoid)
         
@@ -187,10 +279,11 @@ class Factoids(callbacks.Plugin, plugins.ChannelDBHandler):
     def _lookupFactoid(self, channel, key):
         db = self.getDb(channel)
         cursor = db.cursor()
+        (like, args) = self._like('keys', 'key', key)
         cursor.execute("""SELECT factoids.fact, factoids.id, relations.id FROM factoids, keys, relations
-                          WHERE keys.key LIKE ? AND relations.key_id=keys.id AND relations.fact_id=factoids.id
+                          WHERE %s AND relations.key_id=keys.id AND relations.fact_id=factoids.id
                           ORDER BY factoids.id
-                          LIMIT 20""", (key,))
+                          LIMIT 20""" % like, args)
         return cursor.fetchall()
     
     def _searchFactoid(self, channel, key):
@@ -206,12 +299,14 @@ class Factoids(callbacks.Plugin, plugins.ChannelDBHandler):
             
         db = self.getDb(channel)
         cursor = db.cursor()
-        cursor.execute("""SELECT key FROM keys WHERE key LIKE ?""", ('%' + key + '%',))
+        (like, args) = self._like('keys', 'key', '%' + key + '%')
+        cursor.execute("""SELECT key FROM keys WHERE %s""" % like, args)
         wildcardkeys = cursor.fetchall()
         if len(wildcardkeys) > 0:
             return [line[0] for line in wildcardkeys]
         
-        cursor.execute("""SELECT key FROM keys WHERE key LIKE ?""", (key[0] + '%',))
+        (like, args) = self._like('keys', 'key', key[0] + '%')
+        cursor.execute("""SELECT key FROM keys WHERE %s""" % like, args)
         flkeys = cursor.fetchall()
         if len(flkeys) == 0:
             return []
@@ -352,6 +447,7 @@ class Factoids(callbacks.Plugin, plugins.ChannelDBHandler):
             elif len(newkey_info) == 0:
                 cursor.execute("""INSERT INTO keys VALUES (NULL, ?)""", 
                             (newkey,))
+                self._index(cursor, 'keys', cursor.lastrowid, newkey)
                 db.commit()
                 cursor.execute("""SELECT id FROM keys WHERE key=?""", (newkey,))
                 newkey_info = cursor.fetchall()
@@ -486,12 +582,14 @@ class Factoids(callbacks.Plugin, plugins.ChannelDBHandler):
             remaining_key_relations = cursor.fetchall()
             if len(remaining_key_relations) == 0:
                 cursor.execute("""DELETE FROM keys where id=?""", (keyid,))
+                self._unindex(cursor, 'keys', keyid)
             
             cursor.execute("""SELECT id FROM relations
                             WHERE relations.fact_id=?""", (factid,))
             remaining_fact_relations = cursor.fetchall()
             if len(remaining_fact_relations) == 0:
                 cursor.execute("""DELETE FROM factoids where id=?""", (factid,))
+                self._unindex(cursor, 'factoids', factid)
             db.commit()
 
     def forget(self, irc, msg, args, channel, words):
@@ -520,11 +618,12 @@ class Factoids(callbacks.Plugin, plugins.ChannelDBHandler):
         key = ' '.join(words)
         db = self.getDb(channel)
         cursor = db.cursor()
+        (like, args) = self._like('keys', 'key', key)
         cursor.execute("""SELECT keys.id, factoids.id, relations.id
                         FROM keys, factoids, relations
-                        WHERE key LIKE ? AND
+                        WHERE %s AND
                         relations.key_id=keys.id AND
-                        relations.fact_id=factoids.id""", (key,))
+                        relations.fact_id=factoids.id""" % like, args)
         results = cursor.fetchall()
         if len(results) == 0:
             irc.error('There is no such factoid.')
@@ -583,7 +682,8 @@ class Factoids(callbacks.Plugin, plugins.ChannelDBHandler):
         """
         db = self.getDb(channel)
         cursor = db.cursor()
-        cursor.execute("SELECT id FROM keys WHERE key LIKE ?", (key,))
+        (like, args) = self._like('keys', 'key', key)
+        cursor.execute("SELECT id FROM keys WHERE %s" % like, args)
         results = cursor.fetchall()
         if len(results) == 0:
             irc.error('No factoid matches that key.')
@@ -619,11 +719,12 @@ class Factoids(callbacks.Plugin, plugins.ChannelDBHandler):
         """
         db = self.getDb(channel)
         cursor = db.cursor()
+        (like, args) = self._like('keys', 'key', key)
         cursor.execute("""SELECT factoids.id, factoids.fact
                         FROM keys, factoids, relations
-                        WHERE keys.key LIKE ? AND
+                        WHERE %s AND
                         keys.id=relations.key_id AND
-                        factoids.id=relations.fact_id""", (key,))
+                        factoids.id=relations.fact_id""" % like, args)
         results = cursor.fetchall()
         if len(results) == 0:
             irc.error(format('I couldn\'t find any key %q', key))
@@ -632,7 +733,13 @@ class Factoids(callbacks.Plugin, plugins.ChannelDBHandler):
             irc.errorInvalid('key id')
         (id, fact) = results[number-1]
         newfact = replacer(fact)
+        # The UPDATE replaces any other factoid that's already newfact.
+        cursor.execute("SELECT id FROM factoids WHERE fact=?", (newfact,))
+        for (otherid,) in cursor.fetchall():
+            self._unindex(cursor, 'factoids', otherid)
         cursor.execute("UPDATE factoids SET fact=? WHERE id=?", (newfact, id))
+        self._unindex(cursor, 'factoids', id)
+        self._index(cursor, 'factoids', id, newfact)
         db.commit()
         irc.replySuccess()
     change = wrap(change, ['channel', 'something',
@@ -654,9 +761,11 @@ class Factoids(callbacks.Plugin, plugins.ChannelDBHandler):
         target = 'keys.key'
         predicateName = 'p'
         db = self.getDb(channel)
+        (table, column) = ('keys', 'key')
         for (option, arg) in optlist:
             if option == 'values':
                 target = 'factoids.fact'
+                (table, column) = ('factoids', 'fact')
                 if 'factoids' not in tables:
                     tables.append('factoids')
                     tables.append('relations')
@@ -667,9 +776,13 @@ class Factoids(callbacks.Plugin, plugins.ChannelDBHandler):
                     return int(bool(r.search(s)))
                 db.create_function(predicateName, 1, p)
                 predicateName += 'p'
+        # Each glob binds its pattern, then its share of the index terms.
+        maximum = maximumTerms // max(len(globs), 1) - 1
         for glob in globs:
-            criteria.append('TARGET LIKE ?')
-            formats.append(glob.translate(self._sqlTrans))
+            (like, args) = self._like(table, column,
+                                      glob.translate(self._sqlTrans), maximum)
+            criteria.append(like)
+            formats.extend(args)
         cursor = db.cursor()
         sql = """SELECT keys.key FROM %s WHERE %s""" % \
               (', '.join(tables), ' AND '.join(criteria))
@@ -30,6 +30,9 @@
 
 from supybot.test import *
 
+import random
+import string
+
 try:
     import sqlite3
 except ImportError:
@@ -109,6 +112,59 @@ class FactoidsTestCase(ChannelPluginTestCase):
         self.assertRegexp('factoids search --values primary author',
                           'my primary author')
 
+    def testSearchIndex(self):
+        self.assertNotError('learn JemFinch as my primary author')
+        self.assertNotError('learn jamessan as a developer of much python')
+        self.assertNotError('learn ab as short')
+        self.assertRegexp('factoids search *FINCH', 'JemFinch')
+        self.assertRegexp('factoids search j*m*', 'JemFinch.*jamessan')
+        self.assertRegexp('factoids search a?', 'short')
+        self.assertRegexp('factoids search *e?fin*', 'JemFinch')
+        self.assertRegexp('factoids search jem*inch', 'JemFinch')
+        self.assertRegexp('factoids search ssan', 'jamessan')
+        self.assertResponse('factoids search *finches*',
+                            'No keys matched that query.')
+        self.assertRegexp('factoids search --values *PYTHON', 'jamessan')
+        self.assertRegexp('factoids search --values *author*', 'JemFinch')
+        self.assertNotError('change jamessan 1 s/python/perl/')
+        self.assertResponse('factoids search --values *python*',
+                            'No keys matched that query.')
+        self.assertRegexp('factoids search --values *perl', 'jamessan')
+        self.assertNotError('forget jemfinch')
+        self.assertResponse('factoids search *finch*',
+                            'No keys matched that query.')
+        self.assertNotRegexp('jemfnch', 'JemFinch')
+        self.assertRegexp('jamesan', 'jamessan')
+
+    def testSearchManyTerms(self):
+        # More index terms than SQLite will bind variables for.
+        r = random.Random(0)
+        value = ''.join([r.choice(string.ascii_lowercase)
+                         for _ in xrange(1500)])
+        cb = self.irc.getCallback('Factoids')
+        (sql, args) = cb._like('factoids', 'fact', '%' + value + '%')
+        self.failUnless(len(args) <= 999)
+        self.assertNotError('learn long as %s' % value)
+        self.assertRegexp('factoids search --values *%s*' % value, 'long')
+        self.assertRegexp('factoids search --values %s' %
+                          ' '.join(['*%s*' % value[i:i+200]
+                                    for i in xrange(0, 1400, 100)]), 'long')
+        self.assertResponse('factoids search *%s*' % value,
+                            'No keys matched that query.')
+
+    def testIndexesExistingDatabase(self):
+        self.assertNotError('learn jemfinch as my primary author')
+        self.assertNotError('learn jamessan as a developer of much python')
+        cb = self.irc.getCallback('Factoids')
+        db = cb.getDb(self.channel)
+        db.execute('DROP TABLE keys_index')
+        db.execute('DROP TABLE factoids_index')
+        db.close()
+        del cb.dbCache[self.channel]
+        self.assertRegexp('factoids search *finch', 'my primary author')
+        self.assertRegexp('factoids search --values *python', 'jamessan')
+        self.assertRegexp('jamesan', 'jamessan')
+
     def testWhatisOnNumbers(self):
         self.assertNotError('learn 911 as emergency number')
         self.assertRegexp('whatis 911', 'emergency number')
@@ -58,5 +58,14 @@ conf.registerChannelValue(conf.supybot.plugins.Karma, 'allowSelfRating',
 conf.registerChannelValue(conf.supybot.plugins.Karma, 'allowUnaddressedKarma',
     registry.Boolean(False, """Determines whether the bot will
     increase/decrease karma without being addressed."""))
+conf.registerGlobalValue(conf.supybot.plugins.Karma, 'commitInterval',
+    registry.PositiveInteger(30, """Determines how many seconds karma changes
+    may wait before they're committed to the database.  Changes are batched
+    this way so busy channels don't make the bot write to its disk for every
+    ++ and --."""))
+conf.registerGlobalValue(conf.supybot.plugins.Karma, 'maximumUncommitted',
+    registry.NonNegativeInteger(100, """Determines how many karma changes may
+    wait to be committed to the database; when there are more than this, they
+    are all committed right away.  0 commits every change as it's made."""))
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -30,13 +30,16 @@
 
 import os
 import csv
+import time
 
 import supybot.conf as conf
 import supybot.utils as utils
+import supybot.world as world
 from supybot.commands import *
 import supybot.plugins as plugins
 import supybot.ircmsgs as ircmsgs
 import supybot.ircutils as ircutils
+import supybot.schedule as schedule
 import supybot.callbacks as callbacks
 
 try:
@@ -48,11 +51,34 @@ class SqliteKarmaDB(object):
     def __init__(self, filename):
         self.dbs = ircutils.IrcDict()
         self.filename = filename
+        # increment and decrement don't commit; since we read through the same
+        # connections we write through, reads see their changes anyway.
+        self.uncommitted = 0
 
     def close(self):
+        self.commit()
         for db in self.dbs.itervalues():
             db.close()
 
+    def commit(self):
+        """Commits the changes increment and decrement have made."""
+        if self.uncommitted:
+            for db in self.dbs.itervalues():
+                db.commit()
+            self.uncommitted = 0
+
+    def _addNet(self, db):
+        """Adds the net karma column (and its index) to databases made before
+        there was one."""
+        cursor = db.cursor()
+        cursor.execute("""PRAGMA table_info(karma)""")
+        if 'net' in [row[1] for row in cursor.fetchall()]:
+            return
+        cursor.execute("""ALTER TABLE karma ADD COLUMN net INTEGER""")
+        cursor.execute("""UPDATE karma SET net=added-subtracted""")
+        cursor.execute("""CREATE INDEX karma_net ON karma (net)""")
+        db.commit()
+
     def _getDb(self, channel):
         filename = plugins.makeChannelFilename(self.filename, channel)
         if filename in self.dbs:
@@ -60,6 +86,7 @@ class SqliteKarmaDB(object):
         if os.path.exists(filename):
             db = sqlite3.connect(filename)
             db.text_factory = str
+            self._addNet(db)
             self.dbs[filename] = db
             return db
         db = sqlite3.connect(filename)
@@ -71,8 +98,10 @@ class SqliteKarmaDB(object):
                           name TEXT,
                           normalized TEXT UNIQUE ON CONFLICT IGNORE,
                           added INTEGER,
-                          subtracted INTEGER
+                          subtracted INTEGER,
+                          net INTEGER
                           )""")
+        cursor.execute("""CREATE INDEX karma_net ON karma (net)""")
         db.commit()
         def p(s1, s2):
             return int(ircutils.nickEqual(s1, s2))
@@ -96,8 +125,8 @@ class SqliteKarmaDB(object):
         cursor = db.cursor()
         normalizedThings = dict(zip(map(lambda s: s.lower(), things), things))
         criteria = ' OR '.join(['normalized=?'] * len(normalizedThings))
-        sql = """SELECT name, added-subtracted FROM karma
-                 WHERE %s ORDER BY added-subtracted DESC""" % criteria
+        sql = """SELECT name, net FROM karma
+                 WHERE %s ORDER BY net DESC""" % criteria
         cursor.execute(sql, normalizedThings.keys())
         L = [(name, int(karma)) for (name, karma) in cursor.fetchall()]
         for (name, _) in L:
@@ -109,28 +138,28 @@ class SqliteKarmaDB(object):
     def top(self, channel, limit):
         db = self._getDb(channel)
         cursor = db.cursor()
-        cursor.execute("""SELECT name, added-subtracted FROM karma
-                          ORDER BY added-subtracted DESC LIMIT ?""", (limit,))
+        cursor.execute("""SELECT name, net FROM karma
+                          ORDER BY net DESC LIMIT ?""", (limit,))
         return [(t[0], int(t[1])) for t in cursor.fetchall()]
 
     def bottom(self, channel, limit):
         db = self._getDb(channel)
         cursor = db.cursor()
-        cursor.execute("""SELECT name, added-subtracted FROM karma
-                          ORDER BY added-subtracted ASC LIMIT ?""", (limit,))
+        cursor.execute("""SELECT name, net FROM karma
+                          ORDER BY net ASC LIMIT ?""", (limit,))
         return [(t[0], int(t[1])) for t in cursor.fetchall()]
 
     def rank(self, channel, thing):
         db = self._getDb(channel)
         cursor = db.cursor()
-        cursor.execute("""SELECT added-subtracted FROM karma
-                          WHERE name=?""", (thing,))
+        cursor.execute("""SELECT net FROM karma
+                          WHERE normalized=?""", (thing.lower(),))
         results = cursor.fetchall()
         if len(results) == 0:
             return None
         karma = int(results[0][0])
         cursor.execute("""SELECT COUNT(*) FROM karma
-                          WHERE added-subtracted > ?""", (karma,))
+                          WHERE net > ?""", (karma,))
         rank = int(cursor.fetchone()[0])
         return rank+1
 
@@ -144,21 +173,21 @@ class SqliteKarmaDB(object):
         db = self._getDb(channel)
         cursor = db.cursor()
         normalized = name.lower()
-        cursor.execute("""INSERT INTO karma VALUES (NULL, ?, ?, 0, 0)""",
+        cursor.execute("""INSERT INTO karma VALUES (NULL, ?, ?, 0, 0, 0)""",
                        (name, normalized,))
-        cursor.execute("""UPDATE karma SET added=added+1
+        cursor.execute("""UPDATE karma SET added=added+1, net=net+1
                           WHERE normalized=?""", (normalized,))
-        db.commit()
+        self.uncommitted += 1
 
     def decrement(self, channel, name):
         db = self._getDb(channel)
         cursor = db.cursor()
         normalized = name.lower()
-        cursor.execute("""INSERT INTO karma VALUES (NULL, ?, ?, 0, 0)""",
+        cursor.execute("""INSERT INTO karma VALUES (NULL, ?, ?, 0, 0, 0)""",
                        (name, normalized,))
-        cursor.execute("""UPDATE karma SET subtracted=subtracted+1
+        cursor.execute("""UPDATE karma SET subtracted=subtracted+1, net=net-1
                           WHERE normalized=?""", (normalized,))
-        db.commit()
+        self.uncommitted += 1
 
     def most(self, channel, kind, limit):
         if kind == 'increased':
@@ -180,7 +209,7 @@ class SqliteKarmaDB(object):
         db = self._getDb(channel)
         cursor = db.cursor()
         normalized = name.lower()
-        cursor.execute("""UPDATE karma SET subtracted=0, added=0
+        cursor.execute("""UPDATE karma SET subtracted=0, added=0, net=0
                           WHERE normalized=?""", (normalized,))
         db.commit()
 
@@ -205,8 +234,9 @@ class SqliteKarmaDB(object):
         for (name, added, subtracted) in reader:
             normalized = name.lower()
             cursor.execute("""INSERT INTO karma
-                              VALUES (NULL, ?, ?, ?, ?)""",
-                           (name, normalized, added, subtracted,))
+                              VALUES (NULL, ?, ?, ?, ?, ?)""",
+                           (name, normalized, added, subtracted,
+                            int(added) - int(subtracted)))
         db.commit()
         fd.close()
 
@@ -219,11 +249,36 @@ class Karma(callbacks.Plugin):
         self.__parent = super(Karma, self)
         self.__parent.__init__(irc)
         self.db = KarmaDB()
+        self.commitScheduled = False
+        world.flushers.append(self._commit)
 
     def die(self):
         self.__parent.die()
+        world.flushers.remove(self._commit)
+        if self.commitScheduled:
+            schedule.removeEvent(self.commitEvent)
         self.db.close()
 
+    commitEvent = 'Karma commit'
+    def _commit(self):
+        if self.commitScheduled:
+            try:
+                schedule.removeEvent(self.commitEvent)
+            except KeyError: # We're being called by it.
+                pass
+            self.commitScheduled = False
+        self.db.commit()
+
+    def _changed(self):
+        """Commits the karma changes when there are too many uncommitted, or
+        makes sure they'll be committed in commitInterval seconds."""
+        if self.db.uncommitted > self.registryValue('maximumUncommitted'):
+            self._commit()
+        elif not self.commitScheduled:
+            when = time.time() + self.registryValue('commitInterval')
+            schedule.addEvent(self._commit, when, self.commitEvent)
+            self.commitScheduled = True
+
     def _normalizeThing(self, thing):
         assert thing
         if thing[0] == '(' and thing[-1] == ')':
@@ -245,6 +300,7 @@ class Karma(callbacks.Plugin):
                 irc.error('You\'re not allowed to adjust your own karma.')
             elif thing:
                 self.db.increment(channel, self._normalizeThing(thing))
+                self._changed()
                 self._respond(irc, channel)
         else:
             thing = thing[:-2]
@@ -253,6 +309,7 @@ class Karma(callbacks.Plugin):
                 irc.error('You\'re not allowed to adjust your own karma.')
             elif thing:
                 self.db.decrement(channel, self._normalizeThing(thing))
+                self._changed()
                 self._respond(irc, channel)
 
     def invalidCommand(self, irc, msg, tokens):
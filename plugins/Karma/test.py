@@ -29,6 +29,8 @@
 
 from supybot.test import *
 
+import supybot.schedule as schedule
+
 try:
     import sqlite3
 except ImportError:
@@ -181,6 +183,82 @@ class KarmaTestCase(ChannelPluginTestCase):
         self.assertRegexp('karma foo', '0')
         self.assertNotRegexp('karma foo', '1')
 
+    def _committed(self, thing):
+        """Returns what another connection sees of thing's karma."""
+        cb = self.irc.getCallback('Karma')
+        L = []
+        for filename in cb.db.dbs:
+            db = sqlite3.connect(filename)
+            try:
+                L.extend(db.execute("""SELECT added, subtracted, net FROM karma
+                                       WHERE normalized=?""", (thing,)))
+            finally:
+                db.close()
+        return L
+
+    def testCommitsInBatches(self):
+        karma = conf.supybot.plugins.Karma
+        maximum = karma.maximumUncommitted()
+        try:
+            karma.maximumUncommitted.setValue(3)
+            self.assertNoResponse('foo++', 1)
+            self.assertNoResponse('foo++', 1)
+            self.assertNoResponse('bar--', 1)
+            self.assertEqual(self._committed('foo'), [])
+            self.assertRegexp('karma foo', 'increased 2.*total.*2')
+            self.assertRegexp('karma', r'Highest karma: "foo" \(2\)')
+            self.assertNoResponse('foo++', 1)
+            self.assertEqual(self._committed('foo'), [(3, 0, 3)])
+            self.assertNoResponse('foo--', 1)
+            self.assertEqual(self._committed('foo'), [(3, 0, 3)])
+            world.flush()
+            self.assertEqual(self._committed('foo'), [(3, 1, 2)])
+        finally:
+            karma.maximumUncommitted.setValue(maximum)
+
+    def testCommitsAfterInterval(self):
+        karma = conf.supybot.plugins.Karma
+        interval = karma.commitInterval()
+        try:
+            karma.commitInterval.setValue(60)
+            start = time.time()
+            self.assertNoResponse('foo++', 1)
+            self.assertEqual(self._committed('foo'), [])
+            cb = self.irc.getCallback('Karma')
+            # Run the commit now, as schedule.run would once it's due.
+            when = schedule.schedule.events[cb.commitEvent][1][0]
+            self.failUnless(start + 60 <= when <= time.time() + 60)
+            schedule.removeEvent(cb.commitEvent)()
+            self.failIf(cb.commitScheduled)
+            self.assertEqual(self._committed('foo'), [(1, 0, 1)])
+        finally:
+            karma.commitInterval.setValue(interval)
+
+    def testAddsNetToOldDatabases(self):
+        self.assertNoResponse('foo++', 1)
+        cb = self.irc.getCallback('Karma')
+        filenames = cb.db.dbs.keys()
+        cb.db.close()
+        cb.db.dbs.clear()
+        # Replace the database with one made before there was a net column.
+        for filename in filenames:
+            os.remove(filename)
+            db = sqlite3.connect(filename)
+            db.execute("""CREATE TABLE karma (
+                          id INTEGER PRIMARY KEY,
+                          name TEXT,
+                          normalized TEXT UNIQUE ON CONFLICT IGNORE,
+                          added INTEGER,
+                          subtracted INTEGER
+                          )""")
+            db.executemany("""INSERT INTO karma VALUES (NULL, ?, ?, ?, ?)""",
+                           [('foo', 'foo', 2, 0), ('bar', 'bar', 0, 1)])
+            db.commit()
+            db.close()
+        self.assertRegexp('karma', r'Highest karma: "foo" \(2\)')
+        self.assertRegexp('karma', r'Lowest karma: "bar" \(-1\)')
+        self.assertEqual(self._committed('foo'), [(2, 0, 2)])
+
 #        def testNoKarmaDunno(self):
 #            self.assertNotError('load Infobot')
 #            self.assertNoResponse('foo++')
@@ -28,6 +28,7 @@
 # POSSIBILITY OF SUCH DAMAGE.
 ###
 
+import os
 import csv
 import time
 import datetime
@@ -49,12 +50,22 @@ class Later(callbacks.Plugin):
         self.__parent = super(Later, self)
         self.__parent.__init__(irc)
         self._notes = ircutils.IrcDict()
-        self.wildcards = []
+        self.noteCount = 0 # How many notes are in self._notes.
+        # The wildcards we have notes for, IRC-lowercased and keyed by their
+        # first character, or by '' if that's a wildcard itself; a nick only
+        # has to be matched against those under its first character and ''.
+        self.wildcards = {}
         self.filename = conf.supybot.directories.data.dirize('Later.db')
+        # Changes are appended to the journal (notes added as '+' rows,
+        # removed as '-' rows) and Later.db is only rewritten when the journal
+        # gets too big, as with ChannelUserDB.
+        self.journalName = self.filename + '.journal'
+        self.journalSize = 0
         self._openNotes()
 
     def die(self):
-        self._flushNotes()
+        if self.journalSize:
+            self._flushNotes()
 
     def _flushNotes(self):
         fd = utils.file.AtomicFile(self.filename)
@@ -63,17 +74,81 @@ class Later(callbacks.Plugin):
             for (time, whence, text) in notes:
                 writer.writerow([nick, time, whence, text])
         fd.close()
+        if os.path.exists(self.journalName):
+            os.remove(self.journalName)
+        self.journalSize = 0
+
+    def _journal(self, op, nick, notes):
+        if not conf.supybot.databases.types.journal():
+            self._flushNotes()
+            return
+        fd = file(self.journalName, 'ab')
+        try:
+            csv.writer(fd).writerows([[op, nick] + list(note)
+                                      for note in notes])
+        finally:
+            fd.close()
+        self.journalSize += len(notes)
+        maxmods = conf.supybot.databases.types.journal.maximumModifications()
+        if self.journalSize > maxmods * self.noteCount:
+            self._flushNotes()
 
     def _openNotes(self):
         try:
             fd = file(self.filename)
         except EnvironmentError, e:
             self.log.warning('Couldn\'t open %s: %s', self.filename, e)
-            return
-        reader = csv.reader(fd)
-        for (nick, time, whence, text) in reader:
-            self._addNote(nick, whence, text, at=float(time), maximum=0)
-        fd.close()
+        else:
+            reader = csv.reader(fd)
+            for (nick, time, whence, text) in reader:
+                self._add(nick, (float(time), whence, text))
+            fd.close()
+        if os.path.exists(self.journalName):
+            fd = file(self.journalName)
+            for (op, nick, time, whence, text) in csv.reader(fd):
+                self.journalSize += 1
+                note = (float(time), whence, text)
+                notes = self._notes.get(nick, [])
+                # We might have died after rewriting Later.db but before
+                # removing the journal, so adding a note has to be idempotent.
+                if op == '+' and note not in notes:
+                    self._add(nick, note)
+                elif op == '-' and note in notes:
+                    notes.remove(note)
+                    self.noteCount -= 1
+                    if not notes:
+                        self._pop(nick)
+            fd.close()
+
+    def _isWildcard(self, nick):
+        return '?' in nick or '*' in nick
+
+    def _wildcardKey(self, s):
+        c = s[0]
+        if c in '?*':
+            c = ''
+        return ircutils.toLower(c)
+
+    def _add(self, nick, note):
+        self.noteCount += 1
+        try:
+            self._notes[nick].append(note)
+        except KeyError:
+            self._notes[nick] = [note]
+            if self._isWildcard(nick):
+                pattern = ircutils.toLower(nick)
+                key = self._wildcardKey(pattern)
+                self.wildcards.setdefault(key, set()).add(pattern)
+
+    def _pop(self, nick):
+        notes = self._notes.pop(nick)
+        self.noteCount -= len(notes)
+        if self._isWildcard(nick):
+            key = self._wildcardKey(nick)
+            self.wildcards[key].discard(ircutils.toLower(nick))
+            if not self.wildcards[key]:
+                del self.wildcards[key]
+        return notes
 
     def _timestamp(self, when):
         #format = conf.supybot.reply.format.time()
@@ -88,17 +163,11 @@ class Later(callbacks.Plugin):
             at = time.time()
         if maximum is None:
             maximum = self.registryValue('maximum')
-        try:
-            notes = self._notes[nick]
-            if maximum and len(notes) >= maximum:
-                raise ValueError
-            else:
-                notes.append((at, whence, text))
-        except KeyError:
-            self._notes[nick] = [(at, whence, text)]
-        if '?' in nick or '*' in nick and nick not in self.wildcards:
-            self.wildcards.append(nick)
-        self._flushNotes()
+        if maximum and len(self._notes.get(nick, [])) >= maximum:
+            raise ValueError
+        note = (at, whence, text)
+        self._add(nick, note)
+        self._journal('+', nick, [note])
     
     def _validateNick(self, irc, nick):
         """Validate nick according to the IRC RFC 2812 spec.
@@ -131,11 +200,13 @@ class Later(callbacks.Plugin):
                     removals.append((notetime, whence, text))
             for note in removals:
                 notes.remove(note)
+            self.noteCount -= len(removals)
+            if removals:
+                self._journal('-', nick, removals)
             if len(notes) == 0:
                 nickremovals.append(nick)
         for nick in nickremovals:
-            del self._notes[nick]
-        self._flushNotes()
+            self._pop(nick)
     
     ## Note: we call _deleteExpired from 'tell'. This means that it's possible
     ## for expired notes to remain in the database for longer than the maximum,
@@ -195,8 +266,7 @@ class Later(callbacks.Plugin):
         Removes the notes waiting on <nick>.
         """
         try:
-            del self._notes[nick]
-            self._flushNotes()
+            self._journal('-', nick, self._pop(nick))
             irc.replySuccess()
         except KeyError:
             irc.error('There were no notes for %r' % nick)
@@ -205,22 +275,23 @@ class Later(callbacks.Plugin):
     def doPrivmsg(self, irc, msg):
         if ircmsgs.isCtcp(msg) and not ircmsgs.isAction(msg):
             return
-        notes = self._notes.pop(msg.nick, [])
+        nicks = []
+        if msg.nick in self._notes:
+            nicks.append(msg.nick)
         # Let's try wildcards.
-        removals = []
-        for wildcard in self.wildcards:
-            if ircutils.hostmaskPatternEqual(wildcard, msg.nick):
-                removals.append(wildcard)
-                notes.extend(self._notes.pop(wildcard))
-            for removal in removals:
-                self.wildcards.remove(removal)
-        if notes:
+        for key in (self._wildcardKey(msg.nick), ''):
+            for wildcard in self.wildcards.get(key, ()):
+                if ircutils.hostmaskPatternEqual(wildcard, msg.nick):
+                    nicks.append(wildcard)
+        if nicks:
             irc = callbacks.SimpleProxy(irc, msg)
             private = self.registryValue('private')
-            for (when, whence, note) in notes:
-                s = self._formatNote(when, whence, note)
-                irc.reply(s, private=private)
-            self._flushNotes()
+            for nick in nicks:
+                notes = self._pop(nick)
+                for (when, whence, note) in notes:
+                    s = self._formatNote(when, whence, note)
+                    irc.reply(s, private=private)
+                self._journal('-', nick, notes)
 
     def _formatNote(self, when, whence, note):
         return 'Sent %s: <%s> %s' % (self._timestamp(when), whence, note)
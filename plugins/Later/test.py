@@ -73,6 +73,56 @@ class LaterTestCase(ChannelPluginTestCase):
         self.failUnless(str(m).startswith('PRIVMSG foo :Sent just now: <test> stuff'))
         self.assertNotRegexp('later notes', 'foo')
         self.assertRegexp('later notes', 'bar')
-        
+
+    def testWildcards(self):
+        # tell only takes nicks, but notes for wildcards can still be added.
+        cb = self.irc.getCallback('Later')
+        cb._addNote('F?o', 'test', 'stuff')
+        cb._addNote('*bar', 'test', 'more stuff')
+        cb._addNote('b*z', 'test', 'yet more stuff')
+        self.irc.feedMsg(ircmsgs.privmsg(self.channel, 'something',
+                                         prefix='xbar!x@y'))
+        self.assertEqual(self.getMsg(' ').args,
+                         ('xbar', 'Sent just now: <test> more stuff'))
+        self.irc.feedMsg(ircmsgs.privmsg(self.channel, 'something',
+                                         prefix='FOO!x@y'))
+        self.assertEqual(self.getMsg(' ').args,
+                         ('FOO', 'Sent just now: <test> stuff'))
+        self.assertResponse('later notes',
+                            'I currently have notes waiting for b*z.')
+
+    def testJournal(self):
+        journal = conf.supybot.databases.types.journal.maximumModifications
+        original = journal()
+        cb = self.irc.getCallback('Later')
+        def reopen():
+            cb._notes.clear()
+            cb.wildcards.clear()
+            cb.journalSize = 0
+            cb.noteCount = 0
+            cb._openNotes()
+        try:
+            journal.setValue(1.0)
+            self.assertNotError('later tell foo stuff')
+            cb._addNote('b*', 'test', 'more stuff')
+            self.assertNotError('later tell baz still more stuff')
+            self.failUnless(os.path.exists(cb.journalName))
+            reopen()
+            self.assertEqual(cb.noteCount, 3)
+            self.assertRegexp('later notes', r'b\*, baz, and foo')
+            self.irc.feedMsg(ircmsgs.privmsg(self.channel, 'something',
+                                             prefix='bar!x@y'))
+            self.assertRegexp(' ', 'more stuff')
+            # That was a fourth change with two notes left, so the journal
+            # was compacted.
+            self.failIf(os.path.exists(cb.journalName))
+            reopen()
+            self.assertEqual(cb.noteCount, 2)
+            self.assertResponse('later notes',
+                                'I currently have notes waiting for baz '
+                                'and foo.')
+        finally:
+            journal.setValue(original)
+
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
 
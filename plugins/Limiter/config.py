@@ -52,6 +52,15 @@ conf.registerChannelValue(Limiter, 'maximumExcess',
     registry.PositiveInteger(10, """Determines the maximum number of free spots
     that will be saved when limits are being enforced.  This should always be
     larger than supybot.plugins.Limiter.limit.minimumExcess."""))
+conf.registerChannelValue(Limiter, 'delay',
+    registry.NonNegativeInteger(3, """Determines how many seconds the bot will
+    wait before changing the limit, so a burst of joins, parts, or quits gets
+    only one limit change, for the number of people in the channel once it's
+    over.  If this is 0, the limit is changed as soon as it needs to be."""))
+conf.registerChannelValue(Limiter.delay, 'maximumSwing',
+    registry.PositiveInteger(20, """Determines how far off the channel's limit
+    can be before the bot changes it right away, rather than waiting for
+    supybot.plugins.Limiter.delay to pass."""))
 
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -28,9 +28,12 @@
 # POSSIBILITY OF SUCH DAMAGE.
 ###
 
+import time
+
 from supybot.commands import *
 import supybot.ircmsgs as ircmsgs
 import supybot.ircutils as ircutils
+import supybot.schedule as schedule
 import supybot.callbacks as callbacks
 
 
@@ -42,11 +45,24 @@ class Limiter(callbacks.Plugin):
     Once these are set, and someone enters/leaves the channel, Supybot will
     start setting the proper +l modes.
     """
+    def __init__(self, irc):
+        self.__parent = super(Limiter, self)
+        self.__parent.__init__(irc)
+        # Maps (irc, channel) to the name of the event that'll enforce the
+        # channel's limit once supybot.plugins.Limiter.delay has passed.
+        self.events = {}
+
+    def die(self):
+        for name in self.events.itervalues():
+            schedule.removeEvent(name)
+        self.events.clear()
+        self.__parent.die()
+
     def _enforce(self, irc, limit):
         irc.queueMsg(limit)
         irc.noReply()
 
-    def _enforceLimit(self, irc, channel):
+    def _enforceLimit(self, irc, channel, wait=True):
         if self.registryValue('enable', channel):
             maximum = self.registryValue('maximumExcess', channel)
             minimum = self.registryValue('minimumExcess', channel)
@@ -54,9 +70,36 @@ class Limiter(callbacks.Plugin):
             currentUsers = len(irc.state.channels[channel].users)
             currentLimit = irc.state.channels[channel].modes.get('l', 0)
             if currentLimit - currentUsers < minimum:
-                self._enforce(irc, ircmsgs.limit(channel,currentUsers+maximum))
+                limit = currentUsers + maximum
             elif currentLimit - currentUsers > maximum:
-                self._enforce(irc, ircmsgs.limit(channel,currentUsers+minimum))
+                limit = currentUsers + minimum
+            else:
+                return
+            # Small changes wait a bit, in case more joins or parts come along
+            # to supersede them; a channel without a limit, or with one that's
+            # far off, gets its new limit right away.
+            delay = self.registryValue('delay', channel)
+            maximumSwing = self.registryValue('delay.maximumSwing', channel)
+            if wait and delay and currentLimit and \
+               abs(limit - currentLimit) <= maximumSwing:
+                self._delayLimit(irc, channel, delay)
+            else:
+                self._cancelLimit(irc, channel)
+                self._enforce(irc, ircmsgs.limit(channel, limit))
+
+    def _delayLimit(self, irc, channel, delay):
+        key = (irc, ircutils.toLower(channel))
+        if key not in self.events:
+            def f():
+                del self.events[key]
+                if channel in irc.state.channels:
+                    self._enforceLimit(irc, channel, wait=False)
+            self.events[key] = schedule.addEvent(f, time.time() + delay)
+
+    def _cancelLimit(self, irc, channel):
+        key = (irc, ircutils.toLower(channel))
+        if key in self.events:
+            schedule.removeEvent(self.events.pop(key))
 
     def doJoin(self, irc, msg):
         if not ircutils.strEqual(msg.nick, irc.nick):
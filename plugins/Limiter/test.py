@@ -29,15 +29,19 @@
 
 from supybot.test import *
 
+import supybot.schedule as schedule
+
 class LimiterTestCase(ChannelPluginTestCase):
     plugins = ('Limiter',)
     config = {'supybot.plugins.Limiter.enable': True}
     def testEnforceLimit(self):
         origMin = conf.supybot.plugins.Limiter.minimumExcess()
         origMax = conf.supybot.plugins.Limiter.maximumExcess()
+        origDelay = conf.supybot.plugins.Limiter.delay()
         try:
             conf.supybot.plugins.Limiter.minimumExcess.setValue(5)
             conf.supybot.plugins.Limiter.maximumExcess.setValue(10)
+            conf.supybot.plugins.Limiter.delay.setValue(0)
             self.irc.feedMsg(ircmsgs.join('#foo', prefix='foo!root@host'))
             m = self.irc.takeMsg()
             self.assertEqual(m, ircmsgs.limit('#foo', 1+10))
@@ -51,6 +55,53 @@ class LimiterTestCase(ChannelPluginTestCase):
         finally:
             conf.supybot.plugins.Limiter.minimumExcess.setValue(origMin)
             conf.supybot.plugins.Limiter.maximumExcess.setValue(origMax)
+            conf.supybot.plugins.Limiter.delay.setValue(origDelay)
+
+    def users(self):
+        return len(self.irc.state.channels[self.channel].users)
+
+    def join(self, i):
+        self.irc.feedMsg(ircmsgs.join(self.channel,
+                                      prefix='user%s!root@host' % i))
+
+    def testCoalescesJoinStorm(self):
+        origDelay = conf.supybot.plugins.Limiter.delay()
+        try:
+            conf.supybot.plugins.Limiter.delay.setValue(60)
+            self.join(0)
+            m = self.irc.takeMsg()
+            self.assertEqual(m, ircmsgs.limit(self.channel, self.users()+10))
+            for i in range(1, 16):
+                self.join(i)
+                self.assertEqual(self.irc.takeMsg(), None)
+            events = self.irc.getCallback('Limiter').events.values()
+            self.assertEqual(len(events), 1)
+            # Run the delayed limit now, as schedule.run would once it's due.
+            schedule.removeEvent(events[0])()
+            m = self.irc.takeMsg()
+            self.assertEqual(m, ircmsgs.limit(self.channel, self.users()+10))
+            self.assertEqual(self.irc.takeMsg(), None)
+        finally:
+            conf.supybot.plugins.Limiter.delay.setValue(origDelay)
+
+    def testLargeSwingIsImmediate(self):
+        origDelay = conf.supybot.plugins.Limiter.delay()
+        try:
+            conf.supybot.plugins.Limiter.delay.setValue(60)
+            self.join(0)
+            m = self.irc.takeMsg()
+            self.assertEqual(m, ircmsgs.limit(self.channel, self.users()+10))
+            limits = []
+            for i in range(1, 40):
+                self.join(i)
+                m = self.irc.takeMsg()
+                if m is not None:
+                    limits.append((self.users(), m))
+            self.failUnless(limits)
+            for (users, m) in limits:
+                self.assertEqual(m, ircmsgs.limit(self.channel, users+10))
+        finally:
+            conf.supybot.plugins.Limiter.delay.setValue(origDelay)
 
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -261,7 +261,8 @@ class Owner(callbacks.Plugin):
                            utils.timeElapsed(punishment, seconds=False)))
                 return
             try:
-                tokens = callbacks.tokenize(s, channel=msg.args[0])
+                tokens = callbacks.tokenize(s, channel=msg.args[0],
+                                            frozen=True)
                 self.Proxy(irc, msg, tokens)
             except SyntaxError, e:
                 irc.queueMsg(callbacks.error(msg, str(e)))
@@ -29,8 +29,10 @@
 ###
 
 import os
+import re
 import time
 import random
+import string
 
 import supybot.dbi as dbi
 import supybot.conf as conf
@@ -64,6 +66,33 @@ class QuoteGrabsRecord(dbi.Record):
         return format('%s (Said by: %s; grabbed by %s at %t)',
                       self.text, self.hostmask, grabber, self.at)
 
+# Quotes are indexed by the (lowercased, since LIKE doesn't care about case)
+# trigrams in them, so searches only check LIKE against the quotes having every
+# trigram the search does, and by the (IRC-lowercased) nick that said them, so
+# lookups by nick don't have to read the whole quotegrabs table.
+def indexTerms(s):
+    """Returns the terms a quote is indexed under."""
+    s = s.lower()
+    return set([s[i:i+3] for i in xrange(len(s) - 2)])
+
+# SQLite won't bind more than 999 variables in a statement; the LIKE still
+# checks every quote the index picks, so fewer terms only mean more checking.
+maximumTerms = 900
+
+def likeTerms(pattern):
+    """Returns the terms any quote matching the LIKE pattern is indexed under.
+    """
+    terms = set()
+    for part in re.split('[%_]', pattern):
+        terms.update(indexTerms(part))
+    return terms
+
+# Search results are ranked by how many of the search's words they have whole.
+_wordRe = re.compile('[^\\s%s]+' % re.escape(string.punctuation))
+def words(s):
+    """Returns the set of words in s, lowercased."""
+    return set(_wordRe.findall(s.lower()))
+
 class SqliteQuoteGrabsDB(object):
     def __init__(self, filename):
         self.dbs = ircutils.IrcDict()
@@ -75,21 +104,16 @@ class SqliteQuoteGrabsDB(object):
 
     def _getDb(self, channel):
         filename = plugins.makeChannelFilename(self.filename, channel)
-        def p(s1, s2):
-            # text_factory seems to only apply as an output adapter,
-            # so doesn't apply to created functions; so we use str()
-            return ircutils.nickEqual(str(s1), str(s2))
         if filename in self.dbs:
             return self.dbs[filename]
         if os.path.exists(filename):
             db = sqlite3.connect(filename)
             db.text_factory = str
-            db.create_function('nickeq', 2, p)
+            self._makeIndex(db)
             self.dbs[filename] = db
             return db
         db = sqlite3.connect(filename)
         db.text_factory = str
-        db.create_function('nickeq', 2, p)
         self.dbs[filename] = db
         cursor = db.cursor()
         cursor.execute("""CREATE TABLE quotegrabs (
@@ -101,8 +125,42 @@ class SqliteQuoteGrabsDB(object):
                           quote TEXT
                           );""")
         db.commit()
+        self._makeIndex(db)
         return db
 
+    def _makeIndex(self, db):
+        """Creates the search and nick indexes, and fills them in if the
+        database was made before there were any."""
+        cursor = db.cursor()
+        cursor.execute("""SELECT name FROM sqlite_master
+                          WHERE type='table' AND name='quotegrabs_terms'""")
+        if cursor.fetchall():
+            return
+        for (table, column) in [('terms', 'term'), ('nicks', 'nick')]:
+            cursor.execute("""CREATE TABLE quotegrabs_%s (
+                              %s TEXT,
+                              id INTEGER
+                              )""" % (table, column))
+            cursor.execute("""CREATE INDEX quotegrabs_%s_%s
+                              ON quotegrabs_%s (%s, id)""" %
+                           (table, column, table, column))
+            cursor.execute("""CREATE INDEX quotegrabs_%s_id
+                              ON quotegrabs_%s (id)""" % (table, table))
+        cursor.execute("""SELECT id, nick, quote FROM quotegrabs""")
+        for (id, nick, quote) in cursor.fetchall():
+            self._index(cursor, id, nick, quote)
+        db.commit()
+
+    def _index(self, cursor, id, nick, quote):
+        cursor.execute("""INSERT INTO quotegrabs_nicks VALUES (?, ?)""",
+                       (ircutils.toLower(nick), id))
+        cursor.executemany("""INSERT INTO quotegrabs_terms VALUES (?, ?)""",
+                           [(term, id) for term in indexTerms(quote)])
+
+    def _unindex(self, cursor, id):
+        cursor.execute("""DELETE FROM quotegrabs_nicks WHERE id=?""", (id,))
+        cursor.execute("""DELETE FROM quotegrabs_terms WHERE id=?""", (id,))
+
     def get(self, channel, id):
         db = self._getDb(channel)
         cursor = db.cursor()
@@ -119,13 +177,24 @@ class SqliteQuoteGrabsDB(object):
         db = self._getDb(channel)
         cursor = db.cursor()
         if nick:
-            cursor.execute("""SELECT quote FROM quotegrabs
-                              WHERE nickeq(nick, ?)
-                              ORDER BY random() LIMIT 1""",
-                              (nick,))
+            cursor.execute("""SELECT id FROM quotegrabs_nicks WHERE nick=?""",
+                           (ircutils.toLower(nick),))
+            ids = cursor.fetchall()
+            if len(ids) == 0:
+                raise dbi.NoRecordError
+            cursor.execute("""SELECT quote FROM quotegrabs WHERE id=?""",
+                           random.choice(ids))
         else:
+            # Skipping to a random offset, rather than ordering the whole table
+            # by random(), doesn't sort every quote, and unlike picking a
+            # random id, doesn't favor the quotes after gaps left by ungrabs.
+            cursor.execute("""SELECT count(*) FROM quotegrabs""")
+            (count,) = cursor.fetchone()
+            if count == 0:
+                raise dbi.NoRecordError
             cursor.execute("""SELECT quote FROM quotegrabs
-                              ORDER BY random() LIMIT 1""")
+                              ORDER BY id LIMIT 1 OFFSET ?""",
+                           (random.randint(0, count-1),))
         results = cursor.fetchall()
         if len(results) == 0:
             raise dbi.NoRecordError
@@ -135,8 +204,10 @@ class SqliteQuoteGrabsDB(object):
         db = self._getDb(channel)
         cursor = db.cursor()
         cursor.execute("""SELECT id, quote FROM quotegrabs
-                          WHERE nickeq(nick, ?)
-                          ORDER BY id DESC""", (nick,))
+                          WHERE id IN (SELECT id FROM quotegrabs_nicks
+                                       WHERE nick=?)
+                          ORDER BY id DESC""",
+                       (ircutils.toLower(nick),))
         results = cursor.fetchall()
         if len(results) == 0:
             raise dbi.NoRecordError
@@ -147,8 +218,10 @@ class SqliteQuoteGrabsDB(object):
         db = self._getDb(channel)
         cursor = db.cursor()
         cursor.execute("""SELECT quote FROM quotegrabs
-                          WHERE nickeq(nick, ?)
-                          ORDER BY id DESC LIMIT 1""", (nick,))
+                          WHERE id IN (SELECT id FROM quotegrabs_nicks
+                                       WHERE nick=?)
+                          ORDER BY id DESC LIMIT 1""",
+                       (ircutils.toLower(nick),))
         results = cursor.fetchall()
         if len(results) == 0:
             raise dbi.NoRecordError
@@ -158,8 +231,10 @@ class SqliteQuoteGrabsDB(object):
         db = self._getDb(channel)
         cursor = db.cursor()
         cursor.execute("""SELECT added_at FROM quotegrabs
-                          WHERE nickeq(nick, ?)
-                          ORDER BY id DESC LIMIT 1""", (nick,))
+                          WHERE id IN (SELECT id FROM quotegrabs_nicks
+                                       WHERE nick=?)
+                          ORDER BY id DESC LIMIT 1""",
+                       (ircutils.toLower(nick),))
         results = cursor.fetchall()
         if len(results) == 0:
             raise dbi.NoRecordError
@@ -171,8 +246,10 @@ class SqliteQuoteGrabsDB(object):
         text = ircmsgs.prettyPrint(msg)
         # Check to see if the latest quotegrab is identical
         cursor.execute("""SELECT quote FROM quotegrabs
-                          WHERE nick=?
-                          ORDER BY id DESC LIMIT 1""", (msg.nick,))
+                          WHERE id IN (SELECT id FROM quotegrabs_nicks
+                                       WHERE nick=?) AND nick=?
+                          ORDER BY id DESC LIMIT 1""",
+                       (ircutils.toLower(msg.nick), msg.nick))
         results = cursor.fetchall()
         if len(results) != 0:
             if text == results[0][0]:
@@ -180,6 +257,7 @@ class SqliteQuoteGrabsDB(object):
         cursor.execute("""INSERT INTO quotegrabs
                           VALUES (NULL, ?, ?, ?, ?, ?)""",
                        (msg.nick, msg.prefix, by, int(time.time()), text,))
+        self._index(cursor, cursor.lastrowid, msg.nick, text)
         db.commit()
 
     def remove(self, channel, grab=None):
@@ -194,27 +272,41 @@ class SqliteQuoteGrabsDB(object):
             results = cursor.fetchall()
             if len(results) == 0:
                 raise dbi.NoRecordError
-            cursor.execute("""DELETE FROM quotegrabs WHERE id = ?""", (grab,))
         else:
             cursor.execute("""SELECT * FROM quotegrabs WHERE id = (SELECT MAX(id)
                 FROM quotegrabs)""")
             results = cursor.fetchall()
             if len(results) == 0:
                 raise dbi.NoRecordError
-            cursor.execute("""DELETE FROM quotegrabs WHERE id = (SELECT MAX(id)
-                FROM quotegrabs)""")
+            grab = results[0][0]
+        cursor.execute("""DELETE FROM quotegrabs WHERE id = ?""", (grab,))
+        self._unindex(cursor, grab)
         db.commit()
 
     def search(self, channel, text):
+        """Returns the quotes with text in them (as a LIKE pattern), those with
+        the most of its words whole first, and newest first among equals."""
         db = self._getDb(channel)
         cursor = db.cursor()
-        text = '%' + text + '%'
-        cursor.execute("""SELECT id, nick, quote FROM quotegrabs
-                          WHERE quote LIKE ?
-                          ORDER BY id DESC""", (text,))
+        sql = """SELECT id, nick, quote FROM quotegrabs WHERE quote LIKE ?"""
+        pattern = '%' + text + '%'
+        args = [pattern]
+        terms = list(likeTerms(pattern.lower()))[:maximumTerms]
+        if terms:
+            sql += """ AND id IN (SELECT id FROM quotegrabs_terms
+                                  WHERE term IN (%s)
+                                  GROUP BY id
+                                  HAVING count(*)=%s)""" % \
+                   (', '.join('?' * len(terms)), len(terms))
+            args.extend(terms)
+        cursor.execute(sql, args)
         results = cursor.fetchall()
         if len(results) == 0:
             raise dbi.NoRecordError
+        textWords = words(text)
+        def relevance((id, nick, quote)):
+            return (len(textWords & words(quote)), id)
+        results.sort(key=relevance, reverse=True)
         return [QuoteGrabsRecord(id, text=quote, by=nick)
                 for (id, nick, quote) in results]
 
@@ -367,8 +459,9 @@ class QuoteGrabs(callbacks.Plugin):
     def search(self, irc, msg, args, channel, text):
         """[<channel>] <text>
 
-        Searches for <text> in a quote.  <channel> is only necessary if the
-        message isn't sent in the channel itself.
+        Searches for <text> in a quote.  Quotes having more of the words in
+        <text> whole come first, and newer ones first among those.  <channel>
+        is only necessary if the message isn't sent in the channel itself.
         """
         try:
             records = self.db.search(channel, text)
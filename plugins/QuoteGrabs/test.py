@@ -126,6 +126,24 @@ class QuoteGrabsTestCase(ChannelPluginTestCase):
         self.assertResponse('random foo', '<foo> testRandom')
         self.assertResponse('random FOO', '<foo> testRandom')
 
+    def testRandomIsUniformAcrossUngrabs(self):
+        for i in range(50):
+            self.irc.feedMsg(ircmsgs.privmsg(self.channel, 'quote %s' % i,
+                                             prefix='foo!bar@baz'))
+            self.assertNotError('grab foo')
+        for id in range(2, 50):
+            self.assertNotError('ungrab %s' % id)
+        # Quote #50 follows a gap of 48 ungrabbed quotes, but shouldn't come
+        # up any more often than quote #1.
+        first = 0
+        for i in range(100):
+            m = self.getMsg('random')
+            if m.args[1].endswith('quote 0'):
+                first += 1
+            else:
+                self.failUnless(m.args[1].endswith('quote 49'), m)
+        self.failUnless(20 <= first <= 80, first)
+
     def testGet(self):
         testPrefix= 'foo!bar@baz'
         self.assertError('quotegrabs get asdf')
@@ -143,6 +161,48 @@ class QuoteGrabsTestCase(ChannelPluginTestCase):
         self.assertNotError('grab foo')
         self.assertNotError('quotegrabs search test')
 
+    def testSearchRelevance(self):
+        for (nick, s) in [('foo', 'the cat sat on the mat'),
+                          ('bar', 'a mat, and then a cat'),
+                          ('baz', 'cats and dogs'),
+                          ('qux', 'no pets here')]:
+            self.irc.feedMsg(ircmsgs.privmsg(self.channel, s,
+                                             prefix='%s!user@host' % nick))
+            self.assertNotError('grab %s' % nick)
+        self.assertResponse('quotegrabs search CAT',
+                            '#2: a mat, and then a cat, #1: the cat sat on '
+                            'the mat, and #3: cats and dogs')
+        self.assertResponse('quotegrabs search the',
+                            '#1: the cat sat on the mat and '
+                            '#2: a mat, and then a cat')
+        self.assertResponse('quotegrabs search sat on the',
+                            '#1: the cat sat on the mat')
+        self.assertResponse('quotegrabs search at',
+                            '#3: cats and dogs, #2: a mat, and then a cat, '
+                            'and #1: the cat sat on the mat')
+        self.assertError('quotegrabs search cat mat')
+        self.assertResponse('quotegrabs search c_t%d',
+                            '#3: cats and dogs')
+        self.assertNotError('ungrab 1')
+        self.assertResponse('quotegrabs search mat',
+                            '#2: a mat, and then a cat')
+        self.assertRegexp('quotegrabs search ,', '#2: a mat')
+
+    def testIndexesExistingDatabase(self):
+        testPrefix = 'foo!bar@baz'
+        self.irc.feedMsg(ircmsgs.privmsg(self.channel, 'something old',
+                                         prefix=testPrefix))
+        self.assertNotError('grab foo')
+        cb = self.irc.getCallback('QuoteGrabs')
+        for db in cb.db.dbs.values():
+            db.execute('DROP TABLE quotegrabs_terms')
+            db.execute('DROP TABLE quotegrabs_nicks')
+        cb.db.close()
+        cb.db.dbs.clear()
+        self.assertResponse('quotegrabs search old', '#1: something old')
+        self.assertResponse('quote FOO', '<foo> something old')
+        self.assertResponse('random foo', '<foo> something old')
+
 class QuoteGrabsNonChannelTestCase(QuoteGrabsTestCase):
     config = { 'databases.plugins.channelSpecific' : False }
 
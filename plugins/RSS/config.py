@@ -109,5 +109,19 @@ conf.registerGlobalValue(RSS.announce, 'cachePeriod',
     registry.PositiveInteger(604800, """Maximum age of cached RSS headlines,
     in seconds. Headline cache is used to avoid re-announcing old news."""))
 
+conf.registerGroup(RSS, 'fetch')
+conf.registerGlobalValue(RSS.fetch, 'threads',
+    registry.PositiveInteger(4, """Determines how many threads the bot will
+    use to fetch announced feeds.  Changes take effect when the plugin is
+    reloaded."""))
+conf.registerGlobalValue(RSS.fetch, 'threadsPerHost',
+    registry.PositiveInteger(1, """Determines how many announced feeds the bot
+    will fetch at once from any one host.  Changes take effect when the plugin
+    is reloaded."""))
+conf.registerGlobalValue(RSS.fetch, 'maximumQueued',
+    registry.PositiveInteger(100, """Determines how many announced feeds may be
+    waiting to be fetched; feeds beyond this are skipped until the next time
+    they're due.  Changes take effect when the plugin is reloaded."""))
+
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -32,14 +32,19 @@ import new
 import time
 import socket
 import sgmllib
+import urlparse
 import threading
+import collections
 import re
 
+import supybot.log as log
 import supybot.conf as conf
 import supybot.utils as utils
 import supybot.world as world
 from supybot.commands import *
+import supybot.ircmsgs as ircmsgs
 import supybot.ircutils as ircutils
+import supybot.schedule as schedule
 import supybot.registry as registry
 import supybot.callbacks as callbacks
 
@@ -57,12 +62,115 @@ def getFeedName(irc, msg, args, state):
     state.args.append(callbacks.canonicalName(args.pop(0)))
 addConverter('feedName', getFeedName)
 
+class FeedFetcher(object):
+    """A fixed number of threads calling fetch(url) for the urls given to
+    submit, with at most perHost of them talking to any one host, and at most
+    maxQueued urls waiting for a thread.  Submitting a url that's already
+    waiting or being fetched doesn't fetch it again; the callback is just
+    called with the same results.  Callbacks are called (with the results, or
+    None if fetch raised an exception) in the fetching thread."""
+    def __init__(self, fetch, threads, perHost, maxQueued, name='Fetcher'):
+        self.fetch = fetch
+        self.threads = threads
+        self.perHost = perHost
+        self.maxQueued = maxQueued
+        self.name = name
+        self.cond = threading.Condition()
+        self.queue = collections.deque()
+        self.callbacks = {} # url : [callback], for queued and running urls.
+        self.hosts = {} # host : number of running fetches.
+        self.workers = []
+        self.stopped = False
+
+    def _host(self, url):
+        return urlparse.urlsplit(url)[1].lower()
+
+    def submit(self, url, callback):
+        """Returns False if the url couldn't be queued."""
+        self.cond.acquire()
+        try:
+            if url in self.callbacks:
+                self.callbacks[url].append(callback)
+                return True
+            if len(self.queue) >= self.maxQueued:
+                return False
+            self.callbacks[url] = [callback]
+            self.queue.append(url)
+            if len(self.workers) < self.threads:
+                name = '%s #%s' % (self.name, len(self.workers) + 1)
+                worker = world.SupyThread(target=self._work, name=name)
+                worker.setDaemon(True)
+                self.workers.append(worker)
+                worker.start()
+            self.cond.notify()
+            return True
+        finally:
+            self.cond.release()
+
+    def busy(self):
+        return bool(self.callbacks)
+
+    def stop(self):
+        self.cond.acquire()
+        try:
+            self.stopped = True
+            self.queue.clear()
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+    def _next(self):
+        # Must be called with self.cond held.
+        for (i, url) in enumerate(self.queue):
+            if self.hosts.get(self._host(url), 0) < self.perHost:
+                del self.queue[i]
+                return url
+        return None
+
+    def _work(self):
+        while True:
+            self.cond.acquire()
+            try:
+                url = self._next()
+                while url is None and not self.stopped:
+                    self.cond.wait()
+                    url = self._next()
+                if self.stopped:
+                    return
+                host = self._host(url)
+                self.hosts[host] = self.hosts.get(host, 0) + 1
+            finally:
+                self.cond.release()
+            try:
+                results = self.fetch(url)
+            except Exception, e:
+                log.exception('Uncaught exception fetching %s:', url)
+                results = None
+            self.cond.acquire()
+            try:
+                self.hosts[host] -= 1
+                if not self.hosts[host]:
+                    del self.hosts[host]
+                callbacks = self.callbacks.pop(url)
+                self.cond.notifyAll()
+            finally:
+                self.cond.release()
+            for callback in callbacks:
+                try:
+                    callback(results)
+                except Exception, e:
+                    log.exception('Uncaught exception in callback for %s:',
+                                  url)
+
 class RSS(callbacks.Plugin):
     """This plugin is useful both for announcing updates to RSS feeds in a
     channel, and for retrieving the headlines of RSS feeds via command.  Use
     the "add" command to add feeds to this plugin, and use the "announce"
     command to determine what feeds should be announced in a given channel."""
     threaded = True
+    # The longest we'll go without checking whether there are announced feeds
+    # to fetch, so changes to what's announced where get noticed.
+    pollInterval = 60
     def __init__(self, irc):
         self.__parent = super(RSS, self)
         self.__parent.__init__(irc)
@@ -72,7 +180,21 @@ class RSS(callbacks.Plugin):
         self.lastRequest = {}
         self.cachedFeeds = {}
         self.cachedHeadlines = {}
+        # Schema is url : (etag, modified), as last returned by the server.
+        self.validators = {}
         self.gettingLockLock = threading.Lock()
+        self.pollEvent = 'RSS announcements'
+        self.nextPoll = None
+        # Feeds are fetched by the fetcher's threads, which leave the results
+        # here for the main loop to announce.
+        self.fetcher = FeedFetcher(self.getFeed,
+                                   self.registryValue('fetch.threads'),
+                                   self.registryValue('fetch.threadsPerHost'),
+                                   self.registryValue('fetch.maximumQueued'),
+                                   name='RSS fetcher')
+        self.fetched = collections.deque()
+        self.fetchedEvent = 'RSS fetched feeds'
+        self.checkingFetched = False
         for name in self.registryValue('feeds'):
             self._registerFeed(name)
             try:
@@ -82,6 +204,17 @@ class RSS(callbacks.Plugin):
                 continue
             self.makeFeedCommand(name, url)
             self.getFeed(url) # So announced feeds don't announce on startup.
+        self._schedulePoll(time.time())
+
+    def die(self):
+        if self.nextPoll is not None:
+            schedule.removeEvent(self.pollEvent)
+            self.nextPoll = None
+        if self.checkingFetched:
+            schedule.removeEvent(self.fetchedEvent)
+            self.checkingFetched = False
+        self.fetcher.stop()
+        self.__parent.die()
 
     def isCommandMethod(self, name):
         if not self.__parent.isCommandMethod(name):
@@ -106,38 +239,70 @@ class RSS(callbacks.Plugin):
         group = self.registryValue('feeds', value=False)
         conf.registerGlobalValue(group, name, registry.String(url, ''))
 
-    def __call__(self, irc, msg):
-        self.__parent.__call__(irc, msg)
-        irc = callbacks.SimpleProxy(irc, msg)
-        newFeeds = {}
-        for channel in irc.state.channels:
-            feeds = self.registryValue('announce', channel)
-            for name in feeds:
-                commandName = callbacks.canonicalName(name)
-                if self.isCommandMethod(commandName):
-                    url = self.feedNames[commandName][0]
-                else:
-                    url = name
-                if self.willGetNewFeed(url):
-                    newFeeds.setdefault((url, name), []).append(channel)
-        for ((url, name), channels) in newFeeds.iteritems():
-            # We check if we can acquire the lock right here because if we
-            # don't, we'll possibly end up spawning a lot of threads to get
-            # the feed, because this thread may run for a number of bytecodes
-            # before it switches to a thread that'll get the lock in
-            # _newHeadlines.
-            if self.acquireLock(url, blocking=False):
-                try:
-                    t = threading.Thread(target=self._newHeadlines,
-                                         name=format('Fetching %u', url),
-                                         args=(irc, channels, name, url))
-                    self.log.info('Checking for announcements at %u', url)
-                    world.threadsSpawned += 1
-                    t.setDaemon(True)
-                    t.start()
-                finally:
-                    self.releaseLock(url)
-                    time.sleep(0.1) # So other threads can run.
+    def _schedulePoll(self, when):
+        if self.nextPoll is not None:
+            if self.nextPoll <= when:
+                return
+            schedule.removeEvent(self.pollEvent)
+        self.nextPoll = when
+        schedule.addEvent(self._poll, when, self.pollEvent)
+
+    def _getAnnouncedFeeds(self):
+        """Returns a dict mapping each (url, name) announced anywhere to the
+        (irc, channel) pairs it's announced to."""
+        feeds = {}
+        for irc in world.ircs:
+            for channel in irc.state.channels:
+                for name in self.registryValue('announce', channel):
+                    commandName = callbacks.canonicalName(name)
+                    if self.isCommandMethod(commandName):
+                        url = self.feedNames[commandName][0]
+                    else:
+                        url = name
+                    feeds.setdefault((url, name), []).append((irc, channel))
+        return feeds
+
+    def _poll(self):
+        self.nextPoll = None
+        now = time.time()
+        wait = self.registryValue('waitPeriod')
+        nextPoll = now + self.pollInterval
+        for ((url, name), targets) in self._getAnnouncedFeeds().iteritems():
+            if not self.willGetNewFeed(url):
+                nextPoll = min(nextPoll, self.lastRequest[url] + wait)
+                continue
+            # If this fetch fails, getFeed backs off for half a waitPeriod.
+            nextPoll = min(nextPoll, now + .5 * wait)
+            self.log.info('Checking for announcements at %u', url)
+            def fetched(results, url=url, name=name, targets=targets,
+                        oldresults=self.cachedFeeds.get(url)):
+                self.fetched.append((targets, name, url, oldresults, results))
+            if not self.fetcher.submit(url, fetched):
+                self.log.warning('Too many feeds waiting to be fetched; '
+                                 'not checking %u this time.', url)
+        # If a fetch is still in flight from the last poll, the pending check
+        # will pick up this poll's results too.
+        if not self.checkingFetched:
+            self._checkFetched()
+        # willGetNewFeed wants strictly more than waitPeriod to have passed.
+        self._schedulePoll(max(nextPoll, now + 1))
+
+    def _checkFetched(self):
+        """Announces what the fetcher's fetched so far, and keeps checking
+        (from the main loop) while it's still busy.  Must only be called when
+        no check is already scheduled."""
+        self.checkingFetched = False
+        while self.fetched:
+            args = self.fetched.popleft()
+            try:
+                self._newHeadlines(*args)
+            except Exception, e:
+                self.log.exception('Uncaught exception announcing %u:',
+                                   args[2])
+        if self.fetcher.busy() or self.fetched:
+            schedule.addEvent(self._checkFetched, time.time() + 1,
+                              self.fetchedEvent)
+            self.checkingFetched = True
 
     def buildHeadlines(self, headlines, channel, linksconfig='announce.showLinks', dateconfig='announce.showPubDate'):
         newheadlines = []
@@ -159,80 +324,74 @@ class RSS(callbacks.Plugin):
                                        pubDate))
         return newheadlines
 
-    def _newHeadlines(self, irc, channels, name, url):
+    def _newHeadlines(self, targets, name, url, oldresults, newresults):
+        if newresults is None or newresults is oldresults:
+            self.log.debug('%u hasn\'t changed.', url)
+            return
+        t = time.time()
         try:
-            # We acquire the lock here so there's only one announcement thread
-            # in this code at any given time.  Otherwise, several announcement
-            # threads will getFeed (all blocking, in turn); then they'll all
-            # want to send their news messages to the appropriate channels.
-            # Note that we're allowed to acquire this lock twice within the
-            # same thread because it's an RLock and not just a normal Lock.
-            self.acquireLock(url)
-            t = time.time()
-            try:
-                #oldresults = self.cachedFeeds[url]
-                #oldheadlines = self.getHeadlines(oldresults)
-                oldheadlines = self.cachedHeadlines[url]
-                oldheadlines = filter(lambda x: t - x[3] < self.registryValue('announce.cachePeriod'), oldheadlines)
-            except KeyError:
-                oldheadlines = []
-            newresults = self.getFeed(url)
-            newheadlines = self.getHeadlines(newresults)
-            if len(newheadlines) == 1:
-                s = newheadlines[0][0]
-                if s in ('Timeout downloading feed.',
-                         'Unable to download feed.'):
-                    self.log.debug('%s %u', s, url)
+            #oldresults = self.cachedFeeds[url]
+            #oldheadlines = self.getHeadlines(oldresults)
+            oldheadlines = self.cachedHeadlines[url]
+            oldheadlines = filter(lambda x: t - x[3] < self.registryValue('announce.cachePeriod'), oldheadlines)
+        except KeyError:
+            oldheadlines = []
+        newheadlines = self.getHeadlines(newresults)
+        if len(newheadlines) == 1:
+            s = newheadlines[0][0]
+            if s in ('Timeout downloading feed.',
+                     'Unable to download feed.'):
+                self.log.debug('%s %u', s, url)
+                return
+        def normalize(headline):
+            return (tuple(headline[0].lower().split()), headline[1])
+        oldheadlinesset = set(map(normalize, oldheadlines))
+        for (i, headline) in enumerate(newheadlines):
+            if normalize(headline) in oldheadlinesset:
+                newheadlines[i] = None
+        newheadlines = filter(None, newheadlines) # Removes Nones.
+        oldheadlines.extend(newheadlines)
+        self.cachedHeadlines[url] = oldheadlines
+        if newheadlines:
+            def filter_whitelist(headline):
+                v = False
+                for kw in whitelist:
+                    if kw in headline[0] or kw in headline[1]:
+                        v = True
+                        break
+                return v
+            def filter_blacklist(headline):
+                v = True
+                for kw in blacklist:
+                    if kw in headline[0] or kw in headline[1]:
+                        v = False
+                        break
+                return v
+            for (irc, channel) in targets:
+                if len(oldheadlines) == 0:
+                    channelnewheadlines = newheadlines[:self.registryValue('initialAnnounceHeadlines', channel)]
+                else:
+                    channelnewheadlines = newheadlines[:]
+                whitelist = self.registryValue('keywordWhitelist', channel)
+                blacklist = self.registryValue('keywordBlacklist', channel)
+                if len(whitelist) != 0:
+                    channelnewheadlines = filter(filter_whitelist, channelnewheadlines)
+                if len(blacklist) != 0:
+                    channelnewheadlines = filter(filter_blacklist, channelnewheadlines)
+                if len(channelnewheadlines) == 0:
                     return
-            def normalize(headline):
-                return (tuple(headline[0].lower().split()), headline[1])
-            oldheadlinesset = set(map(normalize, oldheadlines))
-            for (i, headline) in enumerate(newheadlines):
-                if normalize(headline) in oldheadlinesset:
-                    newheadlines[i] = None
-            newheadlines = filter(None, newheadlines) # Removes Nones.
-            oldheadlines.extend(newheadlines)
-            self.cachedHeadlines[url] = oldheadlines
-            if newheadlines:
-                def filter_whitelist(headline):
-                    v = False
-                    for kw in whitelist:
-                        if kw in headline[0] or kw in headline[1]:
-                            v = True
-                            break
-                    return v
-                def filter_blacklist(headline):
-                    v = True
-                    for kw in blacklist:
-                        if kw in headline[0] or kw in headline[1]:
-                            v = False
-                            break
-                    return v
-                for channel in channels:
-                    if len(oldheadlines) == 0:
-                        channelnewheadlines = newheadlines[:self.registryValue('initialAnnounceHeadlines', channel)]
-                    else:
-                        channelnewheadlines = newheadlines[:]
-                    whitelist = self.registryValue('keywordWhitelist', channel)
-                    blacklist = self.registryValue('keywordBlacklist', channel)
-                    if len(whitelist) != 0:
-                        channelnewheadlines = filter(filter_whitelist, channelnewheadlines)
-                    if len(blacklist) != 0:
-                        channelnewheadlines = filter(filter_blacklist, channelnewheadlines)
-                    if len(channelnewheadlines) == 0:
-                        return
-                    bold = self.registryValue('bold', channel)
-                    sep = self.registryValue('headlineSeparator', channel)
-                    prefix = self.registryValue('announcementPrefix', channel)
-                    pre = format('%s%s: ', prefix, name)
-                    if bold:
-                        pre = ircutils.bold(pre)
-                        sep = ircutils.bold(sep)
-                    headlines = self.buildHeadlines(channelnewheadlines, channel)
-                    irc.replies(headlines, prefixer=pre, joiner=sep,
-                                to=channel, prefixNick=False, private=True)
-        finally:
-            self.releaseLock(url)
+                bold = self.registryValue('bold', channel)
+                sep = self.registryValue('headlineSeparator', channel)
+                prefix = self.registryValue('announcementPrefix', channel)
+                pre = format('%s%s: ', prefix, name)
+                if bold:
+                    pre = ircutils.bold(pre)
+                    sep = ircutils.bold(sep)
+                headlines = self.buildHeadlines(channelnewheadlines, channel)
+                msg = ircmsgs.privmsg(channel, name, prefix=irc.prefix)
+                irc = callbacks.SimpleProxy(irc, msg)
+                irc.replies(headlines, prefixer=pre, joiner=sep,
+                            to=channel, prefixNick=False, private=True)
 
     def willGetNewFeed(self, url):
         now = time.time()
@@ -268,7 +427,14 @@ class RSS(callbacks.Plugin):
             if self.willGetNewFeed(url):
                 try:
                     self.log.debug('Downloading new feed from %u', url)
-                    results = feedparser.parse(url)
+                    (etag, modified) = self.validators.get(url, (None, None))
+                    results = feedparser.parse(url, etag=etag,
+                                               modified=modified)
+                    if results.get('status') == 304 and \
+                       url in self.cachedFeeds:
+                        self.log.debug('%u not modified.', url)
+                        self.lastRequest[url] = time.time()
+                        return self.cachedFeeds[url]
                     if 'bozo_exception' in results:
                         raise results['bozo_exception']
                 except sgmllib.SGMLParseError:
@@ -283,6 +449,8 @@ class RSS(callbacks.Plugin):
                 if results.get('feed', {}):
                     self.cachedFeeds[url] = results
                     self.lastRequest[url] = time.time()
+                    self.validators[url] = (results.get('etag'),
+                                            results.get('modified'))
                 else:
                     self.log.debug('Not caching results; feed is empty.')
             try:
@@ -30,7 +30,192 @@
 
 from supybot.test import *
 
+import threading
+import BaseHTTPServer
+
+import supybot.schedule as schedule
+
+RSS = plugin.loadPluginModule('RSS')
+
 url = 'http://www.advogato.org/rss/articles.xml'
+
+feed = """<?xml version="1.0"?>
+<rss version="2.0">
+<channel>
+<title>Local</title>
+<link>http://localhost/</link>
+<description>A local feed.</description>
+<item><title>%s</title><link>http://localhost/1</link></item>
+</channel>
+</rss>
+"""
+
+class FeedHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        server.requests += 1
+        time.sleep(server.delay)
+        etag = '"%s"' % server.version
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/rss+xml')
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(feed % server.title)
+
+    def log_message(self, *args):
+        pass
+
+class LocalFeedTestCase(ChannelPluginTestCase):
+    plugins = ('RSS',)
+    def setUp(self):
+        ChannelPluginTestCase.setUp(self)
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), FeedHandler)
+        self.server.requests = 0
+        self.server.delay = 0
+        self.server.version = 1
+        self.server.title = 'First headline'
+        t = threading.Thread(target=self.server.serve_forever)
+        t.setDaemon(True)
+        t.start()
+        self.url = 'http://127.0.0.1:%s/feed.xml' % self.server.server_port
+        self.cb = self.irc.getCallback('RSS')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        ChannelPluginTestCase.tearDown(self)
+
+    def expire(self):
+        self.cb.lastRequest[self.url] = 0
+
+    def testConditionalGet(self):
+        results = self.cb.getFeed(self.url)
+        self.assertEqual(self.server.requests, 1)
+        self.assertEqual(self.cb.getHeadlines(results)[0][0],
+                         'First headline')
+        self.cb.getFeed(self.url)
+        self.assertEqual(self.server.requests, 1)
+        self.expire()
+        self.failUnless(self.cb.getFeed(self.url) is results)
+        self.assertEqual(self.server.requests, 2)
+        self.server.version = 2
+        self.server.title = 'Second headline'
+        self.expire()
+        results = self.cb.getFeed(self.url)
+        self.assertEqual(self.server.requests, 3)
+        self.assertEqual(self.cb.getHeadlines(results)[0][0],
+                         'Second headline')
+
+    def _pollForMsg(self, timeout=5):
+        self.cb._schedulePoll(0)
+        schedule.run()
+        timeout += time.time()
+        while time.time() < timeout:
+            schedule.run()
+            m = self.irc.takeMsg()
+            if m is not None:
+                return m
+            if not self.cb.checkingFetched:
+                break
+            time.sleep(0.05)
+        return None
+
+    def testPolling(self):
+        self.assertNotError('rss announce add %s' % self.url)
+        m = self._pollForMsg()
+        self.failUnless(m is not None)
+        self.assertEqual(m.args[0], self.channel)
+        self.failUnless('First headline' in m.args[1])
+        self.assertEqual(self.server.requests, 1)
+        # Not due yet.
+        self.assertEqual(self._pollForMsg(timeout=1), None)
+        self.assertEqual(self.server.requests, 1)
+        self.failUnless(self.cb.nextPoll > time.time())
+        # Due, but unchanged.
+        self.expire()
+        self.assertEqual(self._pollForMsg(timeout=1), None)
+        self.assertEqual(self.server.requests, 2)
+        self.server.version = 2
+        self.server.title = 'Second headline'
+        self.expire()
+        m = self._pollForMsg()
+        self.failUnless(m is not None)
+        self.failUnless('Second headline' in m.args[1])
+        self.assertEqual(self.server.requests, 3)
+
+    def testPollDuringFetch(self):
+        self.assertNotError('rss announce add %s' % self.url)
+        self.server.delay = 1
+        self.cb._schedulePoll(0)
+        schedule.run()
+        self.failUnless(self.cb.checkingFetched)
+        # The first fetch is still in flight when the next poll comes around.
+        self.expire()
+        self.cb._schedulePoll(0)
+        schedule.run()
+        self.failIf(self.cb.nextPoll is None)
+        self.failUnless(self.cb.checkingFetched)
+        m = self._pollForMsg()
+        self.failUnless(m is not None)
+        self.failUnless('First headline' in m.args[1])
+
+class FeedFetcherTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.fetches = []
+        self.release = threading.Event()
+        self.lock = threading.Lock()
+
+    def fetch(self, url):
+        self.lock.acquire()
+        try:
+            self.fetches.append(url)
+        finally:
+            self.lock.release()
+        self.release.wait(5)
+        return url.upper()
+
+    def waitFor(self, f, timeout=5):
+        timeout += time.time()
+        while not f() and time.time() < timeout:
+            time.sleep(0.01)
+        self.failUnless(f())
+
+    def testMergesDuplicates(self):
+        fetcher = RSS.plugin.FeedFetcher(self.fetch, 2, 2, 10)
+        results = []
+        self.failUnless(fetcher.submit('http://a/1', results.append))
+        self.failUnless(fetcher.submit('http://a/1', results.append))
+        self.release.set()
+        self.waitFor(lambda: not fetcher.busy())
+        fetcher.stop()
+        self.assertEqual(self.fetches, ['http://a/1'])
+        self.assertEqual(results, ['HTTP://A/1', 'HTTP://A/1'])
+
+    def testPerHostLimitAndQueueSize(self):
+        fetcher = RSS.plugin.FeedFetcher(self.fetch, 2, 1, 3)
+        results = []
+        self.failUnless(fetcher.submit('http://a/1', results.append))
+        self.waitFor(lambda: len(self.fetches) == 1)
+        self.failUnless(fetcher.submit('http://a/2', results.append))
+        self.failUnless(fetcher.submit('http://b/1', results.append))
+        self.waitFor(lambda: len(self.fetches) == 2)
+        # a/2 waits for a/1, even though a thread would be free for it.
+        self.assertEqual(self.fetches, ['http://a/1', 'http://b/1'])
+        self.failUnless(fetcher.submit('http://c/1', results.append))
+        self.failUnless(fetcher.submit('http://c/2', results.append))
+        self.failIf(fetcher.submit('http://c/3', results.append))
+        self.release.set()
+        self.waitFor(lambda: not fetcher.busy())
+        fetcher.stop()
+        self.assertEqual(len(results), 5)
+        self.failIf('http://c/3' in self.fetches)
+
+
 class RSSTestCase(ChannelPluginTestCase):
     plugins = ('RSS','Plugin')
     def testRssAddBadName(self):
@@ -52,13 +52,15 @@ class Relay(callbacks.Plugin):
         self.lastRelayMsgs = ircutils.IrcDict()
 
     def __call__(self, irc, msg):
-        try:
-            irc = self._getRealIrc(irc)
-            if irc not in self.ircstates:
-                self._addIrc(irc)
-            self.ircstates[irc].addMsg(irc, self.lastmsg[irc])
-        finally:
-            self.lastmsg[irc] = msg
+        irc = self._getRealIrc(irc)
+        if irc not in self.ircstates:
+            # Our copy of irc.state already has msg in it.
+            self._addIrc(irc)
+        else:
+            try:
+                self.ircstates[irc].addMsg(irc, self.lastmsg[irc])
+            finally:
+                self.lastmsg[irc] = msg
         self.__parent.__call__(irc, msg)
 
     def do376(self, irc, msg):
@@ -82,15 +84,9 @@ class Relay(callbacks.Plugin):
     def _addIrc(self, irc):
         # Let's just be extra-special-careful here.
         if irc not in self.ircstates:
-            self.ircstates[irc] = irclib.IrcState()
+            self.ircstates[irc] = irc.state.copy()
         if irc not in self.lastmsg:
             self.lastmsg[irc] = ircmsgs.ping('this is just a fake message')
-        if irc.afterConnect:
-            # We've probably been reloaded.  Let's send some messages to get
-            # our IrcState objects up to current.
-            for channel in self.registryValue('channels'):
-                irc.queueMsg(ircmsgs.who(channel))
-                irc.queueMsg(ircmsgs.names(channel))
 
     def join(self, irc, msg, args, channel):
         """[<channel>]
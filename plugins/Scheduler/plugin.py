@@ -48,6 +48,9 @@ class Scheduler(callbacks.Plugin):
         self.__parent = super(Scheduler, self)
         self.__parent.__init__(irc)
         self.events = {}
+        # Set whenever self.events changes, so _flush only writes it out when
+        # there's actually something new.
+        self.dirty = False
         self._restoreEvents(irc)
         world.flushers.append(self._flush)
 
@@ -84,10 +87,14 @@ class Scheduler(callbacks.Plugin):
                     # we must be reloading the plugin, event is still scheduled
                     self.log.info('Event %s already exists, adding to dict.' % (name,))
                     self.events[name] = event
+                    self.dirty = True
                 else:
                     raise
                                      
     def _flush(self):
+        if not self.dirty:
+            return
+        self.dirty = False
         try:
             pklfd, tempfn = tempfile.mkstemp(suffix='scheduler', dir=datadir)
             pkl = os.fdopen(pklfd, 'wb')
@@ -99,6 +106,7 @@ class Scheduler(callbacks.Plugin):
             shutil.move(tempfn, filename)
         except (IOError, shutil.Error), e:
             self.log.warning('File error: %s', e)
+            self.dirty = True
 
     def die(self):
         self._flush()
@@ -107,12 +115,11 @@ class Scheduler(callbacks.Plugin):
 
     def _makeCommandFunction(self, irc, msg, command, remove=True):
         """Makes a function suitable for scheduling from command."""
-        tokens = callbacks.tokenize(command)
-        print command
-        print tokens
+        tokens = callbacks.tokenize(command, frozen=True)
         def f():
             if remove:
                 del self.events[str(f.eventId)]
+                self.dirty = True
             self.Proxy(irc.irc, msg, tokens)
         return f
 
@@ -124,6 +131,7 @@ class Scheduler(callbacks.Plugin):
                                 'msg':msg,
                                 'time':t,
                                 'type':'single'}
+        self.dirty = True
         return id
 
     def add(self, irc, msg, args, seconds, command):
@@ -147,6 +155,7 @@ class Scheduler(callbacks.Plugin):
         """
         if id in self.events:
             del self.events[id]
+            self.dirty = True
             try:
                 id = int(id)
             except ValueError:
@@ -168,6 +177,7 @@ class Scheduler(callbacks.Plugin):
                              'msg':msg,
                              'time':seconds,
                              'type':'repeat'}
+        self.dirty = True
 
     def repeat(self, irc, msg, args, name, seconds, command):
         """<name> <seconds> <command>
@@ -30,6 +30,7 @@
 
 import re
 import time
+import bisect
 
 import supybot.log as log
 import supybot.conf as conf
@@ -37,7 +38,6 @@ import supybot.utils as utils
 import supybot.world as world
 import supybot.ircdb as ircdb
 from supybot.commands import *
-import supybot.irclib as irclib
 import supybot.ircmsgs as ircmsgs
 import supybot.plugins as plugins
 import supybot.ircutils as ircutils
@@ -50,8 +50,41 @@ class IrcStringAndIntDict(utils.InsensitivePreservingDict):
         else:
             return ircutils.toLower(x)
 
+# Characters that mean something in seenWildcard's regexp, or that
+# ircutils.toLower doesn't treat the way re.I does.
+_notLiteral = re.compile(r'[][\\^$.|?+(){}~]')
+
 class SeenDB(plugins.ChannelUserDB):
     IdDict = IrcStringAndIntDict
+    def __init__(self, filename):
+        # For each channel, the nicks we've seen (keyed by their toLower form),
+        # and those keys kept sorted, both forwards and reversed, so the
+        # candidates for a wildcard with a fixed prefix or suffix can be found
+        # with a couple of bisections.
+        self.nicks = ircutils.IrcDict()
+        self.prefixes = ircutils.IrcDict()
+        self.suffixes = ircutils.IrcDict()
+        plugins.ChannelUserDB.__init__(self, filename)
+
+    def __setitem__(self, (channel, id), v):
+        plugins.ChannelUserDB.__setitem__(self, (channel, id), v)
+        if not isinstance(id, int):
+            key = ircutils.toLower(id)
+            nicks = self.nicks.setdefault(channel, {})
+            if key not in nicks:
+                bisect.insort(self.prefixes.setdefault(channel, []), key)
+                bisect.insort(self.suffixes.setdefault(channel, []), key[::-1])
+            nicks[key] = id
+
+    def __delitem__(self, (channel, id)):
+        plugins.ChannelUserDB.__delitem__(self, (channel, id))
+        if not isinstance(id, int):
+            key = ircutils.toLower(id)
+            del self.nicks[channel][key]
+            for (L, k) in ((self.prefixes[channel], key),
+                           (self.suffixes[channel], key[::-1])):
+                del L[bisect.bisect_left(L, k)]
+
     def serialize(self, v):
         return list(v)
 
@@ -64,17 +97,39 @@ class SeenDB(plugins.ChannelUserDB):
         self[channel, nickOrId] = (seen, saying)
         self[channel, '<last>'] = (seen, saying)
 
+    def _candidates(self, channel, nick):
+        """Returns the keys of the nicks in channel that might match the
+        wildcard nick."""
+        nicks = self.nicks.get(channel, {})
+        pieces = nick.split('*')
+        (prefix, suffix) = (pieces[0], pieces[-1])
+        if _notLiteral.search(prefix):
+            prefix = ''
+        if _notLiteral.search(suffix):
+            suffix = ''
+        if not prefix and not suffix:
+            return nicks.iterkeys()
+        elif len(prefix) >= len(suffix):
+            (L, k, reverse) = (self.prefixes[channel], prefix, False)
+        else:
+            (L, k, reverse) = (self.suffixes[channel], suffix[::-1], True)
+        k = ircutils.toLower(k)
+        candidates = []
+        i = bisect.bisect_left(L, k)
+        while i < len(L) and L[i].startswith(k):
+            candidates.append(L[i])
+            i += 1
+        if reverse:
+            candidates = [key[::-1] for key in candidates]
+        return candidates
+
     def seenWildcard(self, channel, nick):
         nicks = ircutils.IrcSet()
         nickRe = re.compile('^%s$' % '.*'.join(nick.split('*')), re.I)
-        for (searchChan, searchNick) in self.keys():
-            #print 'chan: %s ... nick: %s' % (searchChan, searchNick)
-            if isinstance(searchNick, int):
-                # We need to skip the reponses that are keyed by id as they
-                # apparently duplicate the responses for the same person that
-                # are keyed by nick-string
-                continue
-            if ircutils.strEqual(searchChan, channel):
+        if channel in self.nicks:
+            names = self.nicks[channel]
+            for key in self._candidates(channel, nick):
+                searchNick = names[key]
                 if nickRe.search(searchNick) is not None:
                     nicks.add(searchNick)
         L = [[nick, self.seen(channel, nick)] for nick in nicks]
@@ -115,24 +170,22 @@ class Seen(callbacks.Plugin):
         self.__parent.die()
 
     def __call__(self, irc, msg):
-        try:
-            if irc not in self.ircstates:
-                self._addIrc(irc)
-            self.ircstates[irc].addMsg(irc, self.lastmsg[irc])
-        finally:
-            self.lastmsg[irc] = msg
+        if irc not in self.ircstates:
+            # Our copy of irc.state already has msg in it.
+            self._addIrc(irc)
+        else:
+            try:
+                self.ircstates[irc].addMsg(irc, self.lastmsg[irc])
+            finally:
+                self.lastmsg[irc] = msg
         self.__parent.__call__(irc, msg)
 
     def _addIrc(self, irc):
         # Let's just be extra-special-careful here.
         if irc not in self.ircstates:
-            self.ircstates[irc] = irclib.IrcState()
+            self.ircstates[irc] = irc.state.copy()
         if irc not in self.lastmsg:
             self.lastmsg[irc] = ircmsgs.ping('this is just a fake message')
-        if not world.testing:
-            for channel in irc.state.channels:
-                irc.queueMsg(ircmsgs.who(channel))
-                irc.queueMsg(ircmsgs.names(channel))
 
     def doPrivmsg(self, irc, msg):
         if ircmsgs.isCtcp(msg) and not ircmsgs.isAction(msg):
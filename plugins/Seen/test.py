@@ -29,7 +29,40 @@
 
 from supybot.test import *
 
+import re
+
 import supybot.ircdb as ircdb
+import supybot.plugin as plugin
+
+Seen = plugin.loadPluginModule('Seen')
+
+class SeenDBTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.filename = conf.supybot.directories.data.dirize('SeenDBTest.db')
+        for filename in (self.filename, self.filename + '.journal'):
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def testWildcardIndex(self):
+        db = Seen.plugin.SeenDB(self.filename)
+        nicks = ['foo', 'Foobar', 'barfoo', 'f[o]o', 'fo{o}', 'baz', 'FOO_',
+                 'f|oo', 'oof', 'xfoo']
+        for nick in nicks:
+            db.update('#test', nick, 'hi')
+        db.update('#other', 'fooz', 'hi')
+        db.update('#test', 1, 'hi')
+        del db['#test', 'xfoo']
+        nicks.remove('xfoo')
+        for pattern in ['f*', '*oo', '*foo*', 'f*o*o', 'FOO*', '*', 'f[o]*',
+                        'f{*', 'f|*', '*_', '*o}', 'q*', '*bar', 'foo*bar',
+                        '<*']:
+            nickRe = re.compile('^%s$' % '.*'.join(pattern.split('*')), re.I)
+            expected = [nick for nick in nicks + ['<last>']
+                        if nickRe.search(nick)]
+            results = db.seenWildcard('#test', pattern)
+            self.assertEqual(sorted([nick for (nick, _) in results]),
+                             sorted(expected), pattern)
 
 class ChannelDBTestCase(ChannelPluginTestCase):
     plugins = ('Seen', 'User')
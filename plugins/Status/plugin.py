@@ -210,6 +210,47 @@ class Status(callbacks.Plugin):
         irc.reply(format('%L', sorted(commands)))
     commands = wrap(commands)
 
+    def _formatTimings(self, timings, formatKey, n):
+        def ms(seconds):
+            return '%.1fms' % (seconds * 1000)
+        L = sorted(timings.items(),
+                   key=lambda (key, h): (h.percentile(95), h.total),
+                   reverse=True)
+        if not L:
+            return 'I haven\'t timed anything yet.'
+        overhead = world.timingOverhead()
+        return format('%s (Timing costs me about %.1f microseconds each '
+                      'time.)',
+                      '; '.join([format('%s: %n, p50 %s, p95 %s, p99 %s, '
+                                        'max %s', formatKey(key),
+                                        (h.count, 'call'),
+                                        ms(h.percentile(50)),
+                                        ms(h.percentile(95)),
+                                        ms(h.percentile(99)), ms(h.max))
+                                 for (key, h) in L[:n]]),
+                      overhead * 1000000)
+
+    def slowplugins(self, irc, msg, args, n):
+        """[<number>]
+
+        Returns the <number> (default 5) plugin methods (__call__, inFilter, or
+        outFilter) that have taken the longest to handle messages, by their
+        95th percentile time.
+        """
+        irc.reply(self._formatTimings(world.hookTimings, '.'.join, n))
+    slowplugins = wrap(slowplugins, [additional('positiveInt', 5)])
+
+    def slowcommands(self, irc, msg, args, n):
+        """[<number>]
+
+        Returns the <number> (default 5) commands that have taken the longest
+        to run, by their 95th percentile time.
+        """
+        irc.reply(self._formatTimings(world.commandTimings,
+                                      lambda (plugin, command):
+                                          '%s %s' % (plugin, command), n))
+    slowcommands = wrap(slowcommands, [additional('positiveInt', 5)])
+
     def uptime(self, irc, msg, args):
         """takes no arguments
 
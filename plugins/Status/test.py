@@ -74,5 +74,14 @@ class StatusTestCase(PluginTestCase):
     def testProcesses(self):
         self.assertNotError('processes')
 
+    def testSlowest(self):
+        world.commandTimings.clear()
+        world.hookTimings.clear()
+        self.assertRegexp('slowcommands', 'haven\'t timed')
+        self.assertNotError('uptime')
+        self.assertRegexp('slowcommands', r'Status uptime: 1 call, p50 ')
+        self.assertRegexp('slowplugins', r'Status\.__call__: ')
+        self.assertRegexp('slowplugins 1', 'microseconds')
+
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
 
@@ -125,6 +125,9 @@ class Topic(callbacks.Plugin):
             pkl.close()
         except IOError, e:
             self.log.debug('Unable to open pickle file: %s', e)
+        # Set whenever the pickled data changes, so _flush only writes it out
+        # when there's actually something new.
+        self.dirty = False
         world.flushers.append(self._flush)
 
     def die(self):
@@ -132,6 +135,9 @@ class Topic(callbacks.Plugin):
         self.__parent.die()
 
     def _flush(self):
+        if not self.dirty:
+            return
+        self.dirty = False
         try:
             pklfd, tempfn = tempfile.mkstemp(suffix='topic', dir=datadir)
             pkl = os.fdopen(pklfd, 'wb')
@@ -146,6 +152,7 @@ class Topic(callbacks.Plugin):
             shutil.move(tempfn, filename)
         except (IOError, shutil.Error), e:
             self.log.warning('File error: %s', e)
+            self.dirty = True
 
     def _splitTopic(self, topic, channel):
         separator = self.registryValue('separator', channel)
@@ -156,24 +163,28 @@ class Topic(callbacks.Plugin):
         return separator.join(topics)
 
     def _addUndo(self, channel, topics):
+        self.dirty = True
         stack = self.undos.setdefault(channel, [])
         stack.append(topics)
         maxLen = self.registryValue('undo.max', channel)
         del stack[:len(stack)-maxLen]
 
     def _addRedo(self, channel, topics):
+        self.dirty = True
         stack = self.redos.setdefault(channel, [])
         stack.append(topics)
         maxLen = self.registryValue('undo.max', channel)
         del stack[:len(stack)-maxLen]
 
     def _getUndo(self, channel):
+        self.dirty = True
         try:
             return self.undos[channel].pop()
         except (KeyError, IndexError):
             return None
 
     def _getRedo(self, channel):
+        self.dirty = True
         try:
             return self.redos[channel].pop()
         except (KeyError, IndexError):
@@ -182,6 +193,7 @@ class Topic(callbacks.Plugin):
     def _sendTopics(self, irc, channel, topics, isDo=False, fit=False):
         topics = [s for s in topics if s and not s.isspace()]
         self.lastTopics[channel] = topics
+        self.dirty = True
         newTopic = self._joinTopic(channel, topics)
         try:
             maxLen = irc.state.supported['topiclen']
@@ -232,6 +244,7 @@ class Topic(callbacks.Plugin):
         if ircutils.strEqual(msg.nick, irc.nick):
             # We're joining a channel, let's watch for the topic.
             self.watchingFor332.add(msg.args[0])
+            self.dirty = True
 
     def do315(self, irc, msg):
         # Try to restore the topic when not set yet.
@@ -253,6 +266,7 @@ class Topic(callbacks.Plugin):
     def do332(self, irc, msg):
         if msg.args[1] in self.watchingFor332:
             self.watchingFor332.remove(msg.args[1])
+            self.dirty = True
             # Store an undo for the topic when we join a channel.  This allows
             # us to undo the first topic change that takes place in a channel.
             self._addUndo(msg.args[1], [msg.args[2]])
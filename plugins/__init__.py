@@ -266,17 +266,43 @@ class ChannelUserDB(ChannelUserDictionary):
     def __init__(self, filename):
         ChannelUserDictionary.__init__(self)
         self.filename = filename
+        # The rows last written to the file (keyed like self.changed) and the
+        # records that have been handed out or set since then, which are the
+        # only ones flush needs to serialize again.
+        self.rows = {}
+        self.changed = {}
+        self._idKey = getattr(self.IdDict(), 'key', lambda id: id)
+        # When journaling, flush appends changed rows to the journal and the
+        # file itself is only rewritten (in another thread) when the journal
+        # gets too big.  Rows being compacted live in journalName.old.
+        self.journaled = conf.supybot.databases.types.journal()
+        self.journalName = filename + '.journal'
+        self.journalSize = 0
+        self.compactor = None
         try:
-            fd = file(self.filename)
+            self._read(self.filename)
         except EnvironmentError, e:
             log.warning('Couldn\'t open %s: %s.', self.filename, e)
-            return
+        oldJournalName = self.journalName + '.old'
+        for name in (oldJournalName, self.journalName):
+            if os.path.exists(name):
+                self.journalSize += self._read(name, journal=True)
+        self.changed.clear()
+        if os.path.exists(oldJournalName):
+            # We died in the middle of a compaction.
+            self._compact([oldJournalName, self.journalName])
+
+    def _read(self, filename, journal=False):
+        fd = file(filename)
         reader = csv.reader(fd)
         try:
             lineno = 0
             for t in reader:
                 lineno += 1
                 try:
+                    if journal:
+                        op = t.pop(0)
+                    row = t[:]
                     channel = t.pop(0)
                     id = t.pop(0)
                     try:
@@ -284,8 +310,15 @@ class ChannelUserDB(ChannelUserDictionary):
                     except ValueError:
                         # We'll skip over this so, say, nicks can be kept here.
                         pass
+                    key = self._key(channel, id)
+                    if journal and op == '-':
+                        if (channel, id) in self:
+                            del self[channel, id]
+                        self.rows.pop(key, None)
+                        continue
                     v = self.deserialize(channel, id, t)
                     self[channel, id] = v
+                    self.rows[key] = row
                 except Exception, e:
                     log.warning('Invalid line #%s in %s.',
                                 lineno, self.__class__.__name__)
@@ -294,26 +327,121 @@ class ChannelUserDB(ChannelUserDictionary):
             log.warning('Invalid line #%s in %s.',
                         lineno, self.__class__.__name__)
             log.debug('Exception: %s', utils.exnToString(e))
+        fd.close()
+        return lineno
 
-    def flush(self):
-        fd = utils.file.AtomicFile(self.filename, makeBackupIfSmaller=False)
-        writer = csv.writer(fd)
-        items = self.items()
-        if not items:
+    def _key(self, channel, id):
+        return (self.channels.key(channel), self._idKey(id))
+
+    def __getitem__(self, (channel, id)):
+        v = ChannelUserDictionary.__getitem__(self, (channel, id))
+        # Values are often modified in place, so anything we hand out has to
+        # be checked at the next flush.
+        self.changed[self._key(channel, id)] = (channel, id)
+        return v
+
+    def __setitem__(self, (channel, id), v):
+        ChannelUserDictionary.__setitem__(self, (channel, id), v)
+        self.changed[self._key(channel, id)] = (channel, id)
+
+    def __delitem__(self, (channel, id)):
+        ChannelUserDictionary.__delitem__(self, (channel, id))
+        self.changed[self._key(channel, id)] = (channel, id)
+
+    def __contains__(self, (channel, id)):
+        return channel in self.channels and id in self.channels[channel]
+
+    def _changes(self):
+        """Brings self.rows up to date with the records in self.changed and
+        returns the journal entries for the rows that actually changed."""
+        changes = []
+        for (key, (channel, id)) in self.changed.iteritems():
+            try:
+                v = self.channels[channel][id]
+            except KeyError:
+                if key in self.rows:
+                    del self.rows[key]
+                    changes.append(['-', channel, id])
+                continue
+            L = self.serialize(v)
+            row = self.rows.get(key)
+            # Only the values matter; we don't care if the channel or id was
+            # given in a different case this time.
+            if row is None or row[2:] != L:
+                L.insert(0, id)
+                L.insert(0, channel)
+                self.rows[key] = L
+                changes.append(['+'] + L)
+        self.changed.clear()
+        return changes
+
+    def _writeRows(self, rows, journals=()):
+        if not rows:
             log.debug('%s: Refusing to write blank file.',
                       self.__class__.__name__)
-            fd.rollback()
             return
-        items.sort()
-        for ((channel, id), v) in items:
-            L = self.serialize(v)
-            L.insert(0, id)
-            L.insert(0, channel)
-            writer.writerow(L)
+        fd = utils.file.AtomicFile(self.filename, makeBackupIfSmaller=False)
+        writer = csv.writer(fd)
+        rows.sort()
+        for row in rows:
+            writer.writerow(row)
         fd.close()
+        for name in journals:
+            if os.path.exists(name):
+                os.remove(name)
+
+    def _compact(self, journals):
+        self._writeRows(self.rows.values(), journals)
+        self.journalSize = 0
+
+    def _startCompaction(self):
+        oldJournalName = self.journalName + '.old'
+        os.rename(self.journalName, oldJournalName)
+        self.journalSize = 0
+        # The rows themselves are replaced rather than modified, so a shallow
+        # copy is all the compactor needs to be left alone by later flushes.
+        self.compactor = world.SupyThread(target=self._writeRows,
+                                          args=(self.rows.values(),
+                                                [oldJournalName]),
+                                          name='Compacting %s' % self.filename)
+        self.compactor.setDaemon(True)
+        self.compactor.start()
+
+    def _waitForCompaction(self):
+        if self.compactor is not None:
+            self.compactor.join()
+            self.compactor = None
+
+    def flush(self):
+        changes = self._changes()
+        if not changes:
+            return
+        oldJournalName = self.journalName + '.old'
+        if not self.journaled:
+            self._compact([oldJournalName, self.journalName])
+            return
+        fd = file(self.journalName, 'ab')
+        try:
+            csv.writer(fd).writerows(changes)
+        finally:
+            fd.close()
+        self.journalSize += len(changes)
+        maxmods = conf.supybot.databases.types.journal.maximumModifications()
+        if self.journalSize > maxmods * len(self.rows):
+            if self.compactor is None or not self.compactor.isAlive():
+                self._waitForCompaction()
+                if os.path.exists(oldJournalName):
+                    # The last compaction failed; we'd best not wait for the
+                    # next one.
+                    self._compact([oldJournalName, self.journalName])
+                else:
+                    self._startCompaction()
 
     def close(self):
         self.flush()
+        self._waitForCompaction()
+        if self.journalSize:
+            self._compact([self.journalName + '.old', self.journalName])
         self.clear()
 
     def deserialize(self, channel, id, L):
@@ -157,6 +157,7 @@ setup(
 
     scripts=['scripts/supybot',
              'scripts/supybot-test',
+             'scripts/supybot-benchmark',
              'scripts/supybot-botchk',
              'scripts/supybot-wizard',
              'scripts/supybot-adduser',
@@ -0,0 +1,213 @@
+###
+# Copyright (c) 2026, Kefkius
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+Replays IRC traffic through an Irc object to measure how quickly the bot (and
+the plugins it has loaded) handles it.  Everything happens in this process;
+there's no network involved.  See scripts/supybot-benchmark.
+"""
+
+import sys
+import time
+import random
+
+try:
+    import resource
+except ImportError: # Windows doesn't have it.
+    resource = None
+
+import supybot.conf as conf
+import supybot.ircmsgs as ircmsgs
+import supybot.ircutils as ircutils
+
+from supybot.utils.structures import Histogram
+
+class FakeServer(object):
+    """Stands in for the IRC server: it feeds messages to an Irc and takes
+    everything the Irc has to send after each one, answering PINGs."""
+    def __init__(self, irc, name='irc.benchmark.local'):
+        self.irc = irc
+        self.name = name
+        self.fed = 0
+        self.replies = 0
+
+    def drain(self):
+        msg = self.irc.takeMsg()
+        while msg is not None:
+            self.replies += 1
+            if msg.command == 'PING':
+                self.irc.feedMsg(ircmsgs.pong(msg.args[0], prefix=self.name))
+            msg = self.irc.takeMsg()
+
+    def feed(self, msg):
+        self.fed += 1
+        self.irc.feedMsg(msg)
+        self.drain()
+
+    def connect(self, channels):
+        """Welcomes the bot and puts it in the given channels."""
+        nick = self.irc.nick
+        self.drain()
+        self.feed(ircmsgs.IrcMsg(prefix=self.name, command='001',
+                                 args=(nick, 'Welcome to the benchmark.')))
+        prefix = ircutils.joinHostmask(nick, 'supybot', 'benchmark.local')
+        for channel in channels:
+            self.feed(ircmsgs.join(channel, prefix=prefix))
+            self.feed(ircmsgs.IrcMsg(prefix=self.name, command='353',
+                                     args=(nick, '=', channel, '@' + nick)))
+            self.feed(ircmsgs.IrcMsg(prefix=self.name, command='366',
+                                     args=(nick, channel, 'End of /NAMES')))
+
+def hostmask(i):
+    return ircutils.joinHostmask('user%s' % i, 'ident%s' % i,
+                                 'host%s.example.com' % (i % 97))
+
+# Each scenario takes the channel, the (rough) number of messages to make, and
+# a random.Random, and returns a list of messages.  Messages that are commands
+# to the bot are tagged 'benchmarkCommand', so their latency is kept apart.
+def joins(channel, n, rng):
+    """A JOIN storm: n users join the channel."""
+    return [ircmsgs.join(channel, prefix=hostmask(i)) for i in xrange(n)]
+
+def netsplit(channel, n, rng):
+    """A third of n users join, quit in a netsplit, and join again."""
+    users = [hostmask(i) for i in xrange(max(1, n // 3))]
+    L = [ircmsgs.join(channel, prefix=user) for user in users]
+    L.extend([ircmsgs.quit('*.net *.split', prefix=user) for user in users])
+    L.extend([ircmsgs.join(channel, prefix=user) for user in users])
+    return L
+
+_words = ('the quick brown fox jumps over lazy dog lorem ipsum dolor sit amet '
+          'supybot plugin channel network server message').split()
+def chatter(channel, n, rng):
+    """A busy channel: n messages from 50 users, with the odd action or url.
+    """
+    L = []
+    for i in xrange(n):
+        s = ' '.join([rng.choice(_words) for _ in xrange(rng.randint(3, 15))])
+        r = rng.random()
+        if r < 0.05:
+            s = 'see http://example.com/%s/%s' % (i, rng.choice(_words))
+        user = hostmask(rng.randrange(50))
+        if r > 0.95:
+            L.append(ircmsgs.action(channel, s, prefix=user))
+        else:
+            L.append(ircmsgs.privmsg(channel, s, prefix=user))
+    return L
+
+commandsToRun = ['list', 'help list', 'list Misc']
+def commands(channel, n, rng):
+    """A burst of n commands (from commandsToRun) from 10 users."""
+    prefixChars = conf.supybot.reply.whenAddressedBy.chars()
+    char = prefixChars and prefixChars[0] or ''
+    L = []
+    for i in xrange(n):
+        s = char + rng.choice(commandsToRun)
+        msg = ircmsgs.privmsg(channel, s, prefix=hostmask(rng.randrange(10)))
+        msg.tag('benchmarkCommand')
+        L.append(msg)
+    return L
+
+scenarios = ['joins', 'netsplit', 'chatter', 'commands']
+
+def replay(filename):
+    """Returns the messages in a file of raw IRC lines (such as a recording of
+    what a server sent), skipping blank lines and lines starting with #."""
+    fd = file(filename)
+    try:
+        return [ircmsgs.IrcMsg(line.rstrip('\r\n')) for line in fd
+                if line.strip() and not line.startswith('#')]
+    finally:
+        fd.close()
+
+def peakMemory():
+    """Returns the most memory (in kB) the process has used, or None if we
+    can't tell."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak //= 1024 # It's bytes there, kB elsewhere.
+    return peak
+
+class Result(object):
+    def __init__(self, name):
+        self.name = name
+        self.messages = 0
+        self.replies = 0
+        self.elapsed = 0.0
+        self.latency = Histogram()
+        self.commandLatency = Histogram()
+        self.peakMemory = None
+
+    def __str__(self):
+        def ms(seconds):
+            return '%.2fms' % (seconds * 1000)
+        rate = self.elapsed and self.messages / self.elapsed or 0
+        s = '%s: %s messages in %.2fs (%.0f/s), %s replies; latency ' \
+            'p50 %s, p99 %s, max %s' % \
+            (self.name, self.messages, self.elapsed, rate, self.replies,
+             ms(self.latency.percentile(50)), ms(self.latency.percentile(99)),
+             ms(self.latency.max))
+        h = self.commandLatency
+        if h.count:
+            s += '; %s commands p50 %s, p95 %s, p99 %s, max %s' % \
+                 (h.count, ms(h.percentile(50)), ms(h.percentile(95)),
+                  ms(h.percentile(99)), ms(h.max))
+        if self.peakMemory is not None:
+            s += '; peak memory %s kB' % self.peakMemory
+        return s
+
+def run(server, name, msgs):
+    """Feeds msgs to the server's Irc, and returns a Result.  Threaded
+    commands only count the time it takes to hand them to a thread."""
+    result = Result(name)
+    replies = server.replies
+    clock = time.time
+    start = clock()
+    for msg in msgs:
+        before = clock()
+        server.feed(msg)
+        latency = clock() - before
+        result.latency.add(latency)
+        if msg.tagged('benchmarkCommand'):
+            result.commandLatency.add(latency)
+    result.elapsed = clock() - start
+    result.messages = len(msgs)
+    result.replies = server.replies - replies
+    result.peakMemory = peakMemory()
+    return result
+
+def runScenario(server, name, channel, n, seed=None):
+    rng = random.Random(seed)
+    msgs = globals()[name](channel, n, rng)
+    return run(server, name, msgs)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -35,13 +35,10 @@ This module contains the basic callbacks for handling PRIVMSGs.
 import supybot
 
 import re
-import copy
 import time
-import shlex
 import getopt
 import inspect
 import operator
-from cStringIO import StringIO
 
 import supybot.log as log
 import supybot.conf as conf
@@ -54,13 +51,40 @@ import supybot.ircutils as ircutils
 import supybot.registry as registry
 from supybot.utils.iter import any, all
 
+_addressingConfigs = {}
+_addressingGeneration = None
+def _getAddressingConfig(target):
+    """Returns a tuple of the whenAddressedBy-related values for target,
+    computing them only when the registry has changed since we last did."""
+    global _addressingGeneration
+    generation = registry.generation()
+    if generation != _addressingGeneration:
+        _addressingConfigs.clear()
+        _addressingGeneration = generation
+    if ircutils.isChannel(target):
+        key = ircutils.toLower(target)
+    else:
+        key = None
+    try:
+        return _addressingConfigs[key]
+    except KeyError:
+        def get(group):
+            if key is not None:
+                group = group.get(target)
+            return group()
+        whenAddressedBy = conf.supybot.reply.whenAddressedBy
+        config = (get(whenAddressedBy.chars),
+                  get(whenAddressedBy.nick),
+                  get(whenAddressedBy.nick.atEnd),
+                  get(whenAddressedBy.strings),
+                  map(ircutils.toLower, get(whenAddressedBy.nicks)),
+                  get(conf.supybot.reply.whenNotAddressed))
+        _addressingConfigs[key] = config
+        return config
+
 def _addressed(nick, msg, prefixChars=None, nicks=None,
               prefixStrings=None, whenAddressedByNick=None,
               whenAddressedByNickAtEnd=None):
-    def get(group):
-        if ircutils.isChannel(target):
-            group = group.get(target)
-        return group()
     def stripPrefixStrings(payload):
         for prefixString in prefixStrings:
             if payload.startswith(prefixString):
@@ -71,15 +95,17 @@ def _addressed(nick, msg, prefixChars=None, nicks=None,
     (target, payload) = msg.args
     if not payload:
         return ''
+    (defaultPrefixChars, defaultWhenAddressedByNick,
+     defaultWhenAddressedByNickAtEnd, defaultPrefixStrings,
+     defaultNicks, whenNotAddressed) = _getAddressingConfig(target)
     if prefixChars is None:
-        prefixChars = get(conf.supybot.reply.whenAddressedBy.chars)
+        prefixChars = defaultPrefixChars
     if whenAddressedByNick is None:
-        whenAddressedByNick = get(conf.supybot.reply.whenAddressedBy.nick)
+        whenAddressedByNick = defaultWhenAddressedByNick
     if whenAddressedByNickAtEnd is None:
-        r = conf.supybot.reply.whenAddressedBy.nick.atEnd
-        whenAddressedByNickAtEnd = get(r)
+        whenAddressedByNickAtEnd = defaultWhenAddressedByNickAtEnd
     if prefixStrings is None:
-        prefixStrings = get(conf.supybot.reply.whenAddressedBy.strings)
+        prefixStrings = defaultPrefixStrings
     # We have to check this before nicks -- try "@google supybot" with supybot
     # and whenAddressedBy.nick.atEnd on to see why.
     if any(payload.startswith, prefixStrings):
@@ -87,11 +113,8 @@ def _addressed(nick, msg, prefixChars=None, nicks=None,
     elif payload[0] in prefixChars:
         return payload[1:].strip()
     if nicks is None:
-        nicks = get(conf.supybot.reply.whenAddressedBy.nicks)
-        nicks = map(ircutils.toLower, nicks)
-    else:
-        nicks = list(nicks) # Just in case.
-    nicks.insert(0, ircutils.toLower(nick))
+        nicks = defaultNicks
+    nicks = [ircutils.toLower(nick)] + list(nicks)
     # Ok, let's see if it's a private message.
     if ircutils.nickEqual(target, nick):
         payload = stripPrefixStrings(payload)
@@ -100,8 +123,8 @@ def _addressed(nick, msg, prefixChars=None, nicks=None,
         return payload
     # Ok, not private.  Does it start with our nick?
     elif whenAddressedByNick:
+        lowered = ircutils.toLower(payload)
         for nick in nicks:
-            lowered = ircutils.toLower(payload)
             if lowered.startswith(nick):
                 try:
                     (maybeNick, rest) = payload.split(None, 1)
@@ -126,7 +149,7 @@ def _addressed(nick, msg, prefixChars=None, nicks=None,
                     # There should be some separator between the nick and the
                     # previous alphanumeric character.
                     return possiblePayload
-    if get(conf.supybot.reply.whenNotAddressed):
+    if whenNotAddressed:
         return payload
     else:
         return ''
@@ -134,14 +157,25 @@ def _addressed(nick, msg, prefixChars=None, nicks=None,
 def addressed(nick, msg, **kwargs):
     """If msg is addressed to 'name', returns the portion after the address.
     Otherwise returns the empty string.
+
+    The result is cached in the message's tags, so calling this repeatedly
+    for the same message is cheap.
     """
-    payload = msg.addressed
-    if payload is not None:
-        return payload
-    else:
+    if kwargs:
+        # We can't cache what we compute with non-default settings, but we
+        # still tag the message for those who look at msg.addressed.
         payload = _addressed(nick, msg, **kwargs)
-        msg.tag('addressed', payload)
-        return payload
+        msg.tag('addressedKey', None)
+    else:
+        # The key guards against the nick or the registry having changed, and
+        # against tags copied over to a new IrcMsg with different args.
+        key = (ircutils.toLower(nick), msg.args, registry.generation())
+        if msg.addressed is not None and msg.addressedKey == key:
+            return msg.addressed
+        payload = _addressed(nick, msg)
+        msg.tag('addressedKey', key)
+    msg.tag('addressed', payload)
+    return payload
 
 def canonicalName(command):
     """Turn a command into its canonical form.
@@ -250,27 +284,39 @@ class ArgumentError(Error):
     pass
 
 class Tokenizer(object):
-    # This will be used as a global environment to evaluate strings in.
-    # Evaluation is, of course, necessary in order to allow escaped
-    # characters to be properly handled.
-    #
-    # These are the characters valid in a token.  Everything printable except
-    # double-quote, left-bracket, and right-bracket.
-    validChars = utils.str.chars.translate(utils.str.chars, '\x00\r\n \t')
+    # These are the characters that separate tokens, and aren't part of any.
+    whitespace = ' \t\r\n'
     def __init__(self, brackets='', pipe=False, quotes='"'):
+        # Punctuation characters are always tokens of their own.  The null
+        # character has always been one, though nothing treats it specially.
+        punctuation = '\x00'
         if brackets:
-            self.validChars=self.validChars.translate(utils.str.chars, brackets)
             self.left = brackets[0]
             self.right = brackets[1]
+            punctuation += brackets
         else:
             self.left = ''
             self.right = ''
         self.pipe = pipe
         if self.pipe:
-            self.validChars = self.validChars.translate(utils.str.chars, '|')
+            punctuation += '|'
         self.quotes = quotes
-        self.validChars = self.validChars.translate(utils.str.chars, quotes)
-
+        def charClass(chars, negate=False):
+            return '[%s%s]' % (negate and '^' or '', re.escape(chars))
+        # A token is a quoted string (in which a backslash escapes anything),
+        # a word (which can contain, but not begin with, quote characters),
+        # or a single punctuation character.
+        alternatives = [r'%s(?:[^\\%s]|\\.)*%s' % (q, q, q)
+                        for q in map(re.escape, quotes)]
+        alternatives.append('%s%s*' %
+                            (charClass(self.whitespace+punctuation+quotes,
+                                       negate=True),
+                             charClass(self.whitespace+punctuation,
+                                       negate=True)))
+        alternatives.append(charClass(punctuation))
+        self._tokenRe = re.compile(r'%s*(%s)' % (charClass(self.whitespace),
+                                                 '|'.join(alternatives)),
+                                   re.S)
 
     def _handleToken(self, token):
         if token[0] == token[-1] and token[0] in self.quotes:
@@ -278,10 +324,26 @@ class Tokenizer(object):
             token = token.decode('string_escape')
         return token
 
-    def _insideBrackets(self, lexer):
+    def _tokens(self, s):
+        """Yields the raw tokens in s, followed by an empty string."""
+        pos = 0
+        match = self._tokenRe.match
+        while True:
+            m = match(s, pos)
+            if m is None:
+                if s[pos:].strip(self.whitespace):
+                    # Everything else matches something, so this must be the
+                    # start of a quoted string with no end.
+                    raise ValueError, 'No closing quotation'
+                yield ''
+                return
+            pos = m.end()
+            yield m.group(1)
+
+    def _insideBrackets(self, tokens):
         ret = []
         while True:
-            token = lexer.get_token()
+            token = tokens.next()
             if not token:
                 raise SyntaxError, 'Missing "%s".  You may want to ' \
                                    'quote your arguments with double ' \
@@ -291,21 +353,17 @@ class Tokenizer(object):
             elif token == self.right:
                 return ret
             elif token == self.left:
-                ret.append(self._insideBrackets(lexer))
+                ret.append(self._insideBrackets(tokens))
             else:
                 ret.append(self._handleToken(token))
-            firstToken = False
         return ret
 
     def tokenize(self, s):
-        lexer = shlex.shlex(StringIO(s))
-        lexer.commenters = ''
-        lexer.quotes = self.quotes
-        lexer.wordchars = self.validChars
+        tokens = self._tokens(s)
         args = []
         ends = []
         while True:
-            token = lexer.get_token()
+            token = tokens.next()
             if not token:
                 break
             elif token == '|' and self.pipe:
@@ -319,7 +377,7 @@ class Tokenizer(object):
                 ends.append(args)
                 args = []
             elif token == self.left:
-                args.append(self._insideBrackets(lexer))
+                args.append(self._insideBrackets(tokens))
             elif token == self.right:
                 raise SyntaxError, 'Spurious "%s".  You may want to ' \
                                    'quote your arguments with double ' \
@@ -338,8 +396,35 @@ class Tokenizer(object):
                 args[-1].append(ends.pop())
         return args
 
-def tokenize(s, channel=None):
-    """A utility function to create a Tokenizer and tokenize a string."""
+def freezeTokens(tokens):
+    """Returns tokens (as returned by tokenize) as nested tuples, which can be
+    shared and handed to NestedCommandsIrcProxy any number of times."""
+    L = []
+    for token in tokens:
+        if isinstance(token, (list, tuple)):
+            token = freezeTokens(token)
+        L.append(token)
+    return tuple(L)
+
+def _thawTokens(tokens):
+    L = []
+    for token in tokens:
+        if isinstance(token, tuple):
+            token = _thawTokens(token)
+        L.append(token)
+    return L
+
+_tokenizers = {}
+_tokenized = utils.structures.CacheDict(1000)
+def tokenize(s, channel=None, frozen=False):
+    """A utility function to create a Tokenizer and tokenize a string.
+
+    Tokenizers are reused, and the tokens of recently tokenized strings are
+    cached, since Alias, Scheduler, and friends tokenize the same strings over
+    and over.  Callers are given their own lists of tokens unless frozen is
+    True, in which case the (shared) nested tuples from freezeTokens are
+    returned.
+    """
     pipe = False
     brackets = ''
     nested = conf.supybot.commands.nested
@@ -348,12 +433,24 @@ def tokenize(s, channel=None):
         if conf.get(nested.pipeSyntax, channel): # No nesting, no pipe.
             pipe = True
     quotes = conf.get(conf.supybot.commands.quotes, channel)
-    start = time.time()
+    key = (s, brackets, pipe, quotes)
     try:
-        ret = Tokenizer(brackets=brackets,pipe=pipe,quotes=quotes).tokenize(s)
+        ret = _tokenized[key]
+    except KeyError:
+        try:
+            tokenizer = _tokenizers[key[1:]]
+        except KeyError:
+            tokenizer = Tokenizer(brackets=brackets, pipe=pipe, quotes=quotes)
+            _tokenizers[key[1:]] = tokenizer
+        try:
+            ret = freezeTokens(tokenizer.tokenize(s))
+        except ValueError, e:
+            raise SyntaxError, str(e)
+        _tokenized[key] = ret
+    if frozen:
         return ret
-    except ValueError, e:
-        raise SyntaxError, str(e)
+    else:
+        return _thawTokens(ret)
 
 def formatCommand(command):
     return ' '.join(command)
@@ -486,6 +583,10 @@ class RichReplyMethods(object):
             s = v
         return self._error(s, **kwargs)
 
+    def errorBusy(self, s='', **kwargs):
+        v = self._getConfig(conf.supybot.replies.busy)
+        return self._error(self.__makeReply(v, s), **kwargs)
+
     def errorNotRegistered(self, s='', **kwargs):
         v = self._getConfig(conf.supybot.replies.notRegistered)
         return self._error(self.__makeReply(v, s), **kwargs)
@@ -576,7 +677,8 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
     "A proxy object to allow proper nesting of commands (even threaded ones)."
     _mores = ircutils.IrcDict()
     def __init__(self, irc, msg, args, nested=0):
-        assert isinstance(args, list), 'Args should be a list, not a string.'
+        assert isinstance(args, (list, tuple)), \
+               'Args should be a list, not a string.'
         self.irc = irc
         self.msg = msg
         self.nested = nested
@@ -592,10 +694,12 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
                         self.msg.prefix, maxNesting)
             return self.error('You\'ve attempted more nesting than is '
                               'currently allowed on this bot.')
-        # The deepcopy here is necessary for Scheduler; it re-runs already
-        # tokenized commands.  There's a possibility a simple copy[:] would
-        # work, but we're being careful.
-        self.args = copy.deepcopy(args)
+        # We replace evaluated nested commands in self.args with their
+        # results, so we need our own copy.  Nested commands get their own
+        # NestedCommandsIrcProxy, which copies its own args, so copying only
+        # this level is enough to leave the given tokens untouched (and so
+        # Scheduler and friends can re-run them, even as frozen tuples).
+        self.args = list(args)
         self.counter = 0
         self._resetReplyAttributes()
         if not args:
@@ -635,7 +739,7 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
                 # probably put it.
                 self.counter += 1
             else:
-                assert isinstance(self.args[self.counter], list)
+                assert isinstance(self.args[self.counter], (list, tuple))
                 # It's a list.  So we spawn another NestedCommandsIrcProxy
                 # to evaluate its args.  When that class has finished
                 # evaluating its args, it will call our reply method, which
@@ -677,10 +781,10 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
                     log.debug('Done calling invalidCommands: %s.',cb.name())
                     return
         if threaded:
-            name = 'Thread #%s (for invalidCommands)' % world.threadsSpawned
-            t = world.SupyThread(target=callInvalidCommands, name=name)
-            t.setDaemon(True)
-            t.start()
+            if not world.executor.submit(callInvalidCommands,
+                                         group='invalidCommands',
+                                         name='invalidCommands'):
+                self.errorBusy()
         else:
             callInvalidCommands()
 
@@ -779,9 +883,7 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
             args = self.args[len(command):]
             if world.isMainThread() and \
                (cb.threaded or conf.supybot.debug.threadAllCommands()):
-                t = CommandThread(target=cb._callCommand,
-                                  args=(command, self, self.msg, args))
-                t.start()
+                threadCommand(cb, command, self, self.msg, (args,))
             else:
                 cb._callCommand(command, self, self.msg, args)
 
@@ -953,29 +1055,22 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
 
 IrcObjectProxy = NestedCommandsIrcProxy
 
-class CommandThread(world.SupyThread):
-    """Just does some extra logging and error-recovery for commands that need
-    to run in threads.
+def threadCommand(cb, command, irc, msg, args, kwargs={}):
+    """Calls cb._callCommand(command, irc, msg, *args, **kwargs) in one of
+    world.executor's threads, or replies with an error if too many commands
+    are already waiting for one.
     """
-    def __init__(self, target=None, args=(), kwargs={}):
-        self.command = args[0]
-        self.cb = target.im_self
-        threadName = 'Thread #%s (for %s.%s)' % (world.threadsSpawned,
-                                                 self.cb.name(),
-                                                 self.command)
-        log.debug('Spawning thread %s (args: %r)', threadName, args)
-        self.__parent = super(CommandThread, self)
-        self.__parent.__init__(target=target, name=threadName,
-                               args=args, kwargs=kwargs)
-        self.setDaemon(True)
-        self.originalThreaded = self.cb.threaded
-        self.cb.threaded = True
-
-    def run(self):
+    def run():
+        originalThreaded = cb.threaded
+        cb.threaded = True
         try:
-            self.__parent.run()
+            cb._callCommand(command, irc, msg, *args, **kwargs)
         finally:
-            self.cb.threaded = self.originalThreaded
+            cb.threaded = originalThreaded
+    name = '%s.%s' % (cb.name(), command)
+    log.debug('Queuing %s to run in a thread (args: %r)', name, args)
+    if not world.executor.submit(run, group=cb.name(), name=name):
+        irc.errorBusy()
 
 class CommandProcess(world.SupyProcess):
     """Just does some extra logging and error-recovery for commands that need
@@ -1196,11 +1291,16 @@ class Commands(BasePlugin):
                 if cap:
                     irc.errorNoCapability(cap)
                     return
+            start = time.time()
             try:
                 self.callingCommand = command
                 self.callCommand(command, irc, msg, *args, **kwargs)
             finally:
                 self.callingCommand = None
+                if conf.supybot.debug.timing():
+                    world.addTiming(world.commandTimings,
+                                    (self.name(), formatCommand(command)),
+                                    time.time() - start)
         except (getopt.GetoptError, ArgumentError), e:
             self.log.debug('Got %s, giving argument error.',
                            utils.exnToString(e))
@@ -1241,6 +1341,7 @@ class PluginMixin(BasePlugin, irclib.IrcCallback):
     noIgnore = False
     classModule = None
     Proxy = NestedCommandsIrcProxy
+    _callOnlyDispatches = True
     def __init__(self, irc):
         myName = self.name()
         self.log = log.getPluginLogger(myName)
@@ -1255,14 +1356,16 @@ class PluginMixin(BasePlugin, irclib.IrcCallback):
         return canonicalName(self.name())
 
     def __call__(self, irc, msg):
-        irc = SimpleProxy(irc, msg)
-        if msg.command == 'PRIVMSG':
-            if self.noIgnore or \
-               not ircdb.checkIgnored(msg.prefix, msg.args[0]) or \
-               not ircutils.isUserHostmask(msg.prefix):  # Some services impl.
-                self.__parent.__call__(irc, msg)
-        else:
-            self.__parent.__call__(irc, msg)
+        if msg.command == 'PRIVMSG' and not self.noIgnore:
+            # Irc.feedMsg tags the message, but we may be called directly.
+            ignored = msg.senderIgnored
+            if ignored is None:
+                ignored = ircutils.isUserHostmask(msg.prefix) and \
+                          ircdb.checkIgnored(msg.prefix, msg.args[0])
+                msg.tag('senderIgnored', bool(ignored))
+            if ignored:
+                return
+        self.__parent.__call__(SimpleProxy(irc, msg), msg)
 
     def registryValue(self, name, channel=None, value=True):
         plugin = self.name()
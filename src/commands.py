@@ -61,10 +61,8 @@ def thread(f):
     """Makes sure a command spawns a thread when called."""
     def newf(self, irc, msg, args, *L, **kwargs):
         if world.isMainThread():
-            targetArgs = (self.callingCommand, irc, msg, args) + tuple(L)
-            t = callbacks.CommandThread(target=self._callCommand,
-                                        args=targetArgs, kwargs=kwargs)
-            t.start()
+            callbacks.threadCommand(self, self.callingCommand, irc, msg,
+                                    (args,) + L, kwargs)
         else:
             f(self, irc, msg, args, *L, **kwargs)
     return utils.python.changeFunctionName(newf, f.func_name, f.__doc__)
@@ -124,20 +122,6 @@ def regexp_wrapper(s, reobj, timeout, plugin_name, fcn_name):
     except ProcessTimeoutError:
         return False
 
-class UrlSnarfThread(world.SupyThread):
-    def __init__(self, *args, **kwargs):
-        assert 'url' in kwargs
-        kwargs['name'] = 'Thread #%s (for snarfing %s)' % \
-                         (world.threadsSpawned, kwargs.pop('url'))
-        super(UrlSnarfThread, self).__init__(*args, **kwargs)
-        self.setDaemon(True)
-
-    def run(self):
-        try:
-            super(UrlSnarfThread, self).run()
-        except utils.web.Error, e:
-            log.debug('Exception in urlSnarfer: %s', utils.exnToString(e))
-
 class SnarfQueue(ircutils.FloodQueue):
     timeout = conf.supybot.snarfThrottle
     def key(self, channel):
@@ -186,14 +170,16 @@ def urlSnarfer(f):
                     self.log.debug('Not snarfing, msg is already repliedTo.')
                     return
                 f(self, irc, msg, match, *L, **kwargs)
+            except utils.web.Error, e:
+                log.debug('Exception in urlSnarfer: %s', utils.exnToString(e))
             finally:
                 _snarfLock.release()
         if threading.currentThread() is not world.mainThread:
             doSnarf()
-        else:
-            L = list(L)
-            t = UrlSnarfThread(target=doSnarf, url=url)
-            t.start()
+        elif not world.executor.submit(doSnarf, group=self.name(),
+                                       name='snarfing %s' % url):
+            # Snarfers aren't asked for, so there's no one to tell.
+            self.log.info('Not snarfing %s: too busy.', url)
     newf = utils.python.changeFunctionName(newf, f.func_name, f.__doc__)
     return newf
 
@@ -743,9 +729,7 @@ class context(object):
             self.converter = spec
 
     def __call__(self, irc, msg, args, state):
-        log.debug('args before %r: %r', self, args)
         self.converter(irc, msg, args, state, *self.args)
-        log.debug('args after %r: %r', self, args)
 
     def __repr__(self):
         return '<%s for %s>' % (self.__class__.__name__, self.spec)
@@ -870,24 +854,74 @@ class getopts(context):
     def __init__(self, getopts):
         self.spec = getopts # for repr
         self.getopts = {}
-        self.getoptL = []
+        getoptL = []
         for (name, spec) in getopts.iteritems():
             if spec == '':
-                self.getoptL.append(name)
+                getoptL.append(name)
                 self.getopts[name] = None
             else:
-                self.getoptL.append(name + '=')
+                getoptL.append(name + '=')
                 self.getopts[name] = contextify(spec)
-        log.debug('getopts: %r', self.getopts)
-        log.debug('getoptL: %r', self.getoptL)
+        self.getoptL = tuple(getoptL)
+        # Every prefix of every option maps to (name, takesArgument), or to
+        # None when the prefix is ambiguous.  Exact names always win, just as
+        # they do in getopt.getopt.
+        self.prefixes = {}
+        for name in self.getopts:
+            for i in xrange(len(name)):
+                prefix = name[:i]
+                if prefix in self.prefixes:
+                    self.prefixes[prefix] = None
+                else:
+                    self.prefixes[prefix] = (name, self.getopts[name] is not None)
+        for name in self.getopts:
+            self.prefixes[name] = (name, self.getopts[name] is not None)
+
+    def getopt(self, args):
+        """Equivalent to getopt.getopt(args, '', self.getoptL), but using the
+        option table computed when the spec was defined."""
+        optlist = []
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            if not arg.startswith('-') or arg == '-':
+                break
+            i += 1
+            if arg == '--':
+                break
+            if not arg.startswith('--'):
+                raise getopt.GetoptError('option -%s not recognized' % arg[1],
+                                         arg[1])
+            opt = arg[2:]
+            optarg = None
+            if '=' in opt:
+                (opt, optarg) = opt.split('=', 1)
+            try:
+                (name, hasArg) = self.prefixes[opt]
+            except KeyError:
+                raise getopt.GetoptError('option --%s not recognized' % opt,
+                                         opt)
+            except TypeError:
+                raise getopt.GetoptError('option --%s not a unique prefix' % opt,
+                                         opt)
+            if hasArg:
+                if optarg is None:
+                    if i == len(args):
+                        raise getopt.GetoptError('option --%s requires '
+                                                 'argument' % name, name)
+                    optarg = args[i]
+                    i += 1
+            elif optarg is not None:
+                raise getopt.GetoptError('option --%s must not have an '
+                                         'argument' % name, name)
+            optlist.append(('--' + name, optarg or ''))
+        return (optlist, args[i:])
 
     def __call__(self, irc, msg, args, state):
-        log.debug('args before %r: %r', self, args)
-        (optlist, rest) = getopt.getopt(args, '', self.getoptL)
+        (optlist, rest) = self.getopt(args)
         getopts = []
         for (opt, arg) in optlist:
             opt = opt[2:] # Strip --
-            log.debug('opt: %r, arg: %r', opt, arg)
             context = self.getopts[opt]
             if context is not None:
                 st = state.essence()
@@ -898,7 +932,6 @@ class getopts(context):
                 getopts.append((opt, True))
         state.args.append(getopts)
         args[:] = rest
-        log.debug('args after %r: %r', self, args)
 
 ###
 # This is our state object, passed to converters along with irc, msg, and args.
@@ -921,10 +954,10 @@ class State(object):
             raise AttributeError, attr
 
     def essence(self):
-        st = State(self.types)
-        for (attr, value) in self.__dict__.iteritems():
-            if attr not in ('args', 'kwargs'):
-                setattr(st, attr, value)
+        st = self.__class__.__new__(self.__class__)
+        st.__dict__.update(self.__dict__)
+        st.args = []
+        st.kwargs = {}
         return st
 
     def __repr__(self):
@@ -934,7 +967,8 @@ class State(object):
 
 
 ###
-# This is a compiled Spec object.
+# This is a compiled Spec object.  The contexts (and their converters) are
+# resolved once, when the spec is defined; calling it just runs them in order.
 ###
 class Spec(object):
     def _state(self, types, attrs={}):
@@ -944,18 +978,16 @@ class Spec(object):
         return st
 
     def __init__(self, types, allowExtra=False):
-        self.types = types
+        self.types = tuple(map(contextify, types))
         self.allowExtra = allowExtra
-        utils.seq.mapinto(contextify, self.types)
 
     def __call__(self, irc, msg, args, stateAttrs={}):
-        state = self._state(self.types[:], stateAttrs)
-        while state.types:
-            context = state.types.pop(0)
-            try:
+        state = self._state(self.types, stateAttrs)
+        try:
+            for context in self.types:
                 context(irc, msg, args, state)
-            except IndexError:
-                raise callbacks.ArgumentError
+        except IndexError:
+            raise callbacks.ArgumentError
         if args and not state.allowExtra:
             log.debug('args and not self.allowExtra: %r', args)
             raise callbacks.ArgumentError
@@ -533,6 +533,11 @@ registerChannelValue(supybot.replies, 'possibleBug',
     <http://sourceforge.net/tracker/?func=add&group_id=58965&atid=489447>.""",
     """Determines what message the bot sends when it thinks you've encountered
     a bug that the developers don't know about."""))
+registerChannelValue(supybot.replies, 'busy',
+    registry.NormalizedString("""I'm too busy to do that right now; please try
+    again later.""", """Determines what error message the bot gives when it
+    has too many threaded commands waiting to run another one."""))
+
 ###
 # End supybot.replies.
 ###
@@ -615,6 +620,19 @@ registerGlobalValue(supybot.commands.defaultPlugins, 'importantPlugins',
         change this if you don't know what you're doing; if you do know what
         you're doing, then also know that this set is case-sensitive."""))
 
+registerGroup(supybot.commands, 'threads')
+registerGlobalValue(supybot.commands.threads, 'maximum',
+    registry.PositiveInteger(16, """Determines how many threads the bot will
+    use at most to run threaded commands, url snarfers, and invalidCommand
+    methods."""))
+registerGlobalValue(supybot.commands.threads, 'maximumPerPlugin',
+    registry.PositiveInteger(4, """Determines how many of those threads may be
+    running commands from any one plugin at once."""))
+registerGlobalValue(supybot.commands.threads, 'maximumQueued',
+    registry.NonNegativeInteger(64, """Determines how many threaded commands
+    may be waiting for a thread.  Commands beyond this are refused with an
+    error."""))
+
 # supybot.commands.disabled moved to callbacks for canonicalName.
 
 ###
@@ -875,6 +893,16 @@ registerGlobalValue(supybot.databases.types.cdb, 'maximumModifications',
     their modifications flushed to disk.  When the number of modified records
     is greater than this fraction of the total number of records, the database
     will be entirely flushed to disk."""))
+registerGlobalValue(supybot.databases.types, 'journal',
+    registry.Boolean(True, """Determines whether per-channel, per-user
+    databases (such as those used by the Seen, Herald, and ChannelStats
+    plugins) will append their changes to a journal when flushed, rather than
+    rewriting the whole database each time."""))
+registerGlobalValue(supybot.databases.types.journal, 'maximumModifications',
+    registry.Probability(0.5, """Determines how often journaled databases will
+    be compacted.  When the journal holds more records than this fraction of
+    the total number of records, the database will be rewritten (in another
+    thread) and the journal emptied."""))
 
 # XXX Configuration variables for dbi, sqlite, flat, mysql, etc.
 
@@ -1009,6 +1037,9 @@ registerGroup(supybot.protocols.irc.queuing, 'rateLimit')
 registerGlobalValue(supybot.protocols.irc.queuing.rateLimit, 'join',
     registry.Float(0, """Determines how many seconds must elapse between JOINs
     sent to the server."""))
+registerGlobalValue(supybot.protocols.irc.queuing.rateLimit, 'who',
+    registry.Float(1.0, """Determines how many seconds must elapse between the
+    WHOs the bot sends to refresh the membership of its channels."""))
 
 ###
 # supybot.protocols.http
@@ -1025,6 +1056,12 @@ registerGlobalValue(supybot.protocols.http, 'proxy',
     through.  The value should be of the form 'host:port'."""))
 utils.web.proxy = supybot.protocols.http.proxy
 
+registerGlobalValue(supybot.protocols.http, 'cacheSize',
+    registry.NonNegativeInteger(0, """Determines how many HTTP responses the
+    bot will keep in memory for as long as their Cache-Control or Expires
+    headers say they're fresh.  If set to 0, responses won't be cached."""))
+utils.web.client.cacheSize = supybot.protocols.http.cacheSize
+
 
 ###
 # Especially boring stuff.
@@ -1076,6 +1113,11 @@ registerGroup(supybot, 'debug')
 registerGlobalValue(supybot.debug, 'threadAllCommands',
     registry.Boolean(False, """Determines whether the bot will automatically
     thread all commands."""))
+registerGlobalValue(supybot.debug, 'timing',
+    registry.Boolean(True, """Determines whether the bot will keep track of
+    how long each plugin's __call__, inFilter, and outFilter methods and each
+    command take.  The Status plugin's slowplugins and slowcommands commands
+    report them."""))
 registerGlobalValue(supybot.debug, 'flushVeryOften',
     registry.Boolean(False, """Determines whether the bot will automatically
     flush all flushers *very* often.  Useful for debugging when you don't know
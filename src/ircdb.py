@@ -33,6 +33,7 @@ from __future__ import division
 import os
 import time
 import operator
+from cStringIO import StringIO
 
 import supybot.log as log
 import supybot.conf as conf
@@ -559,6 +560,25 @@ class IrcChannelCreator(Creator):
 class DuplicateHostmask(ValueError):
     pass
 
+def _updatePreserved(preserved, changed, records):
+    """Re-preserves the records (from the records dict) whose keys are in
+    changed, updating preserved, a dict mapping keys to their preserved text.
+    Returns whether any of that text actually changed."""
+    dirty = False
+    for key in changed:
+        if key in records:
+            fd = StringIO()
+            records[key].preserve(fd, indent='  ')
+            s = fd.getvalue()
+            if preserved.get(key) != s:
+                preserved[key] = s
+                dirty = True
+        elif key in preserved:
+            del preserved[key]
+            dirty = True
+    changed.clear()
+    return dirty
+
 class UsersDictionary(utils.IterableMap):
     """A simple serialized-to-file User Database."""
     def __init__(self):
@@ -566,6 +586,10 @@ class UsersDictionary(utils.IterableMap):
         self.filename = None
         self.users = {}
         self.nextId = 0
+        # Users handed out since the last flush (and thus possibly modified),
+        # and the text each user was last written to disk as.
+        self.changed = set()
+        self.preserved = {}
         self._nameCache = utils.structures.CacheDict(1000)
         self._hostmaskCache = utils.structures.CacheDict(1000)
 
@@ -591,6 +615,8 @@ class UsersDictionary(utils.IterableMap):
         """Reloads the database from its file."""
         self.nextId = 0
         self.users.clear()
+        self.changed.clear()
+        self.preserved.clear()
         self._nameCache.clear()
         self._hostmaskCache.clear()
         if self.filename is not None:
@@ -602,16 +628,19 @@ class UsersDictionary(utils.IterableMap):
             log.error('UsersDictionary.reload called with no filename.')
 
     def flush(self):
-        """Flushes the database to its file."""
+        """Flushes the database to its file, if anything in it has changed."""
         if not self.noFlush:
             if self.filename is not None:
-                L = self.users.items()
+                if not _updatePreserved(self.preserved, self.changed,
+                                        self.users):
+                    return
+                L = self.preserved.items()
                 L.sort()
                 fd = utils.file.AtomicFile(self.filename)
-                for (id, u) in L:
+                for (id, s) in L:
                     fd.write('user %s' % id)
                     fd.write(os.linesep)
-                    u.preserve(fd, indent='  ')
+                    fd.write(s)
                 fd.close()
             else:
                 log.error('UsersDictionary.flush called with no filename.')
@@ -654,6 +683,7 @@ class UsersDictionary(utils.IterableMap):
                     for (id, hostmask) in ids.iteritems():
                         log.error('Removing %q from user %s.', hostmask, id)
                         self.users[id].removeHostmask(hostmask)
+                        self.changed.add(id)
                     raise DuplicateHostmask, 'Ids %r matched.' % ids
         else: # Not a hostmask, must be a name.
             s = s.lower()
@@ -678,6 +708,9 @@ class UsersDictionary(utils.IterableMap):
             id = u
             u = self.users[id]
         u.id = id
+        # Callers are free to modify the user they get, so we'll have to check
+        # it at the next flush.
+        self.changed.add(id)
         return u
 
     def hasUser(self, id):
@@ -734,12 +767,14 @@ class UsersDictionary(utils.IterableMap):
                         raise DuplicateHostmask, hostmask
         self.invalidateCache(user.id)
         self.users[user.id] = user
+        self.changed.add(user.id)
         if flush:
             self.flush()
 
     def delUser(self, id):
         """Removes a user from the database."""
         del self.users[id]
+        self.changed.add(id)
         if id in self._nameCache:
             del self._nameCache[self._nameCache[id]]
             del self._nameCache[id]
@@ -755,6 +790,7 @@ class UsersDictionary(utils.IterableMap):
         self.nextId += 1
         id = self.nextId
         self.users[id] = user
+        self.changed.add(id)
         self.flush()
         user.id = id
         return user
@@ -765,6 +801,9 @@ class ChannelsDictionary(utils.IterableMap):
         self.noFlush = False
         self.filename = None
         self.channels = ircutils.IrcDict()
+        # See UsersDictionary.
+        self.changed = set()
+        self.preserved = {}
 
     def open(self, filename):
         self.noFlush = True
@@ -785,14 +824,22 @@ class ChannelsDictionary(utils.IterableMap):
             self.noFlush = False
 
     def flush(self):
-        """Flushes the channel database to its file."""
+        """Flushes the channel database to its file, if anything in it has
+        changed."""
         if not self.noFlush:
             if self.filename is not None:
+                if not _updatePreserved(self.preserved, self.changed,
+                                        self.channels):
+                    return
+                # self.preserved is keyed by the rfc1459-lowered name; the
+                # file keeps the name self.channels has for the channel.
+                L = self.channels.keys()
+                L.sort()
                 fd = utils.file.AtomicFile(self.filename)
-                for (channel, c) in self.channels.iteritems():
+                for channel in L:
                     fd.write('channel %s' % channel)
                     fd.write(os.linesep)
-                    c.preserve(fd, indent='  ')
+                    fd.write(self.preserved[ircutils.toLower(channel)])
                 fd.close()
             else:
                 log.warning('ChannelsDictionary.flush without self.filename.')
@@ -809,6 +856,8 @@ class ChannelsDictionary(utils.IterableMap):
         """Reloads the channel database from its file."""
         if self.filename is not None:
             self.channels.clear()
+            self.changed.clear()
+            self.preserved.clear()
             try:
                 self.open(self.filename)
             except EnvironmentError, e:
@@ -819,6 +868,7 @@ class ChannelsDictionary(utils.IterableMap):
     def getChannel(self, channel):
         """Returns an IrcChannel object for the given channel."""
         channel = channel.lower()
+        self.changed.add(ircutils.toLower(channel))
         if channel in self.channels:
             return self.channels[channel]
         else:
@@ -830,6 +880,7 @@ class ChannelsDictionary(utils.IterableMap):
         """Sets a given channel to the IrcChannel object given."""
         channel = channel.lower()
         self.channels[channel] = ircChannel
+        self.changed.add(ircutils.toLower(channel))
         self.flush()
 
     def iteritems(self):
@@ -840,6 +891,7 @@ class IgnoresDB(object):
     def __init__(self):
         self.filename = None
         self.hostmasks = {}
+        self.dirty = False
 
     def open(self, filename):
         self.filename = filename
@@ -857,9 +909,13 @@ class IgnoresDB(object):
             except Exception, e:
                 log.error('Invalid line in ignores database: %q', line)
         fd.close()
+        self.dirty = False
 
     def flush(self):
         if self.filename is not None:
+            if not self.dirty:
+                return
+            self.dirty = False
             fd = utils.file.AtomicFile(self.filename)
             now = time.time()
             for (hostmask, expiration) in self.hostmasks.items():
@@ -894,6 +950,7 @@ class IgnoresDB(object):
         for (hostmask, expiration) in self.hostmasks.items():
             if expiration and now > expiration:
                 del self.hostmasks[hostmask]
+                self.dirty = True
             else:
                 if ircutils.hostmaskPatternEqual(hostmask, prefix):
                     return True
@@ -902,9 +959,11 @@ class IgnoresDB(object):
     def add(self, hostmask, expiration=0):
         assert ircutils.isUserHostmask(hostmask), 'got %s' % hostmask
         self.hostmasks[hostmask] = expiration
+        self.dirty = True
 
     def remove(self, hostmask):
         del self.hostmasks[hostmask]
+        self.dirty = True
 
 
 confDir = conf.supybot.directories.conf()
@@ -69,6 +69,12 @@ class IrcCallback(IrcCommandDispatcher):
     """
     callAfter = ()
     callBefore = ()
+    # The IRC commands this callback wants to be called for.  None means it's
+    # figured out from the doCommand methods; see handledCommands.
+    handles = None
+    # Only checked in a class's own __dict__; it says that the __call__ that
+    # class defines does nothing more than dispatch to doCommand methods.
+    _callOnlyDispatches = True
     __metaclass__ = log.MetaFirewall
     __firewalled__ = {'die': None,
                       'reset': None,
@@ -131,6 +137,33 @@ class IrcCallback(IrcCommandDispatcher):
         if method is not None:
             method(irc, msg)
 
+    def handledCommands(self):
+        """Returns the set of IRC commands this callback should be called for,
+        or None if it should be called for every message.
+
+        Unless the 'handles' attribute is set, this is derived from the
+        callback's doCommand methods, but only when its __call__ does nothing
+        more than dispatch to them.
+        """
+        if self.handles is not None:
+            return frozenset([command.upper() for command in self.handles])
+        cls = self.__class__
+        if cls.dispatchCommand.im_func is not \
+           IrcCommandDispatcher.dispatchCommand.im_func or \
+           hasattr(cls, '__getattr__'):
+            return None
+        for klass in cls.__mro__:
+            if '__call__' in klass.__dict__:
+                if not klass.__dict__.get('_callOnlyDispatches'):
+                    return None
+                break
+        commands = set()
+        for name in dir(self):
+            if name.startswith('do') and len(name) > 2 and \
+               callable(getattr(self, name, None)):
+                commands.add(name[2:].upper())
+        return frozenset(commands)
+
     def reset(self):
         """Resets the callback.  Called when reconnecting to the server."""
         pass
@@ -229,31 +262,128 @@ class IrcMsgQueue(object):
 # Maintains the state of IRC connection -- the most recent messages, the
 # status of various modes (especially ops/halfops/voices) in channels, etc.
 ###
+# Channel membership is kept as a dict from each member's lowered nick to
+# their nick, and a dict from lowered nicks to the modes (as bits) they have.
+# Both nicks are interned, so every channel (and every copy of a channel) with
+# someone in it shares the one copy of their nick.
+_op = 1
+_halfop = 2
+_voice = 4
+def _intern(nick):
+    return intern(str(nick))
+
+class ChannelMembers(object):
+    """A set-like view of the nicks in a ChannelState that have the given mode
+    bit, or of all its users, if bit is 0.  Changing it changes the
+    ChannelState."""
+    __slots__ = ('channel', 'bit')
+    def __init__(self, channel, bit=0):
+        self.channel = channel
+        self.bit = bit
+
+    def _keys(self):
+        if self.bit:
+            bit = self.bit
+            return [key for (key, bits) in self.channel.flags.iteritems()
+                    if bits & bit]
+        else:
+            return self.channel.members.keys()
+
+    def __contains__(self, nick):
+        try:
+            key = ircutils.toLower(nick)
+        except (TypeError, AttributeError):
+            return False
+        if self.bit:
+            return bool(self.channel.flags.get(key, 0) & self.bit)
+        else:
+            return key in self.channel.members
+
+    def __iter__(self):
+        members = self.channel.members
+        for key in self._keys():
+            yield ircutils.IrcString(members.get(key, key))
+
+    def __len__(self):
+        if self.bit:
+            return len(self._keys())
+        else:
+            return len(self.channel.members)
+
+    def __nonzero__(self):
+        return bool(len(self))
+
+    def add(self, nick):
+        key = _intern(ircutils.toLower(nick))
+        if self.bit:
+            flags = self.channel.flags
+            flags[key] = flags.get(key, 0) | self.bit
+        else:
+            self.channel.members[key] = _intern(nick)
+
+    def discard(self, nick):
+        key = ircutils.toLower(nick)
+        if self.bit:
+            flags = self.channel.flags
+            if key in flags:
+                bits = flags[key] & ~self.bit
+                if bits:
+                    flags[key] = bits
+                else:
+                    del flags[key]
+        else:
+            self.channel.members.pop(key, None)
+
+    def remove(self, nick):
+        if nick not in self:
+            raise KeyError, nick
+        self.discard(nick)
+
+    def __eq__(self, other):
+        try:
+            return set(self._keys()) == set(map(ircutils.toLower, other))
+        except (TypeError, AttributeError):
+            return False
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, list(self))
+
+
 class ChannelState(utils.python.Object):
-    __slots__ = ('users', 'ops', 'halfops', 'bans',
-                 'voices', 'topic', 'modes', 'created')
+    __slots__ = ('members', 'flags', 'bans', 'topic', 'modes', 'created')
     def __init__(self):
         self.topic = ''
         self.created = 0
-        self.ops = ircutils.IrcSet()
+        self.members = {}
+        self.flags = {}
         self.bans = ircutils.IrcSet()
-        self.users = ircutils.IrcSet()
-        self.voices = ircutils.IrcSet()
-        self.halfops = ircutils.IrcSet()
         self.modes = ircutils.IrcDict()
 
+    users = property(lambda self: ChannelMembers(self))
+    ops = property(lambda self: ChannelMembers(self, _op))
+    halfops = property(lambda self: ChannelMembers(self, _halfop))
+    voices = property(lambda self: ChannelMembers(self, _voice))
+
+    def _hasBit(self, nick, bit):
+        return bool(self.flags.get(ircutils.toLower(nick), 0) & bit)
+
     def isOp(self, nick):
-        return nick in self.ops
+        return self._hasBit(nick, _op)
     def isVoice(self, nick):
-        return nick in self.voices
+        return self._hasBit(nick, _voice)
     def isHalfop(self, nick):
-        return nick in self.halfops
+        return self._hasBit(nick, _halfop)
 
     def addUser(self, user):
         "Adds a given user to the ChannelState.  Power prefixes are handled."
         nick = user.lstrip('@%+&~!')
         if not nick:
             return
+        key = _intern(ircutils.toLower(nick))
+        bits = 0
         # & is used to denote protected users in UnrealIRCd
         # ~ is used to denote channel owner in UnrealIRCd
         # ! is used to denote protected users in UltimateIRCd
@@ -261,29 +391,34 @@ class ChannelState(utils.python.Object):
             (marker, user) = (user[0], user[1:])
             assert user, 'Looks like my caller is passing chars, not nicks.'
             if marker in '@&~!':
-                self.ops.add(nick)
+                bits |= _op
             elif marker == '%':
-                self.halfops.add(nick)
+                bits |= _halfop
             elif marker == '+':
-                self.voices.add(nick)
-        self.users.add(nick)
+                bits |= _voice
+        if bits:
+            self.flags[key] = self.flags.get(key, 0) | bits
+        self.members[key] = _intern(nick)
 
     def replaceUser(self, oldNick, newNick):
         """Changes the user oldNick to newNick; used for NICK changes."""
         # Note that this doesn't have to have the sigil (@%+) that users
         # have to have for addUser; it just changes the name of the user
         # without changing any of his categories.
-        for s in (self.users, self.ops, self.halfops, self.voices):
-            if oldNick in s:
-                s.remove(oldNick)
-                s.add(newNick)
+        oldKey = ircutils.toLower(oldNick)
+        newKey = _intern(ircutils.toLower(newNick))
+        if oldKey in self.members:
+            del self.members[oldKey]
+            self.members[newKey] = _intern(newNick)
+        if oldKey in self.flags:
+            bits = self.flags.pop(oldKey)
+            self.flags[newKey] = self.flags.get(newKey, 0) | bits
 
     def removeUser(self, user):
         """Removes a given user from the channel."""
-        self.users.discard(user)
-        self.ops.discard(user)
-        self.halfops.discard(user)
-        self.voices.discard(user)
+        key = ircutils.toLower(user)
+        self.members.pop(key, None)
+        self.flags.pop(key, None)
 
     def setMode(self, mode, value=None):
         assert mode not in 'ovhbeq'
@@ -328,6 +463,23 @@ class ChannelState(utils.python.Object):
     def __setstate__(self, t):
         for (name, value) in zip(self.__slots__, t):
             setattr(self, name, value)
+        # Unpickled nicks aren't interned.
+        self.members = dict([(_intern(key), _intern(nick))
+                             for (key, nick) in self.members.iteritems()])
+        self.flags = dict([(_intern(key), bits)
+                           for (key, bits) in self.flags.iteritems()])
+
+    def __deepcopy__(self, memo):
+        # The nicks and their bits are immutable, so there's no need to copy
+        # them one at a time.
+        ret = self.__class__()
+        ret.topic = self.topic
+        ret.created = self.created
+        ret.members = self.members.copy()
+        ret.flags = self.flags.copy()
+        ret.bans = copy.deepcopy(self.bans, memo)
+        ret.modes = copy.deepcopy(self.modes, memo)
+        return ret
 
     def __eq__(self, other):
         ret = True
@@ -478,11 +630,24 @@ class IrcState(IrcCommandDispatcher):
             else:
                 self.supported[arg] = None
 
+    def _addWhoReply(self, channel, nick, user, host, flags):
+        self.nicksToHostmasks[nick] = '%s!%s@%s' % (nick, user, host)
+        if channel in self.channels:
+            # The flags are H or G (here or gone), maybe * (an IRC operator),
+            # then the same prefixes as in NAMES replies.
+            prefixes = ''.join([c for c in flags if c in '@%+&~!'])
+            self.channels[channel].addUser(prefixes + nick)
+
     def do352(self, irc, msg):
         # WHO reply.
-        (nick, user, host) = (msg.args[5], msg.args[2], msg.args[3])
-        hostmask = '%s!%s@%s' % (nick, user, host)
-        self.nicksToHostmasks[nick] = hostmask
+        (channel, user, host, nick, flags) = msg.args[1:4] + msg.args[5:7]
+        self._addWhoReply(channel, nick, user, host, flags)
+
+    def do354(self, irc, msg):
+        # WHOX reply, which is only ours if it has our token.
+        if len(msg.args) == 7 and msg.args[1] == ChannelRefresher.whoxToken:
+            (channel, user, host, nick, flags) = msg.args[2:]
+            self._addWhoReply(channel, nick, user, host, flags)
 
     def do353(self, irc, msg):
         # NAMES reply.
@@ -590,6 +755,77 @@ class IrcState(IrcCommandDispatcher):
 
 
 
+###
+# Sends the WHOs that refresh the membership of an Irc's channels.
+###
+class ChannelRefresher(object):
+    """Keeps track of the channels whose membership has been asked to be
+    refreshed, so only one WHO is sent for each however many ask for it.
+    WHOs are sent no more often than
+    supybot.protocols.irc.queuing.rateLimit.who allows, and ask only for what
+    IrcState uses if the server supports WHOX.  Those asking can give a
+    function to be called (with the Irc and the channel) once the channel's
+    WHO is over."""
+    whoxToken = '1'
+    # A channel whose WHO hasn't ended after this many seconds can be asked to
+    # be refreshed again.
+    timeout = 60
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.waiting = [] # The channels whose WHOs haven't been sent yet.
+        self.sent = ircutils.IrcDict() # When the others' WHOs were sent.
+        self.callbacks = ircutils.IrcDict()
+        self.lastSent = 0
+
+    def refresh(self, channel, callback=None, resend=False):
+        """Asks for channel to be refreshed.  If resend is True, another WHO
+        is sent even if one already has been (as when we've rejoined the
+        channel, so what the one sent will tell us is out of date)."""
+        if channel not in self.callbacks:
+            self.callbacks[channel] = []
+            self.waiting.append(channel)
+        elif channel in self.sent and \
+             (resend or self.sent[channel] + self.timeout < time.time()):
+            del self.sent[channel]
+            self.waiting.append(channel)
+        if callback is not None:
+            self.callbacks[channel].append(callback)
+
+    def takeMsg(self, irc, now):
+        """Returns the next WHO to send, if there's one waiting and it's time
+        for it."""
+        if not self.waiting:
+            return None
+        limit = conf.supybot.protocols.irc.queuing.rateLimit.who()
+        if now - self.lastSent < limit:
+            return None
+        channel = self.waiting.pop(0)
+        self.sent[channel] = now
+        self.lastSent = now
+        if 'whox' in irc.state.supported:
+            # Token, channel, user, host, nick, and flags.
+            return ircmsgs.who(channel, args=('%%tcuhnf,%s' % self.whoxToken,))
+        else:
+            return ircmsgs.who(channel)
+
+    def done(self, irc, channel):
+        """Called when a WHO for channel is over, whoever sent it."""
+        if channel not in self.callbacks:
+            return
+        if channel in self.sent:
+            del self.sent[channel]
+        else:
+            self.waiting = [c for c in self.waiting
+                            if not ircutils.strEqual(c, channel)]
+        for f in self.callbacks.pop(channel):
+            try:
+                f(irc, channel)
+            except Exception:
+                log.exception('Uncaught exception in refresh callback:')
+
+
 ###
 # The basic class for handling a connection to an IRC server.  Accepts
 # callbacks of the IrcCallback interface.  Public attributes include 'driver',
@@ -618,7 +854,12 @@ class Irc(IrcCommandDispatcher):
         self.state = IrcState()
         self.queue = IrcMsgQueue()
         self.fastqueue = smallqueue()
+        self.refresher = ChannelRefresher()
         self.driver = None # The driver should set this later.
+        self._dispatchedCallbacks = None
+        self._handled = []
+        self._dispatchTable = {}
+        self._inFilters = []
         self._setNonResettingVariables()
         self._queueConnectMessages()
         self.startedSync = ircutils.IrcDict()
@@ -696,6 +937,38 @@ class Irc(IrcCommandDispatcher):
         self.callbacks[:] = good
         return bad
 
+    def _checkDispatchTable(self):
+        # self.callbacks may be shared with other Irc objects and changed by
+        # them, so we check it hasn't changed rather than relying on our own
+        # addCallback/removeCallback to tell us.
+        cbs = tuple(self.callbacks)
+        if cbs != self._dispatchedCallbacks:
+            self._dispatchedCallbacks = cbs
+            self._handled = []
+            self._inFilters = []
+            defaultInFilter = IrcCallback.inFilter.im_func
+            for cb in cbs:
+                if hasattr(cb, 'handledCommands'):
+                    self._handled.append((cb, cb.handledCommands()))
+                else:
+                    self._handled.append((cb, None))
+                if getattr(cb.inFilter, 'im_func', None) is not defaultInFilter:
+                    self._inFilters.append(cb)
+            self._dispatchTable = {}
+
+    def callbacksFor(self, command):
+        """Returns the callbacks that should be called for messages with the
+        given command, in the order they should be called."""
+        self._checkDispatchTable()
+        command = command.upper()
+        try:
+            return self._dispatchTable[command]
+        except KeyError:
+            L = [cb for (cb, handled) in self._handled
+                 if handled is None or command in handled]
+            self._dispatchTable[command] = L
+            return L
+
     def queueMsg(self, msg):
         """Queues a message to be sent to the server."""
         if not self.zombie:
@@ -704,6 +977,13 @@ class Irc(IrcCommandDispatcher):
             log.warning('Refusing to queue %r; %s is a zombie.', msg, self)
             return False
 
+    def refreshChannel(self, channel, callback=None):
+        """Asks for the membership of channel to be refreshed, and for
+        callback (if it's given) to be called with this Irc and the channel
+        once it has been.  Plugins should use this rather than queuing their
+        own WHOs, so the server only gets one."""
+        self.refresher.refresh(channel, callback)
+
     def sendMsg(self, msg):
         """Queues a message to be sent to the server *immediately*"""
         if not self.zombie:
@@ -719,15 +999,22 @@ class Irc(IrcCommandDispatcher):
         msg = None
         if self.fastqueue:
             msg = self.fastqueue.dequeue()
-        elif self.queue:
+        elif self.queue or self.refresher.waiting:
             if now-self.lastTake <= conf.supybot.protocols.irc.throttleTime():
                 log.debug('Irc.takeMsg throttling.')
             else:
-                self.lastTake = now
-                msg = self.queue.dequeue()
-        elif self.afterConnect and \
-             conf.supybot.protocols.irc.ping() and \
-             now > self.lastping + conf.supybot.protocols.irc.ping.interval():
+                # A WHO that's due goes out ahead of the low priority queue
+                # (not into it), so rateLimit.who spaces out the WHOs the
+                # server actually gets.
+                if not (self.queue.highpriority or self.queue.normal):
+                    msg = self.refresher.takeMsg(self, now)
+                if msg is None:
+                    msg = self.queue.dequeue()
+                if msg is not None:
+                    self.lastTake = now
+        if msg is None and not self.queue and self.afterConnect and \
+           conf.supybot.protocols.irc.ping() and \
+           now > self.lastping + conf.supybot.protocols.irc.ping.interval():
             if self.outstandingPing:
                 s = 'Ping sent at %s not replied to.' % \
                     log.timestamp(self.lastping)
@@ -740,8 +1027,16 @@ class Irc(IrcCommandDispatcher):
                 self.outstandingPing = True
                 self.queueMsg(ircmsgs.ping(now))
         if msg:
+            timing = conf.supybot.debug.timing()
             for callback in reversed(self.callbacks):
-                msg = callback.outFilter(self, msg)
+                if timing:
+                    start = time.time()
+                    msg = callback.outFilter(self, msg)
+                    world.addTiming(world.hookTimings,
+                                    (callback.name(), 'outFilter'),
+                                    time.time() - start)
+                else:
+                    msg = callback.outFilter(self, msg)
                 if msg is None:
                     log.debug('%s.outFilter returned None.', callback.name())
                     return self.takeMsg()
@@ -821,9 +1116,16 @@ class Irc(IrcCommandDispatcher):
 
         # Now call the callbacks.
         world.debugFlush()
-        for callback in self.callbacks:
+        self._checkDispatchTable()
+        timing = conf.supybot.debug.timing()
+        for callback in self._inFilters:
+            start = time.time()
             try:
                 m = callback.inFilter(self, msg)
+                if timing:
+                    world.addTiming(world.hookTimings,
+                                    (callback.name(), 'inFilter'),
+                                    time.time() - start)
                 if not m:
                     log.debug('%s.inFilter returned None', callback.name())
                     return
@@ -834,12 +1136,23 @@ class Irc(IrcCommandDispatcher):
         postInFilter = str(msg).rstrip('\r\n')
         if postInFilter != preInFilter:
             log.debug('Incoming message (post-inFilter): %s', postInFilter)
-        for callback in self.callbacks:
+        # Whether the sender is ignored doesn't depend on the callback, so
+        # it's checked once here rather than by each callback.
+        if msg.command == 'PRIVMSG':
+            ignored = ircutils.isUserHostmask(msg.prefix) and \
+                      ircdb.checkIgnored(msg.prefix, msg.args[0])
+            msg.tag('senderIgnored', bool(ignored))
+        for callback in self.callbacksFor(msg.command):
+            start = time.time()
             try:
                 if callback is not None:
                     callback(self, msg)
             except:
                 log.exception('Uncaught exception in callback:')
+            if timing and callback is not None:
+                world.addTiming(world.hookTimings,
+                                (callback.name(), '__call__'),
+                                time.time() - start)
             world.debugFlush()
 
     def die(self):
@@ -860,6 +1173,7 @@ class Irc(IrcCommandDispatcher):
         self.state.reset()
         self.queue.reset()
         self.fastqueue.reset()
+        self.refresher.reset()
         self.startedSync.clear()
         for callback in self.callbacks:
             callback.reset()
@@ -956,12 +1270,13 @@ class Irc(IrcCommandDispatcher):
     def doJoin(self, msg):
         if msg.nick == self.nick:
             channel = msg.args[0]
-            self.queueMsg(ircmsgs.who(channel)) # Ends with 315.
+            self.refresher.refresh(channel, resend=True) # Ends with 315.
             self.queueMsg(ircmsgs.mode(channel)) # Ends with 329.
             self.startedSync[channel] = time.time()
 
     def do315(self, msg):
         channel = msg.args[1]
+        self.refresher.done(self, channel)
         if channel in self.startedSync:
             now = time.time()
             started = self.startedSync.pop(channel)
@@ -712,15 +712,16 @@ def user(ident, user, prefix='', msg=None):
     return IrcMsg(prefix=prefix, command='USER',
                   args=(ident, '0', '*', user), msg=msg)
 
-def who(hostmaskOrChannel, prefix='', msg=None):
-    """Returns a WHO for the hostmask or channel hostmaskOrChannel."""
+def who(hostmaskOrChannel, prefix='', msg=None, args=()):
+    """Returns a WHO for the hostmask or channel hostmaskOrChannel.  args are
+    any further arguments, such as WHOX's fields."""
     if conf.supybot.protocols.irc.strictRfc():
         assert isChannel(hostmaskOrChannel) or \
                isUserHostmask(hostmaskOrChannel), repr(hostmaskOrChannel)
     if msg and not prefix:
         prefix = msg.prefix
     return IrcMsg(prefix=prefix, command='WHO',
-                  args=(hostmaskOrChannel,), msg=msg)
+                  args=(hostmaskOrChannel,) + tuple(args), msg=msg)
 
 def whois(nick, mask='', prefix='', msg=None):
     """Returns a WHOIS for nick."""
@@ -33,6 +33,7 @@ import os
 import time
 import string
 import textwrap
+from cStringIO import StringIO
 
 import supybot.utils as utils
 
@@ -61,6 +62,14 @@ class NonExistentRegistryEntry(RegistryException):
 
 _cache = utils.InsensitivePreservingDict()
 _lastModified = 0
+# Bumped whenever any value is set, so things that cache what they've derived
+# from registry values can cheaply tell when they might be stale.
+_generation = 0
+def generation():
+    """Returns something that compares unequal to any previous return value
+    whenever a registry value might have changed since then."""
+    return (_lastModified, _generation)
+
 def open(filename, clear=False):
     """Initializes the module by loading the registry file into memory."""
     global _lastModified
@@ -97,8 +106,10 @@ def open(filename, clear=False):
     _fd.close()
 
 def close(registry, filename, private=True):
+    """Writes registry to filename, unless the file already holds exactly what
+    would be written."""
     first = True
-    fd = utils.file.AtomicFile(filename)
+    fd = StringIO()
     for (name, value) in registry.getValues(getChildren=True):
         help = value.help()
         if help:
@@ -134,6 +145,18 @@ def close(registry, filename, private=True):
                 fd.write('%s: %s\n' % (name, s))
             except Exception, e:
                 exception('Exception printing value:')
+    s = fd.getvalue()
+    try:
+        fd = file(filename)
+        try:
+            if fd.read() == s:
+                return
+        finally:
+            fd.close()
+    except EnvironmentError:
+        pass
+    fd = utils.file.AtomicFile(filename)
+    fd.write(s)
     fd.close()
 
 def isValidRegistryName(name):
@@ -335,6 +358,8 @@ class Value(Group):
         100) convert to an integer in set() and check that the integer is less
         than 100 in this method.  You *must* call this parent method in your
         own setValue."""
+        global _generation
+        _generation += 1
         self._lastModified = time.time()
         self.value = v
         if self._supplyDefault:
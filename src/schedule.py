@@ -39,17 +39,8 @@ import supybot.log as log
 import supybot.world as world
 import supybot.drivers as drivers
 
-class mytuple(tuple):
-    def __cmp__(self, other):
-        return cmp(self[0], other[0])
-    def __le__(self, other):
-        return self[0] <= other[0]
-    def __lt__(self, other):
-        return self[0] < other[0]
-    def __gt__(self, other):
-        return self[0] > other[0]
-    def __ge__(self, other):
-        return self[0] >= other[0]
+# Marks heap entries whose events have been removed.
+_removed = object()
 
 class Schedule(drivers.IrcDriver):
     """An IrcDriver to handling scheduling of events.
@@ -58,13 +49,20 @@ class Schedule(drivers.IrcDriver):
     """
     def __init__(self):
         drivers.IrcDriver.__init__(self)
+        # The heap holds [time, sequence, name] lists; the sequence number
+        # makes events scheduled for the same time run in the order they were
+        # added.  Removed events stay in the heap with their name replaced by
+        # _removed until they're popped or the heap is compacted.
         self.schedule = []
-        self.events = {}
+        self.events = {} # name : (f, heap entry)
         self.counter = 0
+        self.sequence = 0
+        self.removed = 0
 
     def reset(self):
         self.events.clear()
         self.schedule[:] = []
+        self.removed = 0
         # We don't reset the counter here because if someone has held an id of
         # one of the nuked events, we don't want him removing new events with
         # his old id.
@@ -82,22 +80,34 @@ class Schedule(drivers.IrcDriver):
             self.counter += 1
         assert name not in self.events, \
                'An event with the same name has already been scheduled.'
-        self.events[name] = f
-        heapq.heappush(self.schedule, mytuple((t, name)))
+        entry = [t, self.sequence, name]
+        self.sequence += 1
+        self.events[name] = (f, entry)
+        heapq.heappush(self.schedule, entry)
         return name
 
     def removeEvent(self, name):
         """Removes the event with the given name from the schedule."""
-        f = self.events.pop(name)
-        self.schedule = [(t, n) for (t, n) in self.schedule if n != name]
-        # We must heapify here because the heap property may not be preserved
-        # by the above list comprehension.  We could, conceivably, just mark
-        # the elements of the heap as removed and ignore them when we heappop,
-        # but that would only save a constant factor (we're already linear for
-        # the listcomp) so I'm not worried about it right now.
-        heapq.heapify(self.schedule)
+        (f, entry) = self.events.pop(name)
+        # Taking the entry out of the middle of the heap would cost us a
+        # linear search and a heapify, so we just mark it and let run() throw
+        # it away when it gets to the top.
+        entry[2] = _removed
+        self.removed += 1
+        if self.removed > self.compactAt and \
+           self.removed * 2 > len(self.schedule):
+            self._compact()
         return f
 
+    # Removed events are only purged from the heap once there are at least
+    # this many of them, and they make up over half of it.
+    compactAt = 64
+    def _compact(self):
+        self.schedule = [entry for entry in self.schedule
+                         if entry[2] is not _removed]
+        heapq.heapify(self.schedule)
+        self.removed = 0
+
     def rescheduleEvent(self, name, t):
         f = self.removeEvent(name)
         self.addEvent(f, t, name=name)
@@ -123,9 +133,11 @@ class Schedule(drivers.IrcDriver):
                       'why do we continue to live?')
             time.sleep(1) # We're the only driver; let's pause to think.
         while self.schedule and self.schedule[0][0] < time.time():
-            (t, name) = heapq.heappop(self.schedule)
-            f = self.events[name]
-            del self.events[name]
+            (t, _, name) = heapq.heappop(self.schedule)
+            if name is _removed:
+                self.removed -= 1
+                continue
+            (f, _) = self.events.pop(name)
             try:
                 f()
             except Exception, e:
@@ -31,6 +31,7 @@
 Data structures for Python.
 """
 
+import math
 import time
 import types
 import UserDict
@@ -444,4 +445,47 @@ class CacheDict(UserDict.DictMixin):
         return iter(self.d)
 
 
+class Histogram(object):
+    """Keeps the count, total, and maximum of the (non-negative) values added
+    to it, and approximate percentiles.  Values are counted in buckets a
+    quarter of a power of two wide, so adding one is cheap and percentiles are
+    within about 20% of the real thing."""
+    __slots__ = ('buckets', 'count', 'total', 'max')
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        (mantissa, exponent) = math.frexp(max(value, 1e-9))
+        # .5 <= mantissa < 1, so this picks one of four buckets per exponent.
+        bucket = exponent*4 + int(mantissa*8) - 4
+        try:
+            self.buckets[bucket] += 1
+        except KeyError:
+            self.buckets[bucket] = 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        """Returns (an upper bound on) the value p percent of the values are
+        less than or equal to."""
+        target = self.count * p / 100.0
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= target:
+                (exponent, quarter) = divmod(bucket, 4)
+                return min(math.ldexp((quarter+5) / 8.0, exponent), self.max)
+        return self.max
+
+    def mean(self):
+        if not self.count:
+            return 0.0
+        return self.total / self.count
+
+
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
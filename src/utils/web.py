@@ -29,12 +29,16 @@
 ###
 
 import re
+import time
+import zlib
 import socket
 import urllib
 import urllib2
 import httplib
 import sgmllib
 import urlparse
+import threading
+import email.utils
 import htmlentitydefs
 
 sockerrors = (socket.error,)
@@ -96,6 +100,356 @@ defaultHeaders = {
 # application-specific function.  Feel free to use a callable here.
 proxy = None
 
+class HttpResponse(object):
+    """A file-like response from an HttpClient.  Like the objects
+    urllib2.urlopen returns, it has headers, info(), geturl(), and getcode().
+    This one already has its whole body (HttpClient's cache hands these out);
+    LiveHttpResponse reads its body as it goes.
+    """
+    def __init__(self, url, code, msg, headers, body=''):
+        self.url = url
+        self.code = code
+        self.msg = msg
+        self.headers = headers
+        self.buffer = body
+        self.done = True
+
+    def info(self):
+        return self.headers
+
+    def geturl(self):
+        return self.url
+
+    def getcode(self):
+        return self.code
+
+    def _read(self):
+        """Returns the next chunk of the body, or '' when there's no more."""
+        return ''
+
+    def _finished(self):
+        pass
+
+    def _fill(self):
+        if self.done:
+            return False
+        chunk = self._read()
+        if chunk:
+            self.buffer += chunk
+            return True
+        self.done = True
+        self._finished()
+        return False
+
+    def read(self, size=None):
+        chunks = [self.buffer]
+        length = len(self.buffer)
+        while not self.done and (size is None or size < 0 or length < size):
+            chunk = self._read()
+            if not chunk:
+                self.done = True
+                self._finished()
+                break
+            chunks.append(chunk)
+            length += len(chunk)
+        s = ''.join(chunks)
+        if size is None or size < 0:
+            self.buffer = ''
+            return s
+        self.buffer = s[size:]
+        return s[:size]
+
+    def readline(self):
+        while '\n' not in self.buffer and self._fill():
+            pass
+        i = self.buffer.find('\n') + 1 or len(self.buffer)
+        (line, self.buffer) = (self.buffer[:i], self.buffer[i:])
+        return line
+
+    def readlines(self):
+        return list(self)
+
+    def __iter__(self):
+        line = self.readline()
+        while line:
+            yield line
+            line = self.readline()
+
+    def close(self):
+        self.done = True
+        self.buffer = ''
+
+class LiveHttpResponse(HttpResponse):
+    """A response still being read from its connection.  The connection goes
+    back to the client's pool once the whole body has been read; closing the
+    response before then closes the connection."""
+    chunkSize = 8192
+    def __init__(self, client, key, conn, response, url, cacheKey=None):
+        HttpResponse.__init__(self, url, response.status, response.reason,
+                              response.msg)
+        self.done = False
+        self.client = client
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.decompressor = None
+        if response.getheader('content-encoding', '').lower() == 'gzip':
+            # We asked for gzip, so we decode it; the caller shouldn't have
+            # to know, or be told the compressed size as the body's length.
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            del self.headers['content-encoding']
+            if 'content-length' in self.headers:
+                del self.headers['content-length']
+        self.cacheKey = cacheKey
+        self.cached = []
+        self.cachedSize = 0
+
+    def _read(self):
+        while True:
+            data = self.response.read(self.chunkSize)
+            if self.decompressor is not None:
+                if data:
+                    data = self.decompressor.decompress(data)
+                    if not data:
+                        continue
+                else:
+                    data = self.decompressor.flush()
+                    self.decompressor = None
+            break
+        if data and self.cacheKey is not None:
+            self.cachedSize += len(data)
+            if self.cachedSize > self.client.maximumCachedSize:
+                self.cacheKey = None
+                self.cached = []
+            else:
+                self.cached.append(data)
+        return data
+
+    def _finished(self):
+        self.response.close()
+        self.client._release(self.key, self.conn)
+        self.conn = None
+        if self.cacheKey is not None:
+            self.client._store(self.cacheKey, self, ''.join(self.cached))
+            self.cached = []
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        self.response.close()
+        HttpResponse.close(self)
+
+class HttpClient(object):
+    """An HTTP client that keeps connections alive for reuse, at most
+    maximumIdle of them per host, for idleTimeout seconds.  It asks for gzip
+    and decodes it (dropping the compressed Content-Length), and follows
+    redirects like urllib2 does.  GET responses whose Cache-Control or Expires
+    headers say they're fresh are kept in an in-memory cache of at most
+    cacheSize (which may be callable) responses.
+    """
+    maximumRedirects = 10
+    maximumCachedSize = 1024*1024
+    connectionClasses = {'http': httplib.HTTPConnection,
+                         'https': httplib.HTTPSConnection}
+    def __init__(self, maximumIdle=4, idleTimeout=60, cacheSize=0):
+        self.maximumIdle = maximumIdle
+        self.idleTimeout = idleTimeout
+        self.cacheSize = cacheSize
+        self.lock = threading.Lock()
+        self.idle = {} # (scheme, netloc) : [(conn, time released)]
+        self.cache = {} # cacheKey : (expires, url, code, msg, headers, body)
+        self.cacheOrder = [] # cacheKeys, least recently used first.
+        self.connections = 0
+        self.cacheHits = 0
+
+    def _connection(self, key):
+        now = time.time()
+        self.lock.acquire()
+        try:
+            idle = self.idle.get(key, [])
+            while idle:
+                (conn, released) = idle.pop()
+                if now - released < self.idleTimeout:
+                    return (conn, True)
+                conn.close()
+            self.connections += 1
+        finally:
+            self.lock.release()
+        (scheme, netloc) = key
+        return (self.connectionClasses[scheme](netloc), False)
+
+    def _release(self, key, conn):
+        if conn.sock is None:
+            # The server said it'd close the connection.
+            return
+        self.lock.acquire()
+        try:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.maximumIdle:
+                idle.append((conn, time.time()))
+                return
+        finally:
+            self.lock.release()
+        conn.close()
+
+    def close(self):
+        """Closes all idle connections and empties the cache."""
+        self.lock.acquire()
+        try:
+            for idle in self.idle.itervalues():
+                for (conn, _) in idle:
+                    conn.close()
+            self.idle.clear()
+            self.cache.clear()
+            self.cacheOrder = []
+        finally:
+            self.lock.release()
+
+    def _request(self, key, method, selector, headers, data, timeout):
+        while True:
+            (conn, reused) = self._connection(key)
+            conn.timeout = timeout
+            try:
+                if conn.sock is not None:
+                    if timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+                        conn.sock.settimeout(socket.getdefaulttimeout())
+                    else:
+                        conn.sock.settimeout(timeout)
+                conn.request(method, selector, data, headers)
+                return (conn, conn.getresponse())
+            except (httplib.HTTPException, socket.error), e:
+                conn.close()
+                if not reused or isinstance(e, socket.timeout):
+                    raise
+                # The server probably closed this connection while it was
+                # idle, so we try again on another one.
+
+    def _freshUntil(self, headers, now):
+        directives = [s.strip().lower()
+                      for s in headers.get('cache-control', '').split(',')]
+        if 'no-store' in directives or 'no-cache' in directives:
+            return None
+        for directive in directives:
+            if directive.startswith('max-age='):
+                try:
+                    return now + int(directive[8:])
+                except ValueError:
+                    return None
+        expires = email.utils.parsedate_tz(headers.get('expires', ''))
+        if expires is None:
+            return None
+        lifetime = email.utils.mktime_tz(expires)
+        date = email.utils.parsedate_tz(headers.get('date', ''))
+        if date is not None:
+            lifetime -= email.utils.mktime_tz(date)
+        else:
+            lifetime -= now
+        return now + lifetime
+
+    def _cached(self, cacheKey):
+        self.lock.acquire()
+        try:
+            entry = self.cache.get(cacheKey)
+            if entry is None:
+                return None
+            self.cacheOrder.remove(cacheKey)
+            if entry[0] <= time.time():
+                del self.cache[cacheKey]
+                return None
+            self.cacheOrder.append(cacheKey)
+            self.cacheHits += 1
+            return HttpResponse(*entry[1:])
+        finally:
+            self.lock.release()
+
+    def _cacheable(self, response):
+        if response.code != 200:
+            return False
+        vary = response.headers.get('vary', '').lower()
+        return vary in ('', 'accept-encoding')
+
+    def _store(self, cacheKey, response, body):
+        now = time.time()
+        expires = self._freshUntil(response.headers, now)
+        if expires is None or expires <= now:
+            return
+        size = force(self.cacheSize)
+        self.lock.acquire()
+        try:
+            if cacheKey in self.cache:
+                self.cacheOrder.remove(cacheKey)
+            self.cache[cacheKey] = (expires, response.url, response.code,
+                                    response.msg, response.headers, body)
+            self.cacheOrder.append(cacheKey)
+            while len(self.cacheOrder) > size:
+                del self.cache[self.cacheOrder.pop(0)]
+        finally:
+            self.lock.release()
+
+    def open(self, url, headers=None, data=None,
+             timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
+        """Returns an HttpResponse for the given http or https url.  Raises
+        Error for responses that aren't successes or redirects."""
+        headers = dict(headers or {})
+        lowered = set([name.lower() for name in headers])
+        if 'accept-encoding' not in lowered:
+            headers['Accept-Encoding'] = 'gzip'
+        if data is not None and 'content-type' not in lowered:
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        for _ in xrange(self.maximumRedirects + 1):
+            (scheme, netloc, path, query, _) = urlparse.urlsplit(url)
+            scheme = scheme.lower()
+            if scheme not in self.connectionClasses or not netloc:
+                raise httplib.InvalidURL(url)
+            selector = path or '/'
+            if query:
+                selector += '?' + query
+            cacheKey = None
+            if data is None and force(self.cacheSize):
+                cacheKey = (url, tuple(sorted(headers.items())))
+                response = self._cached(cacheKey)
+                if response is not None:
+                    return response
+            key = (scheme, netloc.lower())
+            method = data is None and 'GET' or 'POST'
+            (conn, response) = self._request(key, method, selector,
+                                             headers, data, timeout)
+            location = response.getheader('location')
+            if response.status in (301, 302, 303, 307) and location:
+                response.read()
+                response.close()
+                self._release(key, conn)
+                url = urlparse.urljoin(url, location)
+                if '#' in url:
+                    url = url[:url.index('#')]
+                data = None
+                headers = dict([(name, value)
+                                for (name, value) in headers.iteritems()
+                                if name.lower() not in ('content-type',
+                                                        'content-length')])
+                continue
+            if not 200 <= response.status < 300:
+                conn.close()
+                raise Error, 'HTTP Error %s: %s' % (response.status,
+                                                    response.reason)
+            response = LiveHttpResponse(self, key, conn, response, url)
+            if cacheKey is not None and self._cacheable(response):
+                response.cacheKey = cacheKey
+            return response
+        raise Error, 'The HTTP server returned a redirect error that ' \
+                     'would lead to an infinite loop.'
+
+# The client getUrlFd uses when there's no proxy; cacheSize can be a callable.
+client = HttpClient()
+
+def _environmentProxy(request):
+    """Returns whether urllib2 would send the request through a proxy from
+    the environment (http_proxy and friends, less no_proxy)."""
+    if request.get_type() not in urllib.getproxies():
+        return False
+    return not urllib.proxy_bypass(request.get_host())
+
 def getUrlFd(url, headers=None, data=None, timeout=None):
     """getUrlFd(url, headers=None, data=None)
 
@@ -103,6 +457,8 @@ def getUrlFd(url, headers=None, data=None, timeout=None):
     a dict and string, respectively, as per urllib2.Request's arguments."""
     if headers is None:
         headers = defaultHeaders
+    if timeout is None:
+        timeout = socket._GLOBAL_DEFAULT_TIMEOUT
     try:
         if not isinstance(url, urllib2.Request):
             if '#' in url:
@@ -114,6 +470,11 @@ def getUrlFd(url, headers=None, data=None, timeout=None):
         httpProxy = force(proxy)
         if httpProxy:
             request.set_proxy(httpProxy, 'http')
+        elif request.get_type() in client.connectionClasses and \
+             not _environmentProxy(request):
+            return client.open(request.get_full_url(),
+                               headers=dict(request.header_items()),
+                               data=request.get_data(), timeout=timeout)
         fd = urllib2.urlopen(request, timeout=timeout)
         return fd
     except socket.timeout, e:
@@ -122,6 +483,8 @@ def getUrlFd(url, headers=None, data=None, timeout=None):
         raise Error, strError(e)
     except httplib.InvalidURL, e:
         raise Error, 'Invalid URL: %s' % e
+    except httplib.HTTPException, e:
+        raise Error, strError(e)
     except urllib2.HTTPError, e:
         raise Error, strError(e)
     except urllib2.URLError, e:
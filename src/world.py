@@ -50,6 +50,8 @@ import supybot.drivers as drivers
 import supybot.ircutils as ircutils
 import supybot.registry as registry
 
+from supybot.utils.structures import Histogram
+
 startedAt = time.time() # Just in case it doesn't get set later.
 
 starting = False
@@ -68,6 +70,131 @@ class SupyThread(threading.Thread):
         super(SupyThread, self).__init__(*args, **kwargs)
         log.debug('Spawning thread %q.', self.getName())
 
+class Executor(object):
+    """Runs tasks on at most `threads` SupyThreads, with at most `perGroup` of
+    them running tasks from any one group (a plugin, usually) at once, and at
+    most `queued` tasks waiting for a thread.  Each of those limits may be a
+    callable.  Threads are started as they're needed and exit after
+    `idleTimeout` seconds without work.  While running a task, a thread is
+    named after it."""
+    def __init__(self, threads, perGroup, queued, idleTimeout=60):
+        self.threads = threads
+        self.perGroup = perGroup
+        self.queued = queued
+        self.idleTimeout = idleTimeout
+        self.cond = threading.Condition()
+        self.queue = [] # (group, name, f, args, kwargs)
+        self.running = {} # group : number of running tasks.
+        self.workers = 0
+        self.idle = 0
+        self.started = []
+        self.stopped = False
+
+    def submit(self, f, args=(), kwargs={}, group=None, name=None):
+        """Returns False (and doesn't run f) if too many tasks are waiting."""
+        if name is None:
+            name = getattr(f, '__name__', repr(f))
+        self.cond.acquire()
+        try:
+            if self.stopped:
+                return False
+            if len(self.queue) >= force(self.queued):
+                log.warning('Not running %s: %s tasks are already waiting.',
+                            name, len(self.queue))
+                return False
+            self.queue.append((group, name, f, args, kwargs))
+            if self.idle:
+                self.cond.notify()
+            # A woken worker only stops counting as idle once it has the
+            # lock again, so a burst can't count on the idle ones for more
+            # than one task each.
+            if len(self.queue) > self.idle and \
+               self.workers < force(self.threads):
+                self.workers += 1
+                number = threadsSpawned
+                t = SupyThread(target=self._work, args=(number,),
+                               name='Thread #%s (idle)' % number)
+                t.setDaemon(True)
+                t.start()
+                self.started = filter(threading.Thread.isAlive, self.started)
+                self.started.append(t)
+            return True
+        finally:
+            self.cond.release()
+
+    def stop(self, timeout=1):
+        """Stops the threads once they've run what they're running, waiting
+        at most timeout seconds for them.  Queued tasks aren't run."""
+        self.cond.acquire()
+        try:
+            self.stopped = True
+            self.queue = []
+            self.cond.notifyAll()
+            started = self.started
+        finally:
+            self.cond.release()
+        deadline = time.time() + timeout
+        for t in started:
+            t.join(max(0, deadline - time.time()))
+
+    def _next(self):
+        # Must be called with self.cond held.
+        perGroup = force(self.perGroup)
+        for (i, task) in enumerate(self.queue):
+            if self.running.get(task[0], 0) < perGroup:
+                del self.queue[i]
+                self.running[task[0]] = self.running.get(task[0], 0) + 1
+                return task
+        return None
+
+    def _work(self, number):
+        thread = threading.currentThread()
+        idleName = thread.getName()
+        while True:
+            self.cond.acquire()
+            try:
+                task = self._next()
+                while task is None:
+                    if self.stopped:
+                        self.workers -= 1
+                        return
+                    self.idle += 1
+                    start = time.time()
+                    self.cond.wait(self.idleTimeout)
+                    self.idle -= 1
+                    task = self._next()
+                    if task is None and \
+                       time.time() - start >= self.idleTimeout:
+                        self.workers -= 1
+                        return
+            finally:
+                self.cond.release()
+            (group, name, f, args, kwargs) = task
+            thread.setName('Thread #%s (for %s)' % (number, name))
+            try:
+                try:
+                    f(*args, **kwargs)
+                except Exception, e:
+                    log.exception('Uncaught exception in %s:', name)
+            finally:
+                thread.setName(idleName)
+                self.cond.acquire()
+                try:
+                    self.running[group] -= 1
+                    if not self.running[group]:
+                        del self.running[group]
+                    # Tasks from this group may have been waiting for us.
+                    if self.queue and self.idle:
+                        self.cond.notify()
+                finally:
+                    self.cond.release()
+
+executor = Executor(conf.supybot.commands.threads.maximum,
+                    conf.supybot.commands.threads.maximumPerPlugin,
+                    conf.supybot.commands.threads.maximumQueued)
+# Otherwise idle threads can wake up during interpreter shutdown.
+atexit.register(executor.stop)
+
 processesSpawned = 1 # Starts at one for the initial process.
 class SupyProcess(multiprocessing.Process):
     def __init__(self, *args, **kwargs):
@@ -79,6 +206,29 @@ class SupyProcess(multiprocessing.Process):
 
 commandsProcessed = 0
 
+# How long each plugin's __call__, inFilter, and outFilter take, keyed by
+# (plugin name, method name), and how long each command takes, keyed by
+# (plugin name, command).  Threaded commands add to these from their threads
+# without locking, so their counts may be a little off.
+hookTimings = {}
+commandTimings = {}
+
+def addTiming(timings, key, seconds):
+    try:
+        timings[key].add(seconds)
+    except KeyError:
+        timings[key] = Histogram()
+        timings[key].add(seconds)
+
+def timingOverhead(n=1000):
+    """Returns how many seconds timing a single hook or command costs."""
+    timings = {}
+    start = time.time()
+    for i in xrange(n):
+        t = time.time()
+        addTiming(timings, None, time.time() - t)
+    return (time.time() - start) / n
+
 ircs = [] # A list of all the IRCs.
 
 def getIrc(network):
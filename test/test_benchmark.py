@@ -0,0 +1,83 @@
+###
+# Copyright (c) 2026, Kefkius
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+
+from supybot.test import *
+
+import os
+
+import supybot.benchmark as benchmark
+
+class BenchmarkTestCase(PluginTestCase):
+    plugins = ('Utilities',)
+    def setUp(self):
+        PluginTestCase.setUp(self)
+        self.server = benchmark.FakeServer(self.irc)
+        self.server.connect(['#bench'])
+
+    def testConnect(self):
+        self.failUnless('#bench' in self.irc.state.channels)
+
+    def testScenarios(self):
+        for name in benchmark.scenarios:
+            result = benchmark.runScenario(self.server, name, '#bench', 30)
+            self.failUnless(result.messages >= 30, name)
+            self.assertEqual(result.latency.count, result.messages)
+            self.failUnless(str(result).startswith(name + ': '))
+        self.assertEqual(len(self.irc.state.channels['#bench'].users), 31)
+
+    def testCommands(self):
+        original = benchmark.commandsToRun
+        try:
+            benchmark.commandsToRun = ['echo foo']
+            result = benchmark.runScenario(self.server, 'commands', '#bench',
+                                           10)
+        finally:
+            benchmark.commandsToRun = original
+        self.assertEqual(result.commandLatency.count, 10)
+        self.failUnless(result.replies >= 10)
+
+    def testReplay(self):
+        filename = os.path.join(conf.supybot.directories.data(), 'replay')
+        fd = file(filename, 'w')
+        fd.write('# A recording.\n'
+                 ':foo!bar@baz JOIN #bench\n'
+                 '\n'
+                 ':foo!bar@baz PRIVMSG #bench :hello\r\n'
+                 'PING :irc.benchmark.local\n')
+        fd.close()
+        msgs = benchmark.replay(filename)
+        self.assertEqual([m.command for m in msgs], ['JOIN', 'PRIVMSG', 'PING'])
+        result = benchmark.run(self.server, 'replay', msgs)
+        self.assertEqual(result.messages, 3)
+        # The bot should PONG the PING.
+        self.assertEqual(result.replies, 1)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -29,6 +29,8 @@
 
 from supybot.test import *
 
+import threading
+
 import supybot.conf as conf
 import supybot.utils as utils
 import supybot.ircmsgs as ircmsgs
@@ -138,6 +140,22 @@ class TokenizerTestCase(SupyTestCase):
         finally:
             conf.supybot.commands.quotes.setValue(original)
 
+    def testCachedTokensAreCopies(self):
+        L = tokenize('foo [bar baz]')
+        L[1].append('quux')
+        L.append('qux')
+        self.assertEqual(tokenize('foo [bar baz]'), ['foo', ['bar', 'baz']])
+
+    def testFrozen(self):
+        self.assertEqual(tokenize('foo [bar [baz]]', frozen=True),
+                         ('foo', ('bar', ('baz',))))
+        self.assertEqual(callbacks.freezeTokens(['foo', ['bar']]),
+                         ('foo', ('bar',)))
+
+    def testWordsMayContainQuotes(self):
+        self.assertEqual(tokenize('foo"bar baz"'), ['foo"bar', 'baz"'])
+        self.assertEqual(tokenize('"foo"bar'), ['foo', 'bar'])
+
     def testBold(self):
         s = '\x02foo\x02'
         self.assertEqual(tokenize(s), [s])
@@ -205,6 +223,24 @@ class FunctionsTestCase(SupyTestCase):
         finally:
             conf.supybot.reply.whenNotAddressed.setValue(original)
 
+    def testAddressedCacheInvalidatedByRegistryChanges(self):
+        msg = ircmsgs.privmsg('#foo', '~bar')
+        self.failIf(callbacks.addressed('blah', msg))
+        chars = conf.supybot.reply.whenAddressedBy.chars
+        original = str(chars)
+        try:
+            chars.get('#foo').set('~')
+            self.assertEqual(callbacks.addressed('blah', msg), 'bar')
+            self.assertEqual(callbacks.addressed('blah', msg), 'bar')
+        finally:
+            chars.get('#foo').set(original)
+        self.failIf(callbacks.addressed('blah', msg))
+
+    def testAddressedCacheDependsOnNick(self):
+        msg = ircmsgs.privmsg('#foo', 'bar: baz')
+        self.assertEqual(callbacks.addressed('bar', msg), 'baz')
+        self.failIf(callbacks.addressed('biff', msg))
+
     def testAddressedWithMultipleNicks(self):
         msg = ircmsgs.privmsg('#foo', 'bar: baz')
         self.assertEqual(callbacks.addressed('bar', msg), 'baz')
@@ -540,6 +576,30 @@ class RichReplyMethodsTestCase(PluginTestCase):
         self.assertRegexp('error', 'admin')
 
 
+class ThreadedCommandTestCase(PluginTestCase):
+    plugins = ()
+    class Threaded(callbacks.Plugin):
+        threaded = True
+        def thread(self, irc, msg, args):
+            irc.reply(threading.currentThread().getName())
+    def setUp(self):
+        PluginTestCase.setUp(self)
+        self.irc.addCallback(self.Threaded(self.irc))
+
+    def testRunsInExecutor(self):
+        self.assertRegexp('thread',
+                          r"Thread #\d+ \(for Threaded\.\['thread'\]\)")
+
+    def testBusy(self):
+        original = conf.supybot.commands.threads.maximumQueued()
+        try:
+            conf.supybot.commands.threads.maximumQueued.setValue(0)
+            self.assertRegexp('thread', 'too busy')
+        finally:
+            conf.supybot.commands.threads.maximumQueued.setValue(original)
+        self.assertNotError('thread')
+
+
 class SourceNestedPluginTestCase(PluginTestCase):
     plugins = ('Utilities',)
     class E(callbacks.Plugin):
@@ -104,6 +104,29 @@ class GeneralContextTestCase(CommandsTestCase):
                          ['12', '--foo', 'baz', '--bar', '13', '15'],
                          [12, [('foo', 'baz'), ('bar', 13)], 15])
 
+    def testGetoptsMatchesGetopt(self):
+        import getopt as getoptModule
+        g = getopts({'foo': '', 'foobar': 'int', 'bar': None, 'baz': ''})
+        for args in [[], ['x'], ['--foo'], ['--foo', 'x'], ['--fo', 'x'],
+                     ['--foob', '1'], ['--foobar=1', '--'], ['--foo=1'],
+                     ['--ba'], ['--bar'], ['--bar', '-'], ['--b=1'],
+                     ['-f'], ['--', '--foo'], ['--qux'], ['--='],
+                     ['--baz', '--bar=a=b', 'c', '--foo']]:
+            try:
+                expected = getoptModule.getopt(args, '', g.getoptL)
+            except getoptModule.GetoptError, e:
+                expected = (e.msg, e.opt)
+            try:
+                result = g.getopt(args)
+            except getoptModule.GetoptError, e:
+                result = (e.msg, e.opt)
+            self.assertEqual(result, expected, args)
+
+    def testSpecDoesNotModifyItsArgument(self):
+        spec = ['int', 'text']
+        Spec(spec)
+        self.assertEqual(spec, ['int', 'text'])
+
     def testAny(self):
         self.assertState([any('int')], ['1', '2', '3'], [[1, 2, 3]])
         self.assertState([None, any('int')], ['1', '2', '3'], ['1', [2, 3]])
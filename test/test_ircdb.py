@@ -397,6 +397,52 @@ class UsersDictionaryTestCase(IrcdbTestCase):
         u2.addHostmask('*!xyzzy@baz.domain.c?m')
         self.assertRaises(ValueError, self.users.setUser, u2)
 
+    def testFlushOnlyWritesChanges(self):
+        self.users.filename = self.filename
+        u = self.users.newUser()
+        u.name = 'foo'
+        u.setPassword('bar')
+        self.users.setUser(u)
+        self.failUnless(os.path.exists(self.filename))
+        os.remove(self.filename)
+        self.users.flush()
+        self.failIf(os.path.exists(self.filename))
+        self.users.getUser('foo').addCapability('bar')
+        self.users.flush()
+        self.failUnless(os.path.exists(self.filename))
+        users = ircdb.UsersDictionary()
+        users.open(self.filename)
+        self.failUnless(users.getUser('foo')._checkCapability('bar'))
+
+
+class ChannelsDictionaryTestCase(IrcdbTestCase):
+    filename = os.path.join(conf.supybot.directories.conf(),
+                            'ChannelsDictionaryTestCase.conf')
+    def setUp(self):
+        try:
+            os.remove(self.filename)
+        except:
+            pass
+        self.channels = ircdb.ChannelsDictionary()
+        IrcdbTestCase.setUp(self)
+
+    def testRfc1459Names(self):
+        self.channels.filename = self.filename
+        self.channels.getChannel('#foo[]').addCapability('bar')
+        self.channels.getChannel('#FOO{}').addCapability('baz')
+        self.channels.flush()
+        fd = file(self.filename)
+        try:
+            lines = [line for line in fd if line.startswith('channel ')]
+        finally:
+            fd.close()
+        self.assertEqual(lines, ['channel #foo[]' + os.linesep])
+        channels = ircdb.ChannelsDictionary()
+        channels.open(self.filename)
+        c = channels.getChannel('#foo{}')
+        self.failUnless('bar' in c.capabilities)
+        self.failUnless('baz' in c.capabilities)
+
 
 class CheckCapabilityTestCase(IrcdbTestCase):
     filename = os.path.join(conf.supybot.directories.conf(),
@@ -224,6 +224,37 @@ class ChannelStateTestCase(SupyTestCase):
         self.failIf('quuz' in c.halfops)
         self.failIf('quuz' in c.voices)
 
+    def testMembersAreViews(self):
+        c = irclib.ChannelState()
+        c.addUser('@Foo')
+        c.addUser('+bar')
+        c.addUser('baz')
+        self.assertEqual(len(c.users), 3)
+        self.assertEqual(sorted(c.users), ['Foo', 'bar', 'baz'])
+        self.failUnless('FOO' in c.users)
+        self.assertEqual(c.ops, ['foo'])
+        self.assertEqual(len(c.voices), 1)
+        self.failIf(c.halfops)
+        c.ops.add('qux')
+        self.failUnless('qux' in c.ops)
+        self.failIf('qux' in c.users)
+        c.voices.discard('BAR')
+        self.failIf(c.isVoice('bar'))
+        self.failUnless('bar' in c.users)
+        c.replaceUser('foo', 'quux')
+        self.failUnless(c.isOp('quux'))
+        self.assertEqual(sorted(c.users), ['bar', 'baz', 'quux'])
+        self.assertRaises(KeyError, c.users.remove, 'foo')
+
+    def testNicksAreShared(self):
+        c1 = irclib.ChannelState()
+        c2 = irclib.ChannelState()
+        c1.addUser(''.join(['je', 'mfinch']))
+        c2.addUser(''.join(['jem', 'finch']))
+        self.failUnless(c1.members['jemfinch'] is c2.members['jemfinch'])
+        c3 = copy.deepcopy(c1)
+        self.failUnless(c3.members['jemfinch'] is c1.members['jemfinch'])
+
 
 class IrcStateTestCase(SupyTestCase):
     class FakeIrc:
@@ -440,6 +471,86 @@ class IrcTestCase(SupyTestCase):
         self.irc.feedMsg(msg2)
         self.assertEqual(list(self.irc.state.history), [msg1, msg2])
 
+    def join(self, channel):
+        self.irc.feedMsg(ircmsgs.join(channel, prefix=self.irc.prefix))
+        L = []
+        m = self.irc.takeMsg()
+        while m is not None:
+            L.append(m)
+            m = self.irc.takeMsg()
+        return L
+
+    def testRefreshChannelSendsOneWho(self):
+        called = []
+        def f(irc, channel):
+            called.append((irc, channel))
+        msgs = self.join('#foo')
+        self.irc.refreshChannel('#foo', f)
+        self.irc.refreshChannel('#FOO', f)
+        self.assertEqual([m.command for m in msgs], ['MODE', 'WHO'])
+        self.assertEqual(self.irc.takeMsg(), None)
+        self.irc.feedMsg(ircmsgs.IrcMsg(prefix='server', command='352',
+            args=(self.irc.nick, '#foo', 'user', 'host', 'server', 'bar',
+                  'H@', '0 Real Name')))
+        self.failIf(called)
+        self.irc.feedMsg(ircmsgs.IrcMsg(prefix='server', command='315',
+            args=(self.irc.nick, '#foo', 'End of /WHO list.')))
+        self.assertEqual(called, [(self.irc, '#foo')] * 2)
+        chan = self.irc.state.channels['#foo']
+        self.failUnless('bar' in chan.ops)
+        self.assertEqual(self.irc.state.nickToHostmask('bar'),
+                         'bar!user@host')
+        self.irc.refreshChannel('#foo')
+        self.assertEqual(self.irc.takeMsg(), ircmsgs.who('#foo'))
+
+    def testRefreshChannelUsesWhox(self):
+        self.irc.feedMsg(ircmsgs.IrcMsg(prefix='server', command='005',
+            args=(self.irc.nick, 'WHOX', 'are supported by this server')))
+        msgs = self.join('#foo')
+        token = irclib.ChannelRefresher.whoxToken
+        self.failUnless(ircmsgs.who('#foo', args=('%tcuhnf,' + token,))
+                        in msgs, msgs)
+        self.irc.feedMsg(ircmsgs.IrcMsg(prefix='server', command='354',
+            args=(self.irc.nick, token, '#foo', 'user', 'host', 'bar', 'G+')))
+        self.failUnless('bar' in self.irc.state.channels['#foo'].voices)
+        self.assertEqual(self.irc.state.nickToHostmask('bar'),
+                         'bar!user@host')
+
+    def testRefreshChannelIsRateLimited(self):
+        rateLimit = conf.supybot.protocols.irc.queuing.rateLimit.who
+        original = rateLimit()
+        try:
+            rateLimit.setValue(60)
+            self.join('#foo')
+            self.assertEqual([m.command for m in self.join('#bar')], ['MODE'])
+            self.irc.refresher.lastSent -= 60
+            self.assertEqual(self.irc.takeMsg(), ircmsgs.who('#bar'))
+        finally:
+            rateLimit.setValue(original)
+
+    def testRefreshWhoGoesAheadOfLowPriority(self):
+        rateLimit = conf.supybot.protocols.irc.queuing.rateLimit.who
+        original = rateLimit()
+        try:
+            rateLimit.setValue(60)
+            self.join('#foo')
+            msgs = [ircmsgs.privmsg('#foo', str(i)) for i in range(3)]
+            for msg in msgs:
+                self.irc.queueMsg(msg)
+            self.irc.refresher.lastSent -= 60
+            self.irc.refreshChannel('#bar')
+            self.irc.refreshChannel('#baz')
+            self.assertEqual(self.irc.takeMsg(), ircmsgs.who('#bar'))
+            # The limit runs from when that WHO went out.
+            self.assertEqual(self.irc.takeMsg(), msgs[0])
+            self.assertEqual(self.irc.takeMsg(), msgs[1])
+            self.irc.refresher.lastSent -= 60
+            self.assertEqual(self.irc.takeMsg(), ircmsgs.who('#baz'))
+            self.assertEqual(self.irc.takeMsg(), msgs[2])
+            self.assertEqual(self.irc.takeMsg(), None)
+        finally:
+            rateLimit.setValue(original)
+
 
 class IrcCallbackTestCase(SupyTestCase):
     class FakeIrc:
@@ -473,6 +584,56 @@ class IrcCallbackTestCase(SupyTestCase):
         commands = map(makeCommand, msgs)
         self.assertEqual(doCommandCatcher.L, commands)
 
+    def testHandledCommands(self):
+        class Dispatcher(irclib.IrcCallback):
+            def doPrivmsg(self, irc, msg):
+                pass
+            def do376(self, irc, msg):
+                pass
+        self.assertEqual(Dispatcher().handledCommands(),
+                         frozenset(['PRIVMSG', '376']))
+        class Declared(irclib.IrcCallback):
+            handles = ('join',)
+        self.assertEqual(Declared().handledCommands(), frozenset(['JOIN']))
+        class Overrider(Dispatcher):
+            def __call__(self, irc, msg):
+                pass
+        self.assertEqual(Overrider().handledCommands(), None)
+        class Inheritor(Overrider):
+            def doJoin(self, irc, msg):
+                pass
+        self.assertEqual(Inheritor().handledCommands(), None)
+
+    def testFeedMsgOnlyCallsHandlingCallbacks(self):
+        class Catcher(irclib.IrcCallback):
+            def __init__(self):
+                self.L = []
+            def doPrivmsg(self, irc, msg):
+                self.L.append(msg)
+        class CatchAll(irclib.IrcCallback):
+            def __init__(self):
+                self.L = []
+            def __call__(self, irc, msg):
+                self.L.append(msg)
+        irc = irclib.Irc('test', callbacks=[])
+        catcher = Catcher()
+        catchAll = CatchAll()
+        irc.addCallback(catcher)
+        irc.addCallback(catchAll)
+        self.assertEqual(set(irc.callbacksFor('PRIVMSG')),
+                         set([catcher, catchAll]))
+        self.assertEqual(irc.callbacksFor('JOIN'), [catchAll])
+        privmsg = ircmsgs.privmsg('#foo', 'bar', prefix='foo!bar@baz')
+        join = ircmsgs.join('#foo', prefix='foo!bar@baz')
+        irc.feedMsg(privmsg)
+        irc.feedMsg(join)
+        self.assertEqual(catcher.L, [privmsg])
+        self.assertEqual(catchAll.L, [privmsg, join])
+        self.failIf(privmsg.senderIgnored)
+        irc.removeCallback('Catcher')
+        self.assertEqual(irc.callbacksFor('PRIVMSG'), [catchAll])
+        irc._reallyDie()
+
     def testFirstCommands(self):
         try:
             originalNick = conf.supybot.nick()
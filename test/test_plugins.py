@@ -32,3 +32,84 @@ from supybot.test import *
 
 import supybot.irclib as irclib
 import supybot.plugins as plugins
+
+
+class ChannelUserDBTestCase(SupyTestCase):
+    class DB(plugins.ChannelUserDB):
+        def serialize(self, v):
+            return list(v)
+
+        def deserialize(self, channel, id, L):
+            return L
+
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.filename = conf.supybot.directories.data.dirize('ChannelUserDB')
+        self.journal = self.filename + '.journal'
+        for filename in (self.filename, self.journal):
+            if os.path.exists(filename):
+                os.remove(filename)
+        self.journaled = conf.supybot.databases.types.journal()
+        self.maxmods = \
+            conf.supybot.databases.types.journal.maximumModifications()
+
+    def tearDown(self):
+        conf.supybot.databases.types.journal.setValue(self.journaled)
+        conf.supybot.databases.types.journal.maximumModifications.setValue(
+            self.maxmods)
+        SupyTestCase.tearDown(self)
+
+    def testFlushOnlyWritesChanges(self):
+        conf.supybot.databases.types.journal.setValue(False)
+        db = self.DB(self.filename)
+        db['#foo', 1] = ['bar']
+        db.flush()
+        self.failUnless(os.path.exists(self.filename))
+        os.remove(self.filename)
+        db.flush()
+        self.failIf(os.path.exists(self.filename))
+        self.assertEqual(db['#FOO', 1], ['bar'])
+        db.flush()
+        self.failIf(os.path.exists(self.filename))
+        db['#foo', 1].append('baz')
+        db['#foo', 2] = ['qux']
+        db.flush()
+        db = self.DB(self.filename)
+        self.assertEqual(db['#foo', 1], ['bar', 'baz'])
+        self.assertEqual(db['#foo', 2], ['qux'])
+        del db['#foo', 2]
+        db.flush()
+        db = self.DB(self.filename)
+        self.failIf(('#foo', 2) in db)
+        self.assertEqual(db.items(), [(('#foo', 1), ['bar', 'baz'])])
+
+    def testJournal(self):
+        conf.supybot.databases.types.journal.maximumModifications.setValue(1)
+        db = self.DB(self.filename)
+        db['#foo', 1] = ['bar']
+        db['#foo', 2] = ['baz']
+        db['#foo', 3] = ['qux']
+        db.flush()
+        self.failIf(os.path.exists(self.filename))
+        self.failUnless(os.path.exists(self.journal))
+        self.assertEqual(sorted(self.DB(self.filename).items()),
+                         sorted(db.items()))
+        db['#foo', 1].append('quux')
+        db.flush() # 4 journal entries for 3 records; time to compact.
+        db._waitForCompaction()
+        self.failUnless(os.path.exists(self.filename))
+        self.failIf(os.path.exists(self.journal))
+        self.failIf(os.path.exists(self.journal + '.old'))
+        self.assertEqual(self.DB(self.filename)['#foo', 1], ['bar', 'quux'])
+        del db['#foo', 2]
+        db.flush()
+        self.failUnless(os.path.exists(self.journal))
+        self.failIf(('#foo', 2) in self.DB(self.filename))
+        db.close()
+        self.failIf(os.path.exists(self.journal))
+        self.assertEqual(sorted(self.DB(self.filename).items()),
+                         [(('#foo', 1), ['bar', 'quux']),
+                          (('#foo', 3), ['qux'])])
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
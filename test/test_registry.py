@@ -174,4 +174,20 @@ class ValuesTestCase(SupyTestCase):
         registry.open(filename)
         self.assertEqual(conf.supybot.reply.whenAddressedBy.chars(), '\\')
 
+    def testCloseOnlyWritesChanges(self):
+        filename = conf.supybot.directories.conf.dirize('close.conf')
+        registry.close(conf.supybot, filename)
+        ino = os.stat(filename).st_ino
+        registry.close(conf.supybot, filename)
+        self.assertEqual(os.stat(filename).st_ino, ino)
+        fd = file(filename, 'a')
+        fd.write('supybot.nick: edited\n')
+        fd.close()
+        registry.close(conf.supybot, filename)
+        fd = file(filename)
+        try:
+            self.failIf('edited' in fd.read())
+        finally:
+            fd.close()
+
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -73,6 +73,44 @@ class TestSchedule(SupyTestCase):
         sched.run()
         self.assertEqual(i[0], 1)
 
+    def testSameTimeRunsInOrderAdded(self):
+        sched = schedule.Schedule()
+        L = []
+        t = time.time() - 1
+        for x in range(10):
+            sched.addEvent(lambda x=x: L.append(x), t)
+        sched.run()
+        self.assertEqual(L, range(10))
+
+    def testRemoveMany(self):
+        sched = schedule.Schedule()
+        L = []
+        now = time.time()
+        names = [sched.addEvent(lambda x=x: L.append(x), now - 1000 + x)
+                 for x in range(1000)]
+        for name in names[:600:2] + names[600:]:
+            sched.removeEvent(name)
+        self.failUnless(len(sched.schedule) < 1000)
+        self.assertRaises(KeyError, sched.removeEvent, names[0])
+        sched.rescheduleEvent(names[1], now - 2000)
+        sched.run()
+        self.assertEqual(L, [1] + range(3, 600, 2))
+        self.assertEqual(sched.schedule, [])
+        self.assertEqual(sched.events, {})
+
+    def testRemoveWhileRunning(self):
+        sched = schedule.Schedule()
+        L = []
+        def remove():
+            L.append('remove')
+            sched.removeEvent('later')
+        t = time.time() - 1
+        sched.addEvent(remove, t)
+        sched.addEvent(lambda: L.append('later'), t, 'later')
+        sched.run()
+        self.assertEqual(L, ['remove'])
+        self.failIf(sched.schedule)
+
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
 
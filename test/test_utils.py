@@ -30,8 +30,15 @@
 
 from supybot.test import *
 
+import os
+import gzip
 import time
 import pickle
+import urllib2
+import threading
+import cStringIO
+import SocketServer
+import BaseHTTPServer
 import supybot.utils as utils
 from supybot.utils.structures import *
 
@@ -510,16 +517,185 @@ class NetTest(SupyTestCase):
         self.failUnless(f('2001::'))
         self.failUnless(f('2001:888:0:1::666'))
 
+class WebHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.server.requests += 1
+        self.server.path = self.path
+        headers = {}
+        body = 'page %s' % self.server.requests
+        if self.path == '/cached':
+            headers['Cache-Control'] = 'max-age=60'
+        elif self.path == '/expired':
+            headers['Expires'] = 'Thu, 01 Jan 1970 00:00:00 GMT'
+        elif self.path == '/redirect':
+            self.send_response(302)
+            self.send_header('Location', '/cached')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        elif self.path == '/gzip':
+            assert 'gzip' in self.headers.get('Accept-Encoding', '')
+            fd = cStringIO.StringIO()
+            zipped = gzip.GzipFile(fileobj=fd, mode='wb')
+            zipped.write(body)
+            zipped.close()
+            body = fd.getvalue()
+            headers['Content-Encoding'] = 'gzip'
+        elif self.path == '/missing':
+            self.send_error(404)
+            return
+        self.send_response(200)
+        headers['Content-Length'] = str(len(body))
+        for (name, value) in headers.iteritems():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class WebServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
 class WebTest(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.server = WebServer(('127.0.0.1', 0), WebHandler)
+        self.server.connections = 0
+        self.server.requests = 0
+        t = threading.Thread(target=self.server.serve_forever)
+        t.setDaemon(True)
+        t.start()
+        self.url = 'http://127.0.0.1:%s' % self.server.server_port
+        self.client = utils.web.HttpClient(cacheSize=10)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        SupyTestCase.tearDown(self)
+
+    def get(self, path, size=None):
+        fd = self.client.open(self.url + path)
+        try:
+            return fd.read(size)
+        finally:
+            fd.close()
+
     def testGetDomain(self):
         url = 'http://slashdot.org/foo/bar.exe'
         self.assertEqual(utils.web.getDomain(url), 'slashdot.org')
 
+    def testKeepAlive(self):
+        self.assertEqual(self.get('/'), 'page 1')
+        self.assertEqual(self.get('/'), 'page 2')
+        self.assertEqual(self.get('/other'), 'page 3')
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(self.client.connections, 1)
+
+    def testPartialReadClosesConnection(self):
+        self.assertEqual(self.get('/', 2), 'pa')
+        self.assertEqual(self.get('/'), 'page 2')
+        self.assertEqual(self.server.connections, 2)
+
+    def testStaleConnectionIsRetried(self):
+        self.assertEqual(self.get('/'), 'page 1')
+        for (conn, _) in self.client.idle.values()[0]:
+            conn.sock.close()
+        self.assertEqual(self.get('/'), 'page 2')
+
+    def testCache(self):
+        self.assertEqual(self.get('/cached'), 'page 1')
+        self.assertEqual(self.get('/cached'), 'page 1')
+        self.assertEqual(self.client.cacheHits, 1)
+        self.assertEqual(self.get('/expired'), 'page 2')
+        self.assertEqual(self.get('/expired'), 'page 3')
+        self.assertEqual(self.get('/'), 'page 4')
+        self.assertEqual(self.get('/'), 'page 5')
+        self.assertEqual(self.server.requests, 5)
+        self.client.cacheSize = 0
+        self.assertEqual(self.get('/cached'), 'page 6')
+
+    def testGzip(self):
+        fd = self.client.open(self.url + '/gzip')
+        self.assertEqual(fd.read(), 'page 1')
+        self.failIf('content-encoding' in fd.headers)
+        # That was the compressed length, not the length of what we read.
+        self.failIf('content-length' in fd.headers)
+        fd.close()
+
+    def testRedirect(self):
+        fd = self.client.open(self.url + '/redirect')
+        self.assertEqual(fd.read(), 'page 2')
+        self.assertEqual(fd.geturl(), self.url + '/cached')
+        fd.close()
+        self.assertEqual(self.server.connections, 1)
+
+    def testErrors(self):
+        self.assertRaises(utils.web.Error, self.client.open,
+                          self.url + '/missing')
+        self.assertEqual(self.get('/'), 'page 2')
+
+    def testGetUrlUsesClient(self):
+        originalClient = utils.web.client
+        utils.web.client = self.client
+        try:
+            self.assertEqual(utils.web.getUrl(self.url + '/'), 'page 1')
+            self.assertEqual(utils.web.getUrl(self.url + '/', 2), 'pa')
+            self.assertRaises(utils.web.Error, utils.web.getUrl,
+                              self.url + '/missing')
+        finally:
+            utils.web.client = originalClient
+        self.assertEqual(self.client.connections, 2)
+
+    def testGetUrlHonorsEnvironmentProxy(self):
+        originalClient = utils.web.client
+        originalEnviron = os.environ.copy()
+        # urllib2 reads the environment when it builds its default opener.
+        originalOpener = urllib2._opener
+        utils.web.client = self.client
+        os.environ['http_proxy'] = self.url
+        os.environ['no_proxy'] = 'localhost'
+        urllib2._opener = None
+        try:
+            url = 'http://example.invalid/'
+            self.assertEqual(utils.web.getUrl(url), 'page 1')
+            self.assertEqual(self.server.path, url)
+            self.assertEqual(self.client.connections, 0)
+            os.environ['no_proxy'] = '127.0.0.1'
+            self.assertEqual(utils.web.getUrl(self.url + '/'), 'page 2')
+            self.assertEqual(self.server.path, '/')
+            self.assertEqual(self.client.connections, 1)
+        finally:
+            utils.web.client = originalClient
+            os.environ.clear()
+            os.environ.update(originalEnviron)
+            urllib2._opener = originalOpener
+
     if network:
         def testGetUrlWithSize(self):
             url = 'http://slashdot.org/'
             self.failUnless(len(utils.web.getUrl(url, 1024)) == 1024)
 
+class HistogramTestCase(SupyTestCase):
+    def testPercentiles(self):
+        h = Histogram()
+        self.assertEqual(h.percentile(50), 0)
+        for i in range(1, 1001):
+            h.add(i / 1000.0)
+        h.add(0)
+        self.assertEqual(h.count, 1001)
+        self.assertEqual(h.max, 1.0)
+        for p in (50, 95, 99):
+            self.failUnless(p / 100.0 <= h.percentile(p) <= p / 80.0,
+                            (p, h.percentile(p)))
+        self.assertEqual(h.percentile(100), 1.0)
+
 class FormatTestCase(SupyTestCase):
     def testNormal(self):
         format = utils.str.format
@@ -0,0 +1,117 @@
+###
+# Copyright (c) 2026, Kefkius
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+from supybot.test import *
+
+import time
+import threading
+
+import supybot.world as world
+
+class ExecutorTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.release = threading.Event()
+        self.lock = threading.Lock()
+        self.started = []
+
+    def tearDown(self):
+        self.release.set()
+        SupyTestCase.tearDown(self)
+
+    def task(self, x):
+        self.lock.acquire()
+        try:
+            self.started.append((x, threading.currentThread().getName()))
+        finally:
+            self.lock.release()
+        self.release.wait(5)
+
+    def waitFor(self, f, timeout=5):
+        timeout += time.time()
+        while not f() and time.time() < timeout:
+            time.sleep(0.01)
+        self.failUnless(f())
+
+    def testLimits(self):
+        executor = world.Executor(3, 2, 3)
+        spawned = world.threadsSpawned
+        for x in range(4):
+            self.failUnless(executor.submit(self.task, (x,), group='a'))
+        self.failUnless(executor.submit(self.task, ('b',), group='b'))
+        self.waitFor(lambda: len(self.started) == 3)
+        self.assertEqual(sorted([x for (x, _) in self.started]), [0, 1, 'b'])
+        self.assertEqual(world.threadsSpawned, spawned + 3)
+        # 2 and 3 are still waiting for one of a's tasks to finish.
+        self.failUnless(executor.submit(self.task, ('c',), group='c'))
+        self.failIf(executor.submit(self.task, ('d',), group='d'))
+        self.release.set()
+        self.waitFor(lambda: len(self.started) == 6)
+        self.assertEqual(executor.workers, 3)
+        self.assertEqual(world.threadsSpawned, spawned + 3)
+
+    def testBurstWithIdleWorker(self):
+        executor = world.Executor(3, 3, 3)
+        self.release.set()
+        executor.submit(self.task, (0,))
+        self.waitFor(lambda: executor.idle == 1)
+        self.release.clear()
+        for x in range(1, 4):
+            self.failUnless(executor.submit(self.task, (x,)))
+        # The idle worker only takes one of them; the rest get new workers.
+        self.waitFor(lambda: len(self.started) == 4)
+        self.assertEqual(executor.workers, 3)
+
+    def testNaming(self):
+        executor = world.Executor(1, 1, 1)
+        self.release.set()
+        executor.submit(self.task, (1,), name='Foo.bar')
+        self.waitFor(lambda: self.started)
+        self.failUnless(self.started[0][1].startswith('Thread #'))
+        self.failUnless(self.started[0][1].endswith('(for Foo.bar)'))
+
+    def testIdleThreadsExit(self):
+        executor = world.Executor(1, 1, 1, idleTimeout=0.1)
+        self.release.set()
+        executor.submit(self.task, (1,))
+        self.waitFor(lambda: self.started and not executor.workers)
+        executor.submit(self.task, (2,))
+        self.waitFor(lambda: len(self.started) == 2)
+
+    def testStop(self):
+        executor = world.Executor(2, 2, 2)
+        self.release.set()
+        executor.submit(self.task, (1,))
+        self.waitFor(lambda: self.started)
+        executor.stop()
+        self.assertEqual(executor.workers, 0)
+        self.failIf(executor.submit(self.task, (2,)))
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79: